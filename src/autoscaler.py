@@ -0,0 +1,167 @@
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from pydantic import BaseModel
+
+from machine_manager import MachineManager, StartLintersRequest
+
+
+# Limits and target of autoscaling of one linter, the current version of the linter is scaled
+class AutoscalingPolicy(BaseModel):
+    linter_name: str
+    min_instances: int = 1
+    max_instances: int = 10
+    # lints one instance runs at once, linter_server.py has 10 worker threads
+    instance_concurrency: int = 10
+    # fraction of instance_concurrency which should be busy
+    target_utilization: float = 0.7
+    # seconds since the last scaling before scaling up or down again
+    scale_up_cooldown: float = 30
+    scale_down_cooldown: float = 300
+    # seconds lints in flight on instances removed by a scale-down get to finish before their containers are stopped
+    scale_down_drain: float = 30
+
+
+# What the autoscaler saw in its last step
+class AutoscalingStatus(BaseModel):
+    linter_name: str
+    linter_version: str
+    n_instances: int
+    # lints per second since the previous step
+    request_rate: float
+    mean_latency: float
+    in_flight: int
+    desired_instances: int
+
+
+# Periodically compares load reported by load balancer with the capacity of running instances,
+# starts and stops instances to keep utilization at the target.
+class Autoscaler:
+    def __init__(self, machine_manager: MachineManager, load_report_source: Callable[[], List[dict]],
+                 interval: float = 10, clock: Callable[[], float] = time.monotonic):
+        self.machine_manager = machine_manager
+        # returns LinterLoadTracker.report() of load balancer
+        self.load_report_source = load_report_source
+        self.interval = interval
+        self.clock = clock
+
+        self.policies: Dict[str, AutoscalingPolicy] = {}
+        self.statuses: Dict[str, AutoscalingStatus] = {}
+        # (linter_name, linter_version) -> (time, n_requests, latency_sum) from the previous report
+        self.previous_loads: Dict[Tuple[str, str], Tuple[float, int, float]] = {}
+        # linter_name -> time of the last scaling
+        self.last_scaled: Dict[str, float] = {}
+        # linter_name -> id of the start operation of the last scale-up
+        self.scale_up_operations: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def set_policy(self, policy: AutoscalingPolicy):
+        with self.lock:
+            self.policies[policy.linter_name] = policy
+        logging.info(f"Autoscaling {policy.linter_name} between {policy.min_instances} and "
+                     f"{policy.max_instances} instances")
+
+    def remove_policy(self, linter_name: str):
+        with self.lock:
+            self.policies.pop(linter_name, None)
+            self.statuses.pop(linter_name, None)
+
+    def get_policies(self) -> List[AutoscalingPolicy]:
+        with self.lock:
+            return list(self.policies.values())
+
+    def get_statuses(self) -> List[AutoscalingStatus]:
+        with self.lock:
+            return list(self.statuses.values())
+
+    @staticmethod
+    def desired_instances(policy: AutoscalingPolicy, request_rate: float, mean_latency: float,
+                          in_flight: int) -> int:
+        # lints in progress on average (Little's law), lints waiting in queues show up in in_flight
+        demand = max(request_rate * mean_latency, in_flight)
+        desired = math.ceil(demand / (policy.instance_concurrency * policy.target_utilization))
+        return min(policy.max_instances, max(policy.min_instances, desired))
+
+    def step(self):
+        """Read the load report and scale every linter with a policy"""
+        policies = self.get_policies()
+        if not policies:
+            # load balancer is not asked for a report nobody reads
+            return
+        now = self.clock()
+        loads = {(load["linter_name"], load["linter_version"]): load for load in self.load_report_source()}
+        for policy in policies:
+            try:
+                self.scale(policy, loads, now)
+            except Exception:
+                logging.exception(f"Could not autoscale {policy.linter_name}")
+
+    def scale(self, policy: AutoscalingPolicy, loads: Dict[Tuple[str, str], dict], now: float):
+        linter_name = policy.linter_name
+        linter_version = self.machine_manager.get_curr_version(linter_name)
+        if linter_version is None:
+            # nothing was started yet, so there is no version to scale
+            return
+
+        request_rate, mean_latency, in_flight = self.measure(linter_name, linter_version,
+                                                             loads.get((linter_name, linter_version)), now)
+        n_instances = self.machine_manager.count_linter_instances(linter_name, linter_version)
+        desired = self.desired_instances(policy, request_rate, mean_latency, in_flight)
+        with self.lock:
+            self.statuses[linter_name] = AutoscalingStatus(linter_name=linter_name, linter_version=linter_version,
+                                                           n_instances=n_instances, request_rate=request_rate,
+                                                           mean_latency=mean_latency, in_flight=in_flight,
+                                                           desired_instances=desired)
+
+        # instances of the previous scale-up are not counted until they start
+        operation_id = self.scale_up_operations.get(linter_name)
+        if operation_id is not None:
+            operation = self.machine_manager.get_start_operation(operation_id)
+            if operation is not None and not operation.done:
+                return
+            self.scale_up_operations.pop(linter_name)
+
+        since_last_scaled = now - self.last_scaled.get(linter_name, -math.inf)
+        if desired > n_instances and since_last_scaled >= policy.scale_up_cooldown:
+            logging.info(f"Autoscaling {linter_name} v {linter_version} up from {n_instances} to {desired} instances")
+            operation = self.machine_manager.start_linters(StartLintersRequest(
+                linter_name=linter_name, linter_version=linter_version, n_instances=desired - n_instances))
+            self.scale_up_operations[linter_name] = operation.operation_id
+            self.last_scaled[linter_name] = now
+        elif desired < n_instances and since_last_scaled >= policy.scale_down_cooldown:
+            logging.info(f"Autoscaling {linter_name} v {linter_version} down from {n_instances} to {desired} instances")
+            self.machine_manager.stop_linter_instances(linter_name, linter_version, n_instances - desired,
+                                                       drain_seconds=policy.scale_down_drain)
+            self.last_scaled[linter_name] = now
+
+    # request rate and mean latency since the previous report and lints in flight
+    def measure(self, linter_name: str, linter_version: str, load: dict | None,
+                now: float) -> Tuple[float, float, int]:
+        if load is None:
+            return 0.0, 0.0, 0
+
+        previous = self.previous_loads.get((linter_name, linter_version))
+        self.previous_loads[linter_name, linter_version] = (now, load["n_requests"], load["latency_sum"])
+        if previous is None or load["n_requests"] < previous[1] or now <= previous[0]:
+            # first report or load balancer restarted, only lints in flight are known
+            return 0.0, 0.0, load["in_flight"]
+
+        previous_time, previous_n_requests, previous_latency_sum = previous
+        n_requests = load["n_requests"] - previous_n_requests
+        request_rate = n_requests / (now - previous_time)
+        mean_latency = (load["latency_sum"] - previous_latency_sum) / n_requests if n_requests > 0 else 0.0
+        return request_rate, mean_latency, load["in_flight"]
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.step()
+            except Exception as exc:
+                logging.warning(f"Autoscaler could not read load report: {exc}")
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import threading
+import time
+
+import grpc
+
+import linter_pb2
+import linter_pb2_grpc
+from linter_client import AsyncLinterClient, LinterClient
+from load_balancer import LoadBalancer, RoundRobinStrategy
+
+# Compares lint throughput of the load balancer when the linter call blocks the event loop (how lint_code_endpoint
+# worked before) with the grpc.aio path. Linters are fake in-process servers which sleep instead of linting.
+# Run from the src directory: python3 benchmark_async_lint.py
+
+
+class SleepingLinter(linter_pb2_grpc.LinterServicer):
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def LintCode(self, request, context):
+        await asyncio.sleep(self.delay)
+        return linter_pb2.LintingResult(status=0, comment="CORRECT")
+
+
+# servers stop when garbage collected
+servers = []
+
+
+def start_linter_servers(n_linters, delay):
+    """Start linter servers on a separate event loop, return their host_ports"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def start_server():
+        server = grpc.aio.server()
+        linter_pb2_grpc.add_LinterServicer_to_server(SleepingLinter(delay), server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        servers.append(server)
+        return f"127.0.0.1:{port}"
+
+    return [asyncio.run_coroutine_threadsafe(start_server(), loop).result() for _ in range(n_linters)]
+
+
+# reproduces the old behaviour: blocking linter call made from the async endpoint
+class BlockingLinterClient:
+    def __init__(self):
+        self.linter_client = LinterClient()
+        self.channel_pool = self.linter_client.channel_pool
+
+    async def lint_code(self, host_port, code, trace_context=None, linter_name="", linter_version=""):
+        return self.linter_client.lint_code(host_port, code, trace_context=trace_context, linter_name=linter_name,
+                                            linter_version=linter_version)
+
+
+async def measure_throughput(linter_client, host_ports, n_requests, concurrency):
+    load_balancer = LoadBalancer(RoundRobinStrategy(), machine_management_client=None, linter_client=linter_client)
+    load_balancer.update_routing_table(0, {"bench": "v0"},
+                                       [{"name": "bench", "version": "v0", "hostport": host_port}
+                                        for host_port in host_ports])
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # every code is different, so that lints are neither cached nor coalesced by load balancer
+    async def lint(code):
+        async with semaphore:
+            return await load_balancer.lint_code("bench", code)
+
+    # warm up channels
+    await asyncio.gather(*[lint(f"warm_up = {i}") for i in range(len(host_ports))])
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[lint(f"x = {i}") for i in range(n_requests)])
+    elapsed = time.perf_counter() - start
+
+    assert all(status_code == 0 for status_code, _ in results)
+    return n_requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--n_requests', type=int, default=2000)
+    parser.add_argument('-c', '--concurrency', type=int, default=1000)
+    parser.add_argument('-l', '--n_linters', type=int, default=4)
+    parser.add_argument('-d', '--linter_delay', type=float, default=0.01, help="seconds spent in each lint")
+    parsed_args = parser.parse_args()
+
+    host_ports = start_linter_servers(parsed_args.n_linters, parsed_args.linter_delay)
+
+    # the blocking path handles one lint at a time, so it gets fewer requests to keep the run short
+    n_sync_requests = min(parsed_args.n_requests, 200)
+    sync_throughput = asyncio.run(
+        measure_throughput(BlockingLinterClient(), host_ports, n_sync_requests, parsed_args.concurrency))
+    async_throughput = asyncio.run(
+        measure_throughput(AsyncLinterClient(), host_ports, parsed_args.n_requests, parsed_args.concurrency))
+
+    print(f"{parsed_args.n_linters} linters, {parsed_args.linter_delay * 1000:.1f} ms per lint, "
+          f"up to {parsed_args.concurrency} lints in flight")
+    print(f"blocking: {sync_throughput:10.1f} lints/s")
+    print(f"async:    {async_throughput:10.1f} lints/s ({async_throughput / sync_throughput:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+from container_manager import LINTER_DIR
+
+sys.path.append(LINTER_DIR)
+from linter_server import load_implementation  # noqa: E402
+
+# Speed of every implementation in linter/implementations on generated Python code, one linter instance, no gRPC.
+# Inputs:
+# - plain: assignments and arithmetic only, no linter finds anything, so every linter reads all of the code
+# - python: also comments, docstrings and strings with semicolons and "=" in them, and comparisons; only linters
+#   which know about them (no_semicolons v3, spaces_around_equals v2) read all of it, the rest stop early
+# - dirty: python with a semicolon and an "=" without spaces every few lines; v0-v2 stop at the first violation,
+#   scanning linters find all of them, up to ScanningLinter.max_violations
+# Then the same for lint sessions, which lint the dirty input again after a line in the middle is edited, and after
+# a docstring is opened at the top, which changes all lines after it.
+# Run from the src directory: python3 benchmark_linters.py
+
+PLAIN_LINES = ['value_{i} = argument + {i}\n',
+               'other = value_{i} * 2 - other\n',
+               '\n']
+PYTHON_LINES = ['def function_{i}(argument, other):\n',
+                '    """Docstring; with a semicolon and a = sign"""\n',
+                '    value = argument + {i}  # comment; with a semicolon\n',
+                '    if value == other and value != {i}:\n',
+                '        value += len("string; with=signs")\n',
+                '    return value\n',
+                '\n']
+DIRTY_LINES = ['    value=1; other = 2\n']
+
+
+def make_code(code_size, lines_template, dirty_every=0):
+    lines = []
+    size = 0
+    while size < code_size:
+        for line in lines_template:
+            lines.append(line.format(i=len(lines)))
+            size += len(lines[-1])
+        if dirty_every and len(lines) % dirty_every < len(lines_template):
+            lines += DIRTY_LINES
+    return "".join(lines)
+
+
+def measure(linter, code, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        status, _, violations = linter.lint(code)
+        best = min(best, time.perf_counter() - start)
+    return best, status, len(violations)
+
+
+def measure_session_edit(linter, code, start_line, lines, repeats):
+    session = linter.start_session(code)
+    best = float("inf")
+    for _ in range(repeats):
+        old_lines = session.lines[start_line:start_line + 1]
+        start = time.perf_counter()
+        session.edit(start_line, start_line + 1, lines)
+        session.lint()
+        best = min(best, time.perf_counter() - start)
+        session.edit(start_line, start_line + 1, old_lines)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--code_size', type=int, default=1024 * 1024, help="bytes of code")
+    parser.add_argument('-dirty', '--dirty_every', type=int, default=20, help="lines between violations")
+    parser.add_argument('-r', '--repeats', type=int, default=3, help="the fastest run is reported")
+    parsed_args = parser.parse_args()
+
+    inputs = {"plain": make_code(parsed_args.code_size, PLAIN_LINES),
+              "python": make_code(parsed_args.code_size, PYTHON_LINES),
+              "dirty": make_code(parsed_args.code_size, PYTHON_LINES, parsed_args.dirty_every)}
+    print(f"{'implementation':<38}{'input':>7}{'ms':>10}{'MB/s':>8}{'status':>8}{'violations':>12}")
+    for path in sorted(glob.glob(os.path.join(LINTER_DIR, "implementations", "*.py"))):
+        linter = load_implementation(path)
+        for input_name, code in inputs.items():
+            name = os.path.basename(path)[:-len(".py")]
+            try:
+                seconds, status, n_violations = measure(linter, code, parsed_args.repeats)
+            except Exception as exc:
+                print(f"{name:<38}{input_name:>7}  fails with {type(exc).__name__}: {exc}")
+                continue
+            print(f"{name:<38}{input_name:>7}{seconds * 1000:>10.1f}{len(code) / seconds / 1e6:>8.1f}"
+                  f"{status:>8}{n_violations:>12}")
+
+    print(f"\n{'implementation':<38}{'edit ms':>10}{'docstring ms':>14}")
+    code = inputs["dirty"]
+    middle = code.count("\n") // 2
+    for path in sorted(glob.glob(os.path.join(LINTER_DIR, "implementations", "*.py"))):
+        linter = load_implementation(path)
+        name = os.path.basename(path)[:-len(".py")]
+        try:
+            edit_seconds = measure_session_edit(linter, code, middle, ["    value=1; other = 2"], parsed_args.repeats)
+            docstring_seconds = measure_session_edit(linter, code, 0, ['"""'], parsed_args.repeats)
+        except Exception as exc:
+            print(f"{name:<38}  fails with {type(exc).__name__}: {exc}")
+            continue
+        print(f"{name:<38}{edit_seconds * 1000:>10.2f}{docstring_seconds * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent import futures
+
+import httpx
+import requests
+import uvicorn
+
+import load_balancer_app
+import machine_management_app
+from container_manager import ContainerManager, LINTER_DIR, LocalProcessContainerManager, implementations_by_image
+from linter_client import AsyncLinterClient
+from load_balancer import MachineManagementClient
+from machine_manager import LoadBalancerClient
+
+sys.path.append(LINTER_DIR)
+from linter_server import start_server  # noqa: E402
+
+# Load test of the whole lint path without Docker or ssh: real load balancer and machine management apps served by
+# uvicorn on localhost, containers replaced by gRPC linter servers in this process, hosting implementations from
+# linter/implementations like the images built by build_images.sh.
+# Load is open-loop: lints are sent at Poisson arrival times no matter how many are still waiting, and latency
+# counts from the planned send time, so a slow system cannot hide its queueing by slowing the load down.
+# The load generator runs in its own process, but the apps and linters share this one, so absolute numbers are
+# lower than on a cluster and are only comparable between runs on the same machine. With -cm local every linter
+# is a process of its own, see LocalProcessContainerManager.
+# Run from the src directory: python3 benchmark_load.py -o results.json, then with -baseline results.json to compare.
+
+LINTER_NAME = "no_semicolons"
+LINTER_VERSION = "v1"
+LINTER_IMAGE = "ghcr.io/chedatomasz/no_semicolons:v1"
+
+
+# Linter "containers" are gRPC servers in this process, configured like linter_server.py
+class InProcessContainerManager(ContainerManager):
+    def __init__(self, machine):
+        self.machine = machine
+        self.implementations = implementations_by_image()
+        self.servers = {}
+        self.lock = threading.Lock()
+        # servers are asyncio ones, all of them run on this loop
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def start_container(self, docker_image):
+        server, port = asyncio.run_coroutine_threadsafe(
+            start_server(0, self.implementations[docker_image], host=self.machine), self.loop).result()
+
+        container_name = str(uuid.uuid4())
+        with self.lock:
+            self.servers[container_name] = server
+        return port, container_name
+
+    def stop_container(self, container_name):
+        with self.lock:
+            server = self.servers.pop(container_name)
+        asyncio.run_coroutine_threadsafe(server.stop(None), self.loop).result()
+
+
+CONTAINER_MANAGERS = {"in_process": InProcessContainerManager,
+                      "local": LocalProcessContainerManager}
+
+
+class AppServer:
+    def __init__(self, app, port):
+        # failed lints are counted as errors, e.g. those sent before load balancer has the routing table
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="critical"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+# code of about code_size bytes without semicolons
+def make_code(code_size):
+    lines = []
+    size = 0
+    while size < code_size:
+        lines.append(f"value_{len(lines)} = {len(lines)} + 1  # no semicolons here\n")
+        size += len(lines[-1])
+    return "".join(lines)
+
+
+async def open_loop(load_balancer_url, rate, warmup, duration, code, seed):
+    rng = random.Random(seed)
+    loop = asyncio.get_running_loop()
+    # (planned send time and finish time since the start, latency or None for a failed lint)
+    results = []
+
+    async def send(client, planned, number):
+        # every lint is different, so that the lint cache of load balancer does not answer it
+        request = {"linter_name": LINTER_NAME, "code": f"# lint {seed} {number}\n{code}"}
+        try:
+            response = await client.post(f"{load_balancer_url}/lint_code/", json=request)
+            success = response.status_code == 200 and response.json()["message"] != "linter error"
+        except httpx.HTTPError:
+            success = False
+        finished = loop.time()
+        results.append((planned - start, finished - start, finished - planned if success else None))
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=1000)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        start = loop.time()
+        planned = start
+        tasks = []
+        while True:
+            planned += rng.expovariate(rate)
+            if planned - start > warmup + duration:
+                break
+            await asyncio.sleep(planned - loop.time())
+            tasks.append(asyncio.create_task(send(client, planned, len(tasks))))
+        await asyncio.gather(*tasks)
+
+    # lints planned during the warmup only open connections, times are counted from the end of the warmup
+    return [(finished - warmup, latency) for planned, finished, latency in results if planned >= warmup]
+
+
+def run_load(load_balancer_url, rate, warmup, duration, code_size, seed):
+    return asyncio.run(open_loop(load_balancer_url, rate, warmup, duration, make_code(code_size), seed))
+
+
+def summarize(strategy, rate, code_size, duration, results):
+    latencies = sorted(latency for _, latency in results if latency is not None)
+    last_finished = max((finished for finished, _ in results), default=duration)
+    return {"strategy": strategy, "rate": rate, "code_size": code_size, "sent": len(results),
+            "errors": len(results) - len(latencies),
+            # the load stops after the given duration, but queued lints still finish
+            "throughput": len(latencies) / max(duration, last_finished),
+            "p50": percentile(latencies, 50), "p99": percentile(latencies, 99),
+            "p999": percentile(latencies, 99.9)}
+
+
+def start_linters(machine_management_url, n_instances):
+    requests.post(f"{machine_management_url}/add_machine/", json={"host": "127.0.0.1"}).raise_for_status()
+    requests.post(f"{machine_management_url}/register_linter/",
+                  json={"linter_name": LINTER_NAME, "linter_version": LINTER_VERSION,
+                        "docker_image": LINTER_IMAGE}).raise_for_status()
+    response = requests.post(f"{machine_management_url}/start_linters/",
+                             json={"linter_name": LINTER_NAME, "linter_version": LINTER_VERSION,
+                                   "n_instances": n_instances})
+    while not response.json()["done"]:
+        time.sleep(0.05)
+        response = requests.get(f"{machine_management_url}/start_linters/{response.json()['operation_id']}")
+
+
+# load balancer takes requests once it has the routing table
+def wait_until_routable(load_balancer_url):
+    while True:
+        response = requests.post(f"{load_balancer_url}/lint_code/", json={"linter_name": LINTER_NAME, "code": ""})
+        if response.status_code == 200 and response.json()["message"] != "linter error":
+            return
+        time.sleep(0.05)
+
+
+def compare(baseline, results, tolerance):
+    baseline_results = {(result["strategy"], result["rate"], result["code_size"]): result
+                        for result in baseline["results"]}
+    print(f"compared with the baseline, regressions above {tolerance * 100:.0f}% are marked with !")
+    print(f"{'strategy':<22}{'rate':>8}{'size':>8}{'throughput':>12}{'p50':>9}{'p99':>9}{'p99.9':>9}")
+    n_regressions = 0
+    for result in results:
+        key = (result["strategy"], result["rate"], result["code_size"])
+        if key not in baseline_results:
+            continue
+        changes = []
+        # throughput regresses when it drops, latencies when they grow
+        for metric, sign in [("throughput", -1), ("p50", 1), ("p99", 1), ("p999", 1)]:
+            before, after = baseline_results[key][metric], result[metric]
+            change = (after - before) / before if before else 0.0
+            regression = sign * change > tolerance
+            n_regressions += regression
+            changes.append(f"{change * 100:+.0f}%{'!' if regression else ' '}")
+        print(f"{key[0]:<22}{key[1]:>8.0f}{key[2]:>8}{changes[0]:>12}" + "".join(f"{c:>9}" for c in changes[1:]))
+    return n_regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--n_instances', type=int, default=4)
+    parser.add_argument('-cm', '--container_manager', choices=CONTAINER_MANAGERS.keys(), default="in_process")
+    parser.add_argument('-strategies', '--strategies', nargs="+", choices=load_balancer_app.STRATEGIES.keys(),
+                        default=list(load_balancer_app.STRATEGIES.keys()))
+    parser.add_argument('-rates', '--rates', type=float, nargs="+", default=[50, 200],
+                        help="lints per second")
+    parser.add_argument('-sizes', '--code_sizes', type=int, nargs="+", default=[1000, 20000],
+                        help="bytes of code per lint")
+    parser.add_argument('-d', '--duration', type=float, default=10, help="seconds of measured load")
+    parser.add_argument('-warmup', '--warmup', type=float, default=1, help="seconds of load before measuring")
+    parser.add_argument('-seed', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help="JSON file to save the results in")
+    parser.add_argument('-baseline', '--baseline', default=None, help="JSON file with results to compare with")
+    parser.add_argument('-tolerance', '--tolerance', type=float, default=0.1,
+                        help="relative change counted as a regression")
+    parsed_args = parser.parse_args()
+    # machine management warns about routing table updates sent while no load balancer is up
+    logging.basicConfig(level=logging.ERROR)
+
+    load_balancer_url = f"http://127.0.0.1:{free_port()}"
+    machine_management_url = f"http://127.0.0.1:{free_port()}"
+    machine_management = AppServer(
+        machine_management_app.create_app(LoadBalancerClient(load_balancer_url),
+                                          container_manager_factory=CONTAINER_MANAGERS[parsed_args.container_manager]),
+        int(machine_management_url.rsplit(":", 1)[1]))
+    machine_management.start()
+    start_linters(machine_management_url, parsed_args.n_instances)
+
+    # fork would copy the threads of gRPC servers half way through their work
+    load_generators = futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    print(f"{parsed_args.n_instances} {parsed_args.container_manager} instances of {LINTER_NAME} {LINTER_VERSION}, "
+          f"{parsed_args.duration} s of load per row")
+    print(f"{'strategy':<22}{'rate':>8}{'size':>8}{'sent':>8}{'errors':>8}{'lints/s':>10}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'p99.9 ms':>10}")
+    results = []
+    for strategy in parsed_args.strategies:
+        # a fresh load balancer for every strategy, on the port machine management sends updates to
+        load_balancer = AppServer(
+            load_balancer_app.create_app(load_balancer_app.STRATEGIES[strategy](),
+                                         MachineManagementClient(machine_management_url), AsyncLinterClient()),
+            int(load_balancer_url.rsplit(":", 1)[1]))
+        load_balancer.start()
+        wait_until_routable(load_balancer_url)
+        for rate in parsed_args.rates:
+            for code_size in parsed_args.code_sizes:
+                load = load_generators.submit(run_load, load_balancer_url, rate, parsed_args.warmup,
+                                              parsed_args.duration, code_size, parsed_args.seed).result()
+                result = summarize(strategy, rate, code_size, parsed_args.duration, load)
+                results.append(result)
+                print(f"{strategy:<22}{rate:>8.0f}{code_size:>8}{result['sent']:>8}{result['errors']:>8}"
+                      f"{result['throughput']:>10.1f}{result['p50'] * 1000:>9.2f}{result['p99'] * 1000:>9.2f}"
+                      f"{result['p999'] * 1000:>10.2f}")
+        load_balancer.stop()
+
+    load_generators.shutdown()
+    requests.post(f"{machine_management_url}/remove_linter/",
+                  params={"linter_name": LINTER_NAME, "linter_version": LINTER_VERSION})
+    machine_management.stop()
+
+    if parsed_args.output is not None:
+        with open(parsed_args.output, "w") as output_file:
+            json.dump({"config": vars(parsed_args), "results": results}, output_file, indent=2)
+    if parsed_args.baseline is not None:
+        with open(parsed_args.baseline) as baseline_file:
+            n_regressions = compare(json.load(baseline_file), results, parsed_args.tolerance)
+        sys.exit(1 if n_regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import random
+import time
+
+from machine_manager import LinterRegistry, RunningLinter
+
+# Compares lookups machine manager makes on every request and health check sweep when linter instances are kept in
+# a flat list (how machine manager worked before) and in LinterRegistry.
+# Run from the src directory: python3 benchmark_registry.py
+
+
+# reproduces the old behaviour: linear scans over all running linters
+class LinterList:
+    def __init__(self):
+        self.running_linters = []
+
+    def add(self, linter):
+        self.running_linters.append(linter)
+
+    def remove(self, machine, container_name):
+        removed = [linter for linter in self.running_linters
+                   if linter.machine == machine and linter.container_name == container_name]
+        for linter in removed:
+            self.running_linters.remove(linter)
+        return removed
+
+    def host_ports(self, linter_name, linter_version):
+        return [linter.get_host_port() for linter in self.running_linters if linter.linter_name == linter_name
+                and linter.linter_version == linter_version]
+
+    def at_host_port(self, host_port):
+        return [linter for linter in self.running_linters if linter.get_host_port() == host_port]
+
+
+def make_linters(n_instances, n_machines, n_linters, n_versions):
+    return [RunningLinter(machine=f"machine{i % n_machines}", container_name=f"container{i}",
+                          linter_name=f"linter{i % n_linters}", linter_version=f"v{i // n_linters % n_versions}",
+                          exposed_port=12301 + i // n_machines) for i in range(n_instances)]
+
+
+def measure(registry, linters, n_lookups, n_linters, n_versions):
+    """Returns microseconds per host_ports lookup, per host_port lookup and per stop and start of an instance"""
+    for linter in linters:
+        registry.add(linter)
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    for _ in range(n_lookups):
+        registry.host_ports(f"linter{rng.randrange(n_linters)}", f"v{rng.randrange(n_versions)}")
+    host_ports_time = (time.perf_counter() - start) / n_lookups
+
+    start = time.perf_counter()
+    for _ in range(n_lookups):
+        registry.at_host_port(rng.choice(linters).get_host_port())
+    host_port_time = (time.perf_counter() - start) / n_lookups
+
+    start = time.perf_counter()
+    for _ in range(n_lookups):
+        linter = rng.choice(linters)
+        registry.remove(linter.machine, linter.container_name)
+        registry.add(linter)
+        # the routing table is published after every change
+        registry.host_ports(linter.linter_name, linter.linter_version)
+    restart_time = (time.perf_counter() - start) / n_lookups
+
+    return host_ports_time * 1e6, host_port_time * 1e6, restart_time * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--n_instances', type=int, default=10000)
+    parser.add_argument('-m', '--n_machines', type=int, default=100)
+    parser.add_argument('-l', '--n_linters', type=int, default=10)
+    parser.add_argument('-v', '--n_versions', type=int, default=5)
+    parser.add_argument('-n', '--n_lookups', type=int, default=1000)
+    parsed_args = parser.parse_args()
+
+    linters = make_linters(parsed_args.n_instances, parsed_args.n_machines, parsed_args.n_linters,
+                           parsed_args.n_versions)
+    print(f"{parsed_args.n_instances} instances on {parsed_args.n_machines} machines, "
+          f"{parsed_args.n_linters} linters in {parsed_args.n_versions} versions")
+    print(f"{'':<10}{'host_ports us':>16}{'by host_port us':>18}{'restart us':>14}")
+    for name, registry in [("list", LinterList()), ("registry", LinterRegistry())]:
+        host_ports_time, host_port_time, restart_time = measure(registry, linters, parsed_args.n_lookups,
+                                                                parsed_args.n_linters, parsed_args.n_versions)
+        print(f"{name:<10}{host_ports_time:>16.2f}{host_port_time:>18.2f}{restart_time:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import sys
+
+from benchmark_linters import PYTHON_LINES, make_code, measure
+from container_manager import LINTER_DIR
+
+sys.path.append(LINTER_DIR)
+from linter_base import Rule, ScanningLinter  # noqa: E402
+from linter_server import load_implementation  # noqa: E402
+
+# Cost of every added rule of a scanning linter, when all rules are compiled into one scan (how ScanningLinter
+# works) and when each rule scans the code on its own. Rules are those of the style linter followed by bans of
+# functions, the code is the python input of benchmark_linters.py with a violation every few lines.
+# Run from the src directory: python3 benchmark_rules.py
+
+
+def banned_call_rule(i):
+    return Rule(f"banned_call_{i}", rf"forbidden_{i}\(", f"call of forbidden_{i}", first_chars="f")
+
+
+def make_linter(rules, allowed):
+    class Linter(ScanningLinter):
+        first_chars = " =!<>:"
+        # the whole code is scanned
+        max_violations = float("inf")
+
+        def get_name(self) -> str:
+            return "benchmark"
+
+        def get_version(self) -> str:
+            return "v0"
+
+    Linter.rules = rules
+    Linter.allowed = allowed
+    return Linter()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--code_size', type=int, default=1024 * 1024, help="bytes of code")
+    parser.add_argument('-dirty', '--dirty_every', type=int, default=20, help="lines between violations")
+    parser.add_argument('-n', '--n_rules', type=int, nargs="+", default=[1, 2, 5, 10, 20, 50])
+    parser.add_argument('-r', '--repeats', type=int, default=3, help="the fastest run is reported")
+    parsed_args = parser.parse_args()
+
+    code = make_code(parsed_args.code_size, PYTHON_LINES, parsed_args.dirty_every)
+    style = load_implementation(f"{LINTER_DIR}/implementations/style_linter_v0.py")
+    rules = list(style.rules)
+    rules += [banned_call_rule(i) for i in range(max(parsed_args.n_rules) - len(rules))]
+
+    print(f"{'rules':>6}{'one scan ms':>13}{'ms per rule':>13}{'scan per rule ms':>18}{'ms per rule':>13}"
+          f"{'violations':>12}")
+    first = None
+    for n_rules in parsed_args.n_rules:
+        fused_seconds, _, n_violations = measure(make_linter(rules[:n_rules], style.allowed), code,
+                                                 parsed_args.repeats)
+        separate_seconds = sum(measure(make_linter([rule], style.allowed), code, parsed_args.repeats)[0]
+                               for rule in rules[:n_rules])
+        if first is None:
+            first = n_rules, fused_seconds, separate_seconds
+        # cost of each rule added since the first row
+        n_added = max(1, n_rules - first[0])
+        print(f"{n_rules:>6}{fused_seconds * 1000:>13.1f}{(fused_seconds - first[1]) / n_added * 1000:>13.2f}"
+              f"{separate_seconds * 1000:>18.1f}{(separate_seconds - first[2]) / n_added * 1000:>13.2f}"
+              f"{n_violations:>12}")
+
+
+if __name__ == "__main__":
+    main()
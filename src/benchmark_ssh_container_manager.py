@@ -0,0 +1,48 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from container_manager import SSHContainerManager
+
+# Measures how many container operations per second a single machine handles with a fresh ssh connection per
+# command and with the multiplexed connection. The operation is `docker ps`, which is what every start and stop
+# costs apart from docker itself. Needs passwordless ssh to the machine.
+# Run from the src directory: python3 benchmark_ssh_container_manager.py -m user@host
+
+
+def measure_ops_per_second(container_manager, n_operations, concurrency):
+    def operation(_):
+        container_manager._ssh("docker ps -q > /dev/null").check_returncode()
+
+    # the first command opens the shared connection
+    operation(None)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(operation, range(n_operations)))
+    return n_operations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--machine', type=str, required=True, help="ssh destination, e.g. user@host")
+    parser.add_argument('-n', '--n_operations', type=int, default=50)
+    parser.add_argument('-c', '--concurrency', type=int, default=4,
+                        help="operations in flight, sshd allows 10 sessions per connection by default")
+    parsed_args = parser.parse_args()
+
+    print(f"{parsed_args.machine}, {parsed_args.n_operations} operations, {parsed_args.concurrency} in flight")
+    results = {}
+    for name, multiplex in [("ssh per operation", False), ("multiplexed", True)]:
+        container_manager = SSHContainerManager(parsed_args.machine, multiplex=multiplex)
+        try:
+            results[name] = measure_ops_per_second(container_manager, parsed_args.n_operations,
+                                                   parsed_args.concurrency)
+        finally:
+            container_manager.close()
+        print(f"{name:<20}{results[name]:10.1f} ops/s")
+    print(f"speedup: {results['multiplexed'] / results['ssh per operation']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
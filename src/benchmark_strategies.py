@@ -0,0 +1,105 @@
+import argparse
+import heapq
+import random
+from collections import deque
+
+from load_balancer import RandomStrategy, RoundRobinStrategy, LeastOutstandingStrategy, PowerOfTwoChoicesStrategy
+
+# Discrete event simulation of load balancing strategies. Every linter instance has a few workers (like the thread
+# pool of linter_server) and a queue, some instances are slower than others. Requests arrive as a Poisson process.
+# Run from the src directory: python3 benchmark_strategies.py
+
+STRATEGIES = {"random": RandomStrategy,
+              "round_robin": RoundRobinStrategy,
+              "least_outstanding": LeastOutstandingStrategy,
+              "power_of_two_choices": PowerOfTwoChoicesStrategy}
+
+
+class SimulatedInstance:
+    def __init__(self, n_workers, mean_service_time):
+        self.free_workers = n_workers
+        self.mean_service_time = mean_service_time
+        # arrival times of requests waiting for a worker
+        self.queue = deque()
+
+
+def percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def simulate(strategy, n_instances, n_slow, slowdown, n_workers, mean_service_time, utilization, n_requests, seed):
+    rng = random.Random(seed)
+    random.seed(seed)
+    host_ports = [f"instance{i}:50051" for i in range(n_instances)]
+    instances = {host_port: SimulatedInstance(n_workers, mean_service_time * (slowdown if i < n_slow else 1))
+                 for i, host_port in enumerate(host_ports)}
+    strategy.on_topology_change(host_ports)
+
+    capacity = sum(n_workers / instance.mean_service_time for instance in instances.values())
+    arrival_rate = utilization * capacity
+
+    latencies = []
+    # (time, sequence number, host_port or None for an arrival, arrival time of the finished request)
+    events = [(rng.expovariate(arrival_rate), 0, None, None)]
+    sequence = 1
+    n_arrived = 0
+
+    def start_service(now, host_port, arrival_time):
+        nonlocal sequence
+        instance = instances[host_port]
+        instance.free_workers -= 1
+        heapq.heappush(events, (now + rng.expovariate(1 / instance.mean_service_time), sequence, host_port,
+                                arrival_time))
+        sequence += 1
+
+    while events:
+        now, _, host_port, arrival_time = heapq.heappop(events)
+        if host_port is None:
+            n_arrived += 1
+            if n_arrived < n_requests:
+                heapq.heappush(events, (now + rng.expovariate(arrival_rate), sequence, None, None))
+                sequence += 1
+
+            chosen = strategy.choose_linter_instance(host_ports)
+            strategy.on_request_start(chosen)
+            if instances[chosen].free_workers > 0:
+                start_service(now, chosen, now)
+            else:
+                instances[chosen].queue.append(now)
+        else:
+            latencies.append(now - arrival_time)
+            strategy.on_request_end(host_port, now - arrival_time, success=True)
+            instance = instances[host_port]
+            instance.free_workers += 1
+            if instance.queue:
+                start_service(now, host_port, instance.queue.popleft())
+
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--n_requests', type=int, default=200000)
+    parser.add_argument('-i', '--n_instances', type=int, default=8)
+    parser.add_argument('-slow', '--n_slow', type=int, default=1, help="number of slow instances")
+    parser.add_argument('-slowdown', '--slowdown', type=float, default=5, help="how many times slower they are")
+    parser.add_argument('-w', '--n_workers', type=int, default=10)
+    parser.add_argument('-s', '--service_time', type=float, default=0.01, help="mean seconds per lint")
+    parser.add_argument('-u', '--utilization', type=float, default=0.7, help="fraction of total capacity")
+    parser.add_argument('-seed', '--seed', type=int, default=0)
+    parsed_args = parser.parse_args()
+
+    print(f"{parsed_args.n_instances} instances ({parsed_args.n_slow} {parsed_args.slowdown}x slower), "
+          f"{parsed_args.n_workers} workers each, utilization {parsed_args.utilization}")
+    print(f"{'strategy':<22}{'p50 ms':>10}{'p99 ms':>10}{'p99.9 ms':>10}{'mean ms':>10}")
+    for name, strategy_class in STRATEGIES.items():
+        latencies = simulate(strategy_class(), parsed_args.n_instances, parsed_args.n_slow, parsed_args.slowdown,
+                             parsed_args.n_workers, parsed_args.service_time, parsed_args.utilization,
+                             parsed_args.n_requests, parsed_args.seed)
+        mean = sum(latencies) / len(latencies)
+        print(f"{name:<22}{percentile(latencies, 50) * 1000:>10.2f}{percentile(latencies, 99) * 1000:>10.2f}"
+              f"{percentile(latencies, 99.9) * 1000:>10.2f}{mean * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,21 @@
+import errno
 import logging
+import os
+import re
+import socket
 import subprocess
+import sys
+import tempfile
+import threading
 import time
 import uuid
 from abc import ABC, abstractmethod
-from typing import Tuple
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+from linter_client import LinterClient
+
+LINTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "linter")
 
 
 class ContainerManager(ABC):
@@ -18,29 +30,158 @@ class ContainerManager(ABC):
         """Stop the container with the given name"""
         raise NotImplementedError
 
+    def is_serving(self, port: int) -> bool:
+        """Whether the linter of a started container still answers on its port, managers which can't tell say yes"""
+        return True
+
+    def close(self) -> None:
+        """Release resources held for the machine, containers keep running"""
+        pass
+
+
+# Hands out ports of a machine from [first_port, last_port] in constant time. Ports bound by other processes
+# on the machine are skipped once reported with set_external_ports or add_external_port.
+class PortAllocator:
+    def __init__(self, first_port: int, last_port: int):
+        self.first_port = first_port
+        self.last_port = last_port
+        # ports which may be free, lowest first, released ports go to the end so they are reused last;
+        # a port is free only if it is also in free_ports, the rest are skipped by allocate
+        self.free_queue = deque(range(first_port, last_port + 1))
+        self.free_ports: Set[int] = set(self.free_queue)
+        self.external_ports: Set[int] = set()
+        self.lock = threading.Lock()
+
+    def allocate(self) -> int:
+        with self.lock:
+            while self.free_queue:
+                port = self.free_queue.popleft()
+                if port in self.free_ports:
+                    self.free_ports.remove(port)
+                    return port
+        raise RuntimeError(f"No free ports in range {self.first_port}-{self.last_port}")
+
+    def release(self, port: int):
+        with self.lock:
+            self._free(port)
+
+    # ports bound on the machine by anything except our containers, replaces the previously reported ones
+    def set_external_ports(self, ports: Iterable[int]):
+        ports = {port for port in ports if self.first_port <= port <= self.last_port}
+        with self.lock:
+            for port in self.external_ports - ports:
+                self._free(port)
+            for port in ports - self.external_ports:
+                self.free_ports.discard(port)
+            self.external_ports = ports
+
+    def add_external_port(self, port: int):
+        with self.lock:
+            self.free_ports.discard(port)
+            self.external_ports.add(port)
+
+    def _free(self, port: int):
+        self.external_ports.discard(port)
+        if self.first_port <= port <= self.last_port and port not in self.free_ports:
+            self.free_ports.add(port)
+            self.free_queue.append(port)
+
+
+# ports in LISTEN state from the output of `ss -Htln`, local address is the 4th column, e.g. 0.0.0.0:22 or [::]:22
+def parse_listening_ports(ss_output: str) -> List[int]:
+    ports = []
+    for line in ss_output.splitlines():
+        columns = line.split()
+        if len(columns) >= 4 and columns[3].rpartition(":")[2].isdigit():
+            ports.append(int(columns[3].rpartition(":")[2]))
+    return ports
+
+
+# Polls the health of the linter until it is serving. Returns False if it doesn't serve within timeout seconds
+# or is_running says that it is gone.
+def wait_until_serving(linter_client: LinterClient, host_port: str, timeout: float, poll_interval: float,
+                       is_running: Callable[[], bool] = lambda: True) -> bool:
+    deadline = time.monotonic() + timeout
+    try:
+        while is_running():
+            try:
+                if linter_client.check_health(host_port, timeout=min(1.0, timeout)):
+                    return True
+            except RuntimeError:
+                # the channel backs off after a refused connection, a fresh one tries again right away
+                linter_client.channel_pool.remove(host_port)
+
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(poll_interval)
+        return False
+    finally:
+        linter_client.channel_pool.remove(host_port)
+
+
+# One health check of a started linter, False if it doesn't answer within timeout seconds
+def check_serving(linter_client: LinterClient, host_port: str, timeout: float = 1.0) -> bool:
+    try:
+        return linter_client.check_health(host_port, timeout=timeout)
+    except RuntimeError:
+        return False
+    finally:
+        linter_client.channel_pool.remove(host_port)
+
 
 class SSHContainerManager(ContainerManager):
-    """Start and stop containers on a single machine. Assumes passwordless ssh is already set up."""
+    """Start and stop containers on a single machine. Assumes passwordless ssh is already set up.
+
+    All commands go through one multiplexed ssh connection per machine, which is opened by the first command
+    and kept open for control_persist seconds after the last one, so commands don't pay for the ssh handshake.
+    """
     STARTING_PORT = 12301
+    LAST_PORT = 13300
+    # docker run is retried with another port when the chosen one turns out to be taken
+    MAX_PORT_CONFLICTS = 3
 
-    def __init__(self, machine):
+    def __init__(self, machine, multiplex=True, control_persist=600, readiness_timeout=30,
+                 readiness_poll_interval=0.05, first_port=STARTING_PORT, last_port=LAST_PORT):
         self.machine = machine
+        self.port_allocator = PortAllocator(first_port, last_port)
+        # start_container returns once the linter answers health checks, or fails after readiness_timeout seconds
+        self.readiness_timeout = readiness_timeout
+        self.readiness_poll_interval = readiness_poll_interval
+        self.linter_client = LinterClient()
+        self.ssh_options = []
+        if multiplex:
+            # %C is a hash of the connection parameters, so every machine gets its own socket
+            control_path = os.path.join(tempfile.gettempdir(), "linters-ssh-%C")
+            self.ssh_options = ["-o", "ControlMaster=auto", "-o", f"ControlPath={control_path}",
+                                "-o", f"ControlPersist={control_persist}"]
         # only occupied by our linter services
         # maps container name to port
         # container name is random and unique
         self.occupied_ports = dict()
+        # containers are started and stopped from many threads at once, see MachineManager.start_linters
+        self.occupied_ports_lock = threading.Lock()
         self._health_check()
+        self._update_external_ports()
+
+    def _ssh(self, command, capture_output=False) -> subprocess.CompletedProcess:
+        return subprocess.run(["ssh", *self.ssh_options, f"{self.machine}", command], capture_output=capture_output,
+                              text=True)
 
-    # returns new port which is not occupied by our system
-    def _get_port(self):
-        port = self.STARTING_PORT
-        while port in self.occupied_ports.values():
-            port += 1
-        return port
+    # learn which ports of the range are bound by other processes on the machine
+    def _update_external_ports(self):
+        res = self._ssh("ss -Htln", capture_output=True)
+        if res.returncode != 0:
+            logging.warning(f"Could not list listening ports on {self.machine}: {res.stderr.strip()}")
+            return
+        # docker publishes our containers' ports too
+        with self.occupied_ports_lock:
+            own_ports = set(self.occupied_ports.values())
+        self.port_allocator.set_external_ports(
+            port for port in parse_listening_ports(res.stdout) if port not in own_ports)
 
     def _health_check(self):
         try:
-            res = subprocess.run(["ssh", f"{self.machine}", "docker ps"])
+            res = self._ssh("docker ps")
             res.check_returncode()
         except subprocess.CalledProcessError as exc:
             raise ValueError("Either ssh or docker not set up properly") from exc
@@ -49,27 +190,204 @@ class SSHContainerManager(ContainerManager):
         """Start an instance of the container, return the port it's running on and its name"""
         container_name: str = str(uuid.uuid4())
 
-        machine_port = self._get_port()
-        # we don't know what ports are currently used by our operating system
-        self.occupied_ports[container_name] = machine_port
-        logging.debug("Running container manager command...")
+        for _ in range(self.MAX_PORT_CONFLICTS + 1):
+            machine_port = self.port_allocator.allocate()
+            with self.occupied_ports_lock:
+                self.occupied_ports[container_name] = machine_port
+            logging.debug("Running container manager command...")
 
-        # add docker which will listen on its port 50051
-        # request to [machine_port] of the machine will be forwarded to this docker
-        docker_command = f"docker run --rm --detach --name {container_name} -p {machine_port}:{50051} {docker_image}"
-        res = subprocess.run(["ssh", f"{self.machine}", docker_command])
+            # add docker which will listen on its port 50051
+            # request to [machine_port] of the machine will be forwarded to this docker
+            docker_command = (f"docker run --rm --detach --name {container_name} -p {machine_port}:{50051} "
+                              f"{docker_image}")
+            res = self._ssh(docker_command, capture_output=True)
 
-        # delay to wait for grpc start
-        time.sleep(1)
+            logging.debug("Command completed")
+            if res.returncode == 0:
+                break
 
-        logging.debug("Command completed")
-        res.check_returncode()
+            with self.occupied_ports_lock:
+                self.occupied_ports.pop(container_name)
+            if "port is already allocated" not in res.stderr and "address already in use" not in res.stderr:
+                self.port_allocator.release(machine_port)
+                raise RuntimeError(f"docker run failed on {self.machine}: {res.stderr.strip()}")
+
+            # something else took the port since we last looked
+            logging.warning(f"Port {machine_port} on {self.machine} is taken, retrying with another one")
+            # docker may leave behind a created container
+            self._ssh(f"docker rm --force {container_name}", capture_output=True)
+            self._update_external_ports()
+            self.port_allocator.add_external_port(machine_port)
+        else:
+            raise RuntimeError(f"Could not find a free port on {self.machine}")
+
+        self._wait_until_ready(container_name, machine_port)
         logging.info(
             f"Started container {container_name} from {docker_image} on {self.machine}, visible on {machine_port}")
         return machine_port, container_name
 
+    def _wait_until_ready(self, container_name, machine_port):
+        """Poll the health of the linter until it is serving, stop the container if it doesn't start in time"""
+        host_port = f"{self.machine.split(':')[0]}:{machine_port}"
+        if not wait_until_serving(self.linter_client, host_port, self.readiness_timeout,
+                                  self.readiness_poll_interval):
+            self.stop_container(container_name)
+            raise TimeoutError(f"Container {container_name} on {self.machine} not ready "
+                               f"after {self.readiness_timeout} seconds")
+
+    def is_serving(self, port):
+        return check_serving(self.linter_client, f"{self.machine.split(':')[0]}:{port}")
+
     def stop_container(self, container_name):
-        res = subprocess.run(["ssh", f"{self.machine}", f"docker stop {container_name}"])
+        res = self._ssh(f"docker stop {container_name}")
         res.check_returncode()
-        self.occupied_ports.pop(container_name)
+        with self.occupied_ports_lock:
+            machine_port = self.occupied_ports.pop(container_name)
+        self.port_allocator.release(machine_port)
         logging.info(f"Stopped container {container_name} on {self.machine}")
+
+    def close(self):
+        """Close the shared ssh connection"""
+        if self.ssh_options:
+            subprocess.run(["ssh", *self.ssh_options, "-O", "exit", f"{self.machine}"])
+
+
+# docker image -> paths of the implementations it is built from, read from build_images.sh
+def implementations_by_image() -> Dict[str, List[str]]:
+    implementations = {}
+    with open(os.path.join(LINTER_DIR, "build_images.sh")) as build_script:
+        for line in build_script:
+            image = re.search(r"-t (\S+)", line)
+            # images with many linters list them in LINTER_IMPLS
+            file_names = re.search(r"LINTER_IMPLS=(\S+)", line) or re.search(r"LINTER_IMPL=(\S+)", line)
+            if line.startswith("docker build") and image is not None and file_names is not None:
+                implementations[image.group(1)] = [os.path.join(LINTER_DIR, "implementations", file_name)
+                                                   for file_name in file_names.group(1).split(",")]
+    return implementations
+
+
+# the port can be taken by the time something binds it, callers retry on another port then
+def is_port_free(port: int) -> bool:
+    # an IPv6 socket is bound for IPv4 too, hosts without IPv6 only have IPv4
+    for family, address in [(socket.AF_INET6, "::"), (socket.AF_INET, "0.0.0.0")]:
+        try:
+            with socket.socket(family) as sock:
+                sock.bind((address, port))
+            return True
+        except OSError as exc:
+            if exc.errno in (errno.EADDRINUSE, errno.EACCES):
+                return False
+    return False
+
+
+# linter_server.py process hosting one linter instance
+class LinterProcess:
+    def __init__(self, command: List[str], port: int):
+        self.command = command
+        self.port = port
+        self.n_restarts = 0
+        self.process = self.start()
+
+    def start(self) -> subprocess.Popen:
+        # linter_server.py finds linter_base.py next to itself, generated gRPC code is in src
+        python_path = [os.path.dirname(LINTER_DIR), os.environ.get("PYTHONPATH")]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in python_path if path))
+        return subprocess.Popen(self.command, env=env)
+
+    def is_running(self) -> bool:
+        return self.process.poll() is None
+
+
+class LocalProcessContainerManager(ContainerManager):
+    """Run linters as linter_server.py processes on this machine, for development and single host deployments.
+
+    The machine must be this one, e.g. localhost. The implementations of an image are the files it is built from
+    in build_images.sh. A supervisor thread starts processes which exit again on the same port, until a process
+    exits max_restarts times, then it is left for health check to report.
+    """
+
+    def __init__(self, machine, readiness_timeout=30, readiness_poll_interval=0.05,
+                 first_port=SSHContainerManager.STARTING_PORT, last_port=SSHContainerManager.LAST_PORT,
+                 supervision_interval=1.0, max_restarts=3):
+        self.machine = machine
+        self.port_allocator = PortAllocator(first_port, last_port)
+        self.readiness_timeout = readiness_timeout
+        self.readiness_poll_interval = readiness_poll_interval
+        self.linter_client = LinterClient()
+        self.implementations = implementations_by_image()
+        self.max_restarts = max_restarts
+        # container name -> its process
+        self.processes: Dict[str, LinterProcess] = {}
+        self.lock = threading.Lock()
+        self.supervision_interval = supervision_interval
+        self.stopped = threading.Event()
+        threading.Thread(target=self._supervise, daemon=True).start()
+
+    def start_container(self, docker_image) -> Tuple[int, str]:
+        implementations = self.implementations.get(docker_image)
+        if implementations is None:
+            raise RuntimeError(f"No implementation of {docker_image} in build_images.sh")
+        container_name: str = str(uuid.uuid4())
+
+        for _ in range(SSHContainerManager.MAX_PORT_CONFLICTS + 1):
+            # skip ports bound by other processes
+            port = self.port_allocator.allocate()
+            while not is_port_free(port):
+                self.port_allocator.add_external_port(port)
+                port = self.port_allocator.allocate()
+
+            command = [sys.executable, os.path.join(LINTER_DIR, "linter_server.py"), "--port", str(port)]
+            for implementation in implementations:
+                command += ["--implementation", implementation]
+            linter_process = LinterProcess(command, port)
+            with self.lock:
+                self.processes[container_name] = linter_process
+
+            host_port = f"{self.machine.split(':')[0]}:{port}"
+            if wait_until_serving(self.linter_client, host_port, self.readiness_timeout,
+                                  self.readiness_poll_interval, linter_process.is_running):
+                break
+
+            exited = not linter_process.is_running()
+            self.stop_container(container_name)
+            if not exited or is_port_free(port):
+                raise RuntimeError(f"Linter process {container_name} of {docker_image} not ready "
+                                   f"after {self.readiness_timeout} seconds or exited")
+            # something else bound the port after it was checked, the server could not bind it and exited
+            logging.warning(f"Port {port} is taken, retrying with another one")
+            self.port_allocator.add_external_port(port)
+        else:
+            raise RuntimeError(f"Could not find a free port on {self.machine}")
+
+        logging.info(f"Started linter process {container_name} of {docker_image}, listening on {port}")
+        return port, container_name
+
+    def is_serving(self, port):
+        return check_serving(self.linter_client, f"{self.machine.split(':')[0]}:{port}")
+
+    def stop_container(self, container_name):
+        with self.lock:
+            linter_process = self.processes.pop(container_name)
+        linter_process.process.terminate()
+        try:
+            linter_process.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            linter_process.process.kill()
+            linter_process.process.wait()
+        self.port_allocator.release(linter_process.port)
+        logging.info(f"Stopped linter process {container_name}")
+
+    def _supervise(self):
+        while not self.stopped.wait(self.supervision_interval):
+            with self.lock:
+                exited = [(container_name, linter_process) for container_name, linter_process in self.processes.items()
+                          if not linter_process.is_running() and linter_process.n_restarts < self.max_restarts]
+                for container_name, linter_process in exited:
+                    logging.warning(f"Linter process {container_name} exited with {linter_process.process.returncode}, "
+                                    f"restarting it")
+                    linter_process.n_restarts += 1
+                    linter_process.process = linter_process.start()
+
+    def close(self):
+        """Stop supervising, processes keep running"""
+        self.stopped.set()
@@ -1,8 +1,13 @@
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
 import requests
 
+from metrics import MetricsRegistry
+
 
 class MachineManagerClient:
     def __init__(self, machine_management_url):
@@ -17,40 +22,139 @@ class MachineManagerClient:
                              params={"host_ports": host_ports_list})
 
 
+# Result of probing all linters once
+class SweepReport:
+    def __init__(self, duration: float, probe_latencies: Dict[str, float], broken_host_ports: List[str]):
+        self.duration = duration
+        # host_port -> seconds until the linter responded or the last try failed, including retries
+        self.probe_latencies = probe_latencies
+        self.broken_host_ports = broken_host_ports
+
+    def to_dict(self) -> dict:
+        return {"duration": self.duration, "probe_latencies": self.probe_latencies,
+                "broken_host_ports": self.broken_host_ports}
+
+
 class HealthCheck:
-    def __init__(self, machine_management_client, linter_client, health_check_delay):
+    def __init__(self, machine_management_client, linter_client, health_check_delay, max_concurrent_probes=32,
+                 probe_timeout=1.0, max_tries=3, retry_backoff=0.1, watch_health=True,
+                 metrics: MetricsRegistry = None):
         self.machine_management_client = machine_management_client
         self.linter_client = linter_client
         self.health_check_delay = health_check_delay
+        # seconds a linter has to respond in a single try
+        self.probe_timeout = probe_timeout
+        self.max_tries = max_tries
+        # seconds to wait before the second try, doubled before every next one
+        self.retry_backoff = retry_backoff
+        self.probe_executor = ThreadPoolExecutor(max_workers=max_concurrent_probes)
+        self.last_sweep: SweepReport | None = None
+
+        # besides polling, keep a stream of status updates from every linter to learn about failures right away
+        self.watch_health = watch_health
+        # host_port -> HealthWatch
+        self.health_watches = {}
+        self.health_watches_lock = threading.Lock()
+
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.sweep_duration = self.metrics.histogram("health_check_sweep_duration_seconds",
+                                                     "Time to probe all linters once")
+        self.probe_latency = self.metrics.histogram("health_check_probe_latency_seconds",
+                                                    "Time until a linter responded or the last try failed")
+        self.probe_failures = self.metrics.counter("health_check_probe_failures_total",
+                                                   "Linters which did not respond to any try of a probe")
+        self.watch_failures = self.metrics.counter("health_check_watch_failures_total",
+                                                   "Health watch streams which reported a linter not serving or broke")
+        self.broken_linters_reported = self.metrics.counter("health_check_broken_linters_reported_total",
+                                                            "Linters reported to machine management as broken")
+        self.linters_gauge = self.metrics.gauge("health_check_linters", "Linters probed in the last sweep")
 
     def is_linter_responding(self, host_port):
-        logging.info(host_port)
         try:
-            self.linter_client.lint_code(host_port, "")
-            return True
+            return self.linter_client.check_health(host_port, timeout=self.probe_timeout)
         except RuntimeError:
             return False
 
-    def start(self):
+    # returns whether the linter responded in any of the tries and how long it took
+    def probe(self, host_port) -> Tuple[bool, float]:
+        start = time.perf_counter()
+        for try_number in range(self.max_tries):
+            if try_number > 0:
+                time.sleep(self.retry_backoff * 2 ** (try_number - 1))
+            if self.is_linter_responding(host_port):
+                latency = time.perf_counter() - start
+                self.probe_latency.observe(latency)
+                return True, latency
+        latency = time.perf_counter() - start
+        self.probe_latency.observe(latency)
+        self.probe_failures.inc()
+        return False, latency
 
-        max_tries = 3
+    def sweep(self) -> SweepReport:
+        start = time.perf_counter()
+        linters = self.machine_management_client.get_all_linters()
+        # a container serving many linters is listed once for each of them, but probed once
+        host_ports = list(dict.fromkeys(linter["hostport"] for linter in linters))
 
-        while True:
-            time.sleep(self.health_check_delay)
-            linters = self.machine_management_client.get_all_linters()
-            broken_linters_host_ports = []
+        # drop connections to instances which are gone
+        self.linter_client.channel_pool.retain(host_ports)
+        if self.watch_health:
+            self.update_health_watches(host_ports)
 
-            for linter in linters:
-                is_responding = False
-                host_port = linter["hostport"]
+        probe_results = list(self.probe_executor.map(self.probe, host_ports))
+        probe_latencies = {host_port: latency for host_port, (_, latency) in zip(host_ports, probe_results)}
+        broken_linters_host_ports = [host_port for host_port, (is_responding, _) in zip(host_ports, probe_results)
+                                     if not is_responding]
 
-                for _ in range(max_tries):
-                    if self.is_linter_responding(host_port):
-                        is_responding = True
-                        break
+        return SweepReport(time.perf_counter() - start, probe_latencies, broken_linters_host_ports)
 
-                if not is_responding:
-                    broken_linters_host_ports.append(host_port)
+    # start watching new linters and stop watching the ones which are gone
+    def update_health_watches(self, host_ports: List[str]):
+        with self.health_watches_lock:
+            for host_port in [host_port for host_port in self.health_watches if host_port not in host_ports]:
+                self.health_watches.pop(host_port).cancel()
+
+            for host_port in host_ports:
+                if host_port not in self.health_watches:
+                    health_watch = self.linter_client.watch_health(host_port)
+                    self.health_watches[host_port] = health_watch
+                    threading.Thread(target=self.watch, args=(host_port, health_watch), daemon=True).start()
+
+    def watch(self, host_port, health_watch):
+        try:
+            for is_serving in health_watch:
+                if not is_serving:
+                    self.on_watch_failure(host_port)
+        except RuntimeError:
+            self.on_watch_failure(host_port)
+        finally:
+            # watch is restarted by the next sweep if the linter is still there
+            with self.health_watches_lock:
+                if self.health_watches.get(host_port) is health_watch:
+                    del self.health_watches[host_port]
+
+    # a broken stream may be a network blip, so the linter is reported only if it also fails probing;
+    # linters stopped on purpose end their streams too, they are not reported once machine management dropped them
+    def on_watch_failure(self, host_port):
+        self.watch_failures.inc()
+        is_responding, _ = self.probe(host_port)
+        if not is_responding:
+            if all(linter["hostport"] != host_port for linter in self.machine_management_client.get_all_linters()):
+                return
+            logging.info(f"Linter {host_port} stopped serving")
+            self.broken_linters_reported.inc()
+            self.machine_management_client.report_broken_linters([host_port])
+
+    def start(self):
+        while True:
+            time.sleep(self.health_check_delay)
+            report = self.sweep()
+            self.last_sweep = report
+            self.sweep_duration.observe(report.duration)
+            self.linters_gauge.set(len(report.probe_latencies))
+            logging.info(f"Health check of {len(report.probe_latencies)} linters took {report.duration:.3f} s, "
+                         f"{len(report.broken_host_ports)} broken")
 
-            if broken_linters_host_ports:
-                self.machine_management_client.report_broken_linters(broken_linters_host_ports)
+            if report.broken_host_ports:
+                self.broken_linters_reported.inc(len(report.broken_host_ports))
+                self.machine_management_client.report_broken_linters(report.broken_host_ports)
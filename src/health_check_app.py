@@ -6,16 +6,21 @@ from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
 from health_check import HealthCheck
 from health_check import MachineManagerClient
 from linter_client import LinterClient
 
 
-def create_app(machine_management_client, linter_client, health_check_delay=5):
+def create_app(machine_management_client, linter_client, health_check_delay=5, max_concurrent_probes=32,
+               probe_timeout=1.0, watch_health=True):
+    health_check_obj = HealthCheck(machine_management_client, linter_client, health_check_delay,
+                                   max_concurrent_probes=max_concurrent_probes, probe_timeout=probe_timeout,
+                                   watch_health=watch_health)
+
     def health_check():
         logging.info("started health check service")
-        health_check_obj = HealthCheck(machine_management_client, linter_client, health_check_delay)
         health_check_obj.start()
 
     @asynccontextmanager
@@ -27,6 +32,17 @@ def create_app(machine_management_client, linter_client, health_check_delay=5):
 
     app = FastAPI(lifespan=health_check_starter)
 
+    # duration of the last sweep and how long each linter took to respond
+    @app.get("/last_sweep/")
+    async def last_sweep() -> dict | None:
+        if health_check_obj.last_sweep is None:
+            return None
+        return health_check_obj.last_sweep.to_dict()
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        return PlainTextResponse(health_check_obj.metrics.render(), media_type=health_check_obj.metrics.CONTENT_TYPE)
+
     return app
 
 
@@ -36,10 +52,13 @@ def main():
     parser.add_argument('-host', '--host')
     parser.add_argument('-port', '--port')
     parser.add_argument('-mma', '--machine_management_address')
+    parser.add_argument('-probes', '--max_concurrent_probes', type=int, default=32)
+    parser.add_argument('-probe_timeout', '--probe_timeout', type=float, default=1.0)
     parsed_args = parser.parse_args()
 
     app = create_app(machine_management_client=MachineManagerClient(parsed_args.machine_management_address),
-                     linter_client=LinterClient())
+                     linter_client=LinterClient(), max_concurrent_probes=parsed_args.max_concurrent_probes,
+                     probe_timeout=parsed_args.probe_timeout)
 
     uvicorn.run(app, port=int(parsed_args.port), host=parsed_args.host)
 
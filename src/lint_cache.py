@@ -0,0 +1,71 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# (linter_name, linter_version, sha256 of code)
+CacheKey = Tuple[str, str, bytes]
+
+
+# Linting is a pure function of linter name, version and code, so results can be reused.
+# Least recently used results are dropped when the cache exceeds its memory budget.
+class LintResultCache:
+    # rough memory taken by a cache entry apart from the strings in it
+    ENTRY_OVERHEAD_BYTES = 300
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600):
+        self.max_bytes = max_bytes
+        # seconds after which a result is not used anymore
+        self.ttl = ttl
+        # key -> (expiry time, result, size in bytes), least recently used first
+        self.entries: OrderedDict[CacheKey, Tuple[float, Tuple[int, str], int]] = OrderedDict()
+        self.n_bytes = 0
+
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evictions = 0
+        self.n_expirations = 0
+
+    @staticmethod
+    def make_key(linter_name: str, linter_version: str, code: str) -> CacheKey:
+        return linter_name, linter_version, hashlib.sha256(code.encode()).digest()
+
+    def get(self, key: CacheKey) -> Optional[Tuple[int, str]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.n_misses += 1
+            return None
+
+        expires_at, result, _ = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.n_expirations += 1
+            self.n_misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.n_hits += 1
+        return result
+
+    def put(self, key: CacheKey, result: Tuple[int, str]):
+        size = self.ENTRY_OVERHEAD_BYTES + len(key[0]) + len(key[1]) + len(key[2]) + len(result[1])
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, result, size)
+        self.n_bytes += size
+
+        while self.n_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.n_evictions += 1
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "bytes": self.n_bytes, "max_bytes": self.max_bytes,
+                "hits": self.n_hits, "misses": self.n_misses, "evictions": self.n_evictions,
+                "expirations": self.n_expirations}
+
+    def _remove(self, key: CacheKey):
+        _, _, size = self.entries.pop(key)
+        self.n_bytes -= size
@@ -0,0 +1,112 @@
+import asyncio
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from linter_client import LineEdit
+
+HUNK_HEADER = re.compile(r"@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@")
+
+
+# Edits which turn the code into the new one, from a unified diff of the two (diff -u, git diff, difflib)
+def edits_from_unified_diff(diff: str) -> List[LineEdit]:
+    edits = []
+    edit = None
+    for line in diff.splitlines():
+        match = HUNK_HEADER.match(line)
+        if match is not None:
+            old_start, old_length = int(match.group(1)), int(match.group(2) or 1)
+            # an empty range starts after the given line, others with it
+            start_line = old_start - 1 if old_length > 0 else old_start
+            edit = (start_line, start_line + old_length, [])
+            edits.append(edit)
+        elif edit is not None and line[:1] in (" ", "+"):
+            edit[2].append(line[1:])
+        elif edit is not None and line == "":
+            # some tools strip the space of empty context lines
+            edit[2].append("")
+    # hunks give lines of the old code, so the last one is applied first
+    return edits[::-1]
+
+
+# raises ValueError for lines outside of the code, lines are left as they were
+def apply_edits(lines: List[str], edits: List[LineEdit]):
+    new_lines = list(lines)
+    for start_line, end_line, edit_lines in edits:
+        if not 0 <= start_line <= end_line <= len(new_lines):
+            raise ValueError(f"Lines {start_line}-{end_line} are not in code of {len(new_lines)} lines")
+        new_lines[start_line:end_line] = edit_lines
+    lines[:] = new_lines
+
+
+# Code an editor lints again after every change, sent to one linter instance as edits.
+# Load balancer keeps the code too, so that a session can be started again on another instance.
+class LintSession:
+    def __init__(self, session_id: str, linter_name: str, linter_version: str, code: str):
+        self.session_id = session_id
+        self.linter_name = linter_name
+        # chosen when the session starts and kept during rollouts, so that all lints of an editor agree
+        self.linter_version = linter_version
+        self.lines = code.split("\n")
+        # instance which has the session, None until it is chosen
+        self.host_port: Optional[str] = None
+        # the instance has to get the whole code, it does not have the session or has an outdated one
+        self.needs_reset = True
+        # some instance got the session already, later resets are counted
+        self.started = False
+        # edits of a session are sent one at a time, in order
+        self.lock = asyncio.Lock()
+
+    def get_code(self) -> str:
+        return "\n".join(self.lines)
+
+
+# Open lint sessions, least recently used first. Sessions not used for idle_timeout seconds are dropped.
+class LintSessionStore:
+    def __init__(self, idle_timeout: float = 600):
+        self.idle_timeout = idle_timeout
+        # session id -> (last use time, session)
+        self.sessions: OrderedDict[str, Tuple[float, LintSession]] = OrderedDict()
+
+        self.n_started = 0
+        self.n_ended = 0
+        self.n_evicted = 0
+        # sessions sent again to an instance which lost them or replaced the one which had them
+        self.n_resets = 0
+
+    def start(self, linter_name: str, linter_version: str, code: str) -> LintSession:
+        self._evict_idle()
+        session = LintSession(uuid.uuid4().hex, linter_name, linter_version, code)
+        self.sessions[session.session_id] = (time.monotonic(), session)
+        self.n_started += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[LintSession]:
+        self._evict_idle()
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return None
+        self.sessions[session_id] = (time.monotonic(), entry[1])
+        self.sessions.move_to_end(session_id)
+        return entry[1]
+
+    def end(self, session_id: str) -> bool:
+        if self.sessions.pop(session_id, None) is None:
+            return False
+        self.n_ended += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"open": len(self.sessions), "started": self.n_started, "ended": self.n_ended,
+                "evicted": self.n_evicted, "resets": self.n_resets}
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        while self.sessions:
+            session_id, (last_used, _) = next(iter(self.sessions.items()))
+            if now - last_used <= self.idle_timeout:
+                break
+            self.sessions.popitem(last=False)
+            self.n_evicted += 1
@@ -1,6 +1,13 @@
 docker build . -t ghcr.io/chedatomasz/no_semicolons:v0 --build-arg LINTER_IMPL=no_semicolons_linter_v0.py
 docker build . -t ghcr.io/chedatomasz/no_semicolons:v1 --build-arg LINTER_IMPL=no_semicolons_linter_v1.py
 docker build . -t ghcr.io/chedatomasz/no_semicolons:v2 --build-arg LINTER_IMPL=no_semicolons_linter_v2.py
+docker build . -t ghcr.io/chedatomasz/no_semicolons:v3 --build-arg LINTER_IMPL=no_semicolons_linter_v3.py
 
 docker build . -t ghcr.io/chedatomasz/spaces_around_equals:v0 --build-arg LINTER_IMPL=spaces_around_assignment_linter_v0.py
-docker build . -t ghcr.io/chedatomasz/spaces_around_equals:v1 --build-arg LINTER_IMPL=spaces_around_assignment_linter_v1.py
\ No newline at end of file
+docker build . -t ghcr.io/chedatomasz/spaces_around_equals:v1 --build-arg LINTER_IMPL=spaces_around_assignment_linter_v1.py
+docker build . -t ghcr.io/chedatomasz/spaces_around_equals:v2 --build-arg LINTER_IMPL=spaces_around_assignment_linter_v2.py
+
+docker build . -t ghcr.io/chedatomasz/style:v0 --build-arg LINTER_IMPL=style_linter_v0.py
+
+# one container serving many linters, register each of them with this image under its get_name() and get_version()
+docker build . -t ghcr.io/chedatomasz/multi_linter:v0 --build-arg LINTER_IMPL=no_semicolons_linter_v3.py --build-arg LINTER_IMPLS=no_semicolons_linter_v3.py,spaces_around_assignment_linter_v2.py
\ No newline at end of file
@@ -0,0 +1,14 @@
+from linter_base import ScanningLinter
+
+
+# reports every semicolon outside of comments and strings, also in single quoted and unclosed strings
+class LinterImpl(ScanningLinter):
+    rules = [(";", "found semicolon")]
+    first_chars = ";"
+    success_message = "CORRECT: no redundant semicolons in code"
+
+    def get_name(self) -> str:
+        return "no_semicolons"
+
+    def get_version(self) -> str:
+        return "v3"
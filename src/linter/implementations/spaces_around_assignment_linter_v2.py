@@ -0,0 +1,17 @@
+from linter_base import ScanningLinter
+
+ASSIGNMENT = r"(?:\*\*|//|>>|<<|[-+*/%&|^@])?="
+
+
+# reports every assignment, also augmented, without a space on both sides; comparisons and := are not assignments
+class LinterImpl(ScanningLinter):
+    rules = [(ASSIGNMENT, "no spaces around assignment")]
+    allowed = [f" {ASSIGNMENT} ", "==", "!=", "<=", ">=", ":="]
+    first_chars = " =!<>:*/+%&|^@-"
+    success_message = "CORRECT: all assignments have spaces around them"
+
+    def get_name(self) -> str:
+        return "spaces_around_equals"
+
+    def get_version(self) -> str:
+        return "v2"
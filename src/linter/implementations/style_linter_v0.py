@@ -0,0 +1,22 @@
+from linter_base import IN_CODE, IN_COMMENT, Rule, ScanningLinter
+
+ASSIGNMENT = r"(?:\*\*|//|>>|<<|[-+*/%&|^@])?="
+
+
+# rules of no_semicolons v3 and spaces_around_equals v2 and a few more, checked together in one pass over the code
+class LinterImpl(ScanningLinter):
+    rules = [Rule("semicolon", ";", "found semicolon", first_chars=";"),
+             Rule("spaces_around_assignment", ASSIGNMENT, "no spaces around assignment",
+                  first_chars="=*/><+%&|^@-"),
+             Rule("trailing_whitespace", r"[ \t]+(?=\n|\Z)", "trailing whitespace", (IN_CODE, IN_COMMENT), " \t"),
+             Rule("tab_indentation", r"(?m:^) *\t", "tab in indentation", first_chars=" \t"),
+             Rule("todo_without_owner", r"\bTODO\b(?!\()", "TODO without an owner, write TODO(name)", (IN_COMMENT,))]
+    allowed = [f" {ASSIGNMENT} ", "==", "!=", "<=", ">=", ":="]
+    first_chars = " =!<>:"
+    success_message = "CORRECT: code follows the style"
+
+    def get_name(self) -> str:
+        return "style"
+
+    def get_version(self) -> str:
+        return "v0"
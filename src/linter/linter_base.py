@@ -1,10 +1,20 @@
+import itertools
+import math
+import re
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import Collection, Iterator, List, NamedTuple, Sequence, Tuple
 
 CODE_SUCCESS = 0
 CODE_FAILURE = 1
 
 
+# lines and columns count from 0, like in the messages of linters
+class Violation(NamedTuple):
+    line: int
+    column: int
+    message: str
+
+
 class LinterBase(ABC):
     @abstractmethod
     def get_name(self) -> str:
@@ -17,3 +27,250 @@ class LinterBase(ABC):
     @abstractmethod
     def lint_code(self, code) -> Tuple[int, str]:
         pass
+
+    # status, comment and every violation, linters which stop at the first violation don't list them
+    def lint(self, code) -> Tuple[int, str, List[Violation]]:
+        status, comment = self.lint_code(code)
+        return status, comment, []
+
+    # code which is linted again after every edit, see LintSession
+    def start_session(self, code) -> "LintSession":
+        return LintSession(self, code)
+
+
+# parts of Python code which are not checked by rules of scanning linters, unless a rule asks for them
+COMMENT = r"#[^\n]*"
+# a string which is not closed ends with the line, or with the code if it is triple quoted
+# and always matches, so runs of characters can be taken at once without the risk of backtracking
+STRING = (r'"""(?:[^"\\]+|\\(?:[\s\S]|\Z)|"(?!""))*(?:"""|\Z)'
+          r"|'''(?:[^'\\]+|\\(?:[\s\S]|\Z)|'(?!''))*(?:'''|\Z)"
+          r'|"(?:[^"\\\n]+|\\[\s\S])*"?'
+          r"|'(?:[^'\\\n]+|\\[\s\S])*'?")
+COMMENT_AND_STRING_FIRST_CHARS = "#\"'"
+
+# where rules look for their patterns
+IN_CODE = "code"
+IN_COMMENT = "comment"
+# string literals, docstrings included
+IN_STRING = "string"
+
+
+class Rule(NamedTuple):
+    name: str
+    # regex without named groups
+    pattern: str
+    message: str
+    # by default only code outside comments and strings, like "a semicolon which is not inside a comment or docstring"
+    contexts: Tuple[str, ...] = (IN_CODE,)
+    # characters the pattern starts with in code, added to ScanningLinter.first_chars
+    first_chars: str = ""
+
+
+class ScanningLinter(LinterBase):
+    """Linter which finds every violation of its rules in one pass of a compiled regex over the code,
+    subclasses list rules as Rule or (pattern, message) pairs"""
+    rules: Sequence[Rule | Tuple[str, str]] = ()
+    # code which would match a rule but is fine, e.g. "==" for a rule about "="
+    allowed: Sequence[str] = ()
+    success_message = "CORRECT"
+    # characters which start rules and allowed patterns, optional; other positions are then passed over after one
+    # check instead of trying every pattern there
+    first_chars: str = None
+    # the comment grows with every violation, so the scan stops there
+    max_violations = 1000
+
+    # enabled_rules are names of rules to check, all by default
+    def __init__(self, enabled_rules: Collection[str] = None):
+        rules = [rule if isinstance(rule, Rule) else Rule(f"rule{i}", *rule) for i, rule in enumerate(self.rules)]
+        self.enabled_rules = [rule for rule in rules if enabled_rules is None or rule.name in enabled_rules]
+
+        # only rules, comments and strings end with an empty named group, so lastgroup of a match is the rule it
+        # broke, the context to search again or None for skipped code; the group is put after the pattern, so that
+        # the regex engine skips alternatives starting with a literal or a character set after one check
+        groups = {context: [] for context in [IN_CODE, IN_COMMENT, IN_STRING]}
+        for i, rule in enumerate(self.enabled_rules):
+            for context in rule.contexts:
+                groups[context].append(f"(?:{rule.pattern})(?P<rule{i}>)")
+        self.messages = {f"rule{i}": rule.message for i, rule in enumerate(self.enabled_rules)}
+        self.context_patterns = {context: re.compile("|".join(groups[context]))
+                                 for context in [IN_COMMENT, IN_STRING] if groups[context]}
+
+        pattern = "|".join([f"(?:{COMMENT})(?P<{IN_COMMENT}>)" if IN_COMMENT in self.context_patterns else COMMENT,
+                            f"(?:{STRING})(?P<{IN_STRING}>)" if IN_STRING in self.context_patterns else STRING,
+                            *self.allowed, *groups[IN_CODE]])
+        if self.first_chars is not None:
+            first_chars = "".join(rule.first_chars for rule in self.enabled_rules)
+            pattern = (f"(?=[{re.escape(COMMENT_AND_STRING_FIRST_CHARS + self.first_chars + first_chars)}])"
+                       f"(?:{pattern})")
+        self.pattern = re.compile(pattern)
+
+    # matches of rules, in comments and strings too
+    def _rule_matches(self, code) -> Iterator[re.Match]:
+        for match in self.pattern.finditer(code):
+            group = match.lastgroup
+            if group is None:
+                continue
+            context_pattern = self.context_patterns.get(group)
+            if context_pattern is None:
+                yield match
+            else:
+                yield from context_pattern.finditer(code, match.start(), match.end())
+
+    # stops after max_violations, self.max_violations by default
+    def find_violations(self, code, max_violations: float = None) -> List[Violation]:
+        if max_violations is None:
+            max_violations = self.max_violations
+        violations = []
+        line = 0
+        # start of the last violation, lines are counted from there
+        position = 0
+        for match in self._rule_matches(code):
+            start = match.start()
+            line += code.count("\n", position, start)
+            position = start
+            violations.append(Violation(line, start - code.rfind("\n", 0, start) - 1, self.messages[match.lastgroup]))
+            if len(violations) >= max_violations:
+                break
+        return violations
+
+    def lint(self, code) -> Tuple[int, str, List[Violation]]:
+        return self.report(self.find_violations(code))
+
+    def report(self, violations: List[Violation]) -> Tuple[int, str, List[Violation]]:
+        # the cap may be infinite, which can't be sliced with
+        if len(violations) > self.max_violations:
+            violations = violations[:int(self.max_violations)]
+        if not violations:
+            return CODE_SUCCESS, self.success_message, violations
+        comment = "\n".join(f"ERROR: {violation.message} in line {violation.line} at position {violation.column}"
+                            for violation in violations)
+        return CODE_FAILURE, comment, violations
+
+    def lint_code(self, code) -> Tuple[int, str]:
+        status, comment, _ = self.lint(code)
+        return status, comment
+
+    def start_session(self, code) -> "LintSession":
+        return ScanningLintSession(self, code)
+
+    # violations in code which starts inside a string opened with open_string, e.g. lines in the middle of a docstring
+    def find_violations_after(self, code, open_string: str, max_violations: float = None) -> List[Violation]:
+        if not open_string:
+            return self.find_violations(code, max_violations)
+        prefix = string_prefix(open_string)
+        n_prefix_lines = prefix.count("\n")
+        violations = []
+        for violation in self.find_violations(prefix + code, max_violations):
+            line = violation.line - n_prefix_lines
+            column = violation.column - len(prefix) if line == 0 and n_prefix_lines == 0 else violation.column
+            if line >= 0 and column >= 0:
+                violations.append(Violation(line, column, violation.message))
+        return violations
+
+
+# Code put before lines which start inside a string opened with open_string, so that they are scanned as they would
+# be in the whole code. Strings in quotes go on after an escaped newline, and a quote followed by the quotes the line
+# starts with would open a triple quoted string.
+def string_prefix(open_string: str) -> str:
+    return open_string if len(open_string) == 3 else open_string + "\\\n"
+
+
+# a comment or a string, matched whole so that quotes in comments and strings don't open strings
+COMMENT_OR_STRING = re.compile(f"(?=[{re.escape(COMMENT_AND_STRING_FIRST_CHARS)}])(?:{COMMENT}|{STRING})")
+
+
+# For every line of the code, the string it starts inside of, given by its opening quotes, or "" if it starts in code.
+# That's the only state of Python lexing that crosses lines: triple quoted strings and strings with an escaped
+# newline go on in the next line, comments end with the line. Has one more element, for the line after the code.
+# The code must end with a newline.
+def open_strings_at_lines(code, open_string: str = "") -> List[str]:
+    prefix = string_prefix(open_string) if open_string else ""
+    code = prefix + code
+    open_strings = [open_string] + [""] * code.count("\n")
+    line = 0
+    # start of the last string, lines are counted from there
+    position = 0
+    for match in COMMENT_OR_STRING.finditer(code):
+        token = match.group()
+        if "\n" not in token:
+            continue
+        quote = token[:3] if token[:3] in ('"""', "'''") else token[0]
+        start = match.start()
+        line += code.count("\n", position, start)
+        position = start
+        # lines starting inside the string, a string which is not closed goes on after the code
+        for string_line in range(line + 1, line + token.count("\n") + 1):
+            open_strings[string_line] = quote
+    return open_strings[prefix.count("\n"):]
+
+
+# Code which is linted after every edit of some of its lines, like a file in an editor.
+# Lints the whole code every time, linters which can do better override it.
+class LintSession:
+    def __init__(self, linter: LinterBase, code):
+        self.linter = linter
+        self.lines = code.split("\n")
+
+    def get_code(self) -> str:
+        return "\n".join(self.lines)
+
+    # replaces lines [start_line, end_line) with new lines, raises ValueError for lines outside of the code
+    def edit(self, start_line: int, end_line: int, lines: List[str]):
+        if not 0 <= start_line <= end_line <= len(self.lines):
+            raise ValueError(f"Lines {start_line}-{end_line} are not in code of {len(self.lines)} lines")
+        self.lines[start_line:end_line] = lines
+
+    def lint(self) -> Tuple[int, str, List[Violation]]:
+        return self.linter.lint(self.get_code())
+
+
+# Keeps violations and the open string of every line, so that an edit only scans the edited lines again, and lines
+# after them until the scan gets to a line which starts in the same state as before the edit. Inserting a line
+# with \"\"\" scans until the next one, a line without quotes only scans itself.
+class ScanningLintSession(LintSession):
+    def __init__(self, linter: ScanningLinter, code):
+        super().__init__(linter, code)
+        # open string every line was scanned with, and the one after the last line
+        self.open_strings: List[str | None] = [""] + [None] * len(self.lines)
+        # violations found in every line, with line numbers of the time they were found
+        self.line_violations: List[List[Violation]] = [[] for _ in self.lines]
+        self.rescan(0, len(self.lines), "")
+
+    def edit(self, start_line: int, end_line: int, lines: List[str]):
+        open_string = self.open_strings[start_line]
+        super().edit(start_line, end_line, lines)
+        self.open_strings[start_line:end_line] = [open_string] + [None] * (len(lines) - 1) if lines else []
+        self.line_violations[start_line:end_line] = [[] for _ in lines]
+        self.rescan(start_line, start_line + len(lines), open_string)
+
+    # scans lines from first_line, which starts in open_string, at least to stop_line, then twice as many lines as
+    # the last time until the state after the scanned lines is the one the next line was scanned with
+    def rescan(self, first_line: int, stop_line: int, open_string: str):
+        n_lines = len(self.lines)
+        if stop_line == first_line and self.open_strings[first_line] == open_string:
+            return
+        if first_line == n_lines:
+            self.open_strings[first_line] = open_string
+            return
+
+        stop_line = min(n_lines, max(stop_line, first_line + 1))
+        while True:
+            code = "\n".join(self.lines[first_line:stop_line]) + "\n"
+            open_strings = open_strings_at_lines(code, open_string)
+            if stop_line == n_lines or open_strings[-1] == self.open_strings[stop_line]:
+                break
+            stop_line = min(n_lines, first_line + 2 * (stop_line - first_line))
+
+        self.open_strings[first_line:stop_line + 1] = open_strings
+        line_violations = [[] for _ in range(stop_line - first_line)]
+        # lines are not scanned again unless edited, so they keep all their violations, the cap is applied by lint
+        for violation in self.linter.find_violations_after(code, open_string, math.inf):
+            line_violations[violation.line].append(violation)
+        self.line_violations[first_line:stop_line] = line_violations
+
+    def lint(self) -> Tuple[int, str, List[Violation]]:
+        violations = (violation._replace(line=line)
+                      for line, violations in enumerate(self.line_violations) for violation in violations)
+        if self.linter.max_violations < math.inf:
+            violations = itertools.islice(violations, self.linter.max_violations)
+        return self.linter.report(list(violations))
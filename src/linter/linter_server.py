@@ -1,39 +1,193 @@
+import argparse
+import asyncio
+import importlib.util
 import logging
+import os
+import threading
+import time
 from concurrent import futures
+from typing import Dict, List, Tuple
 
 import grpc
 import linter_pb2
 import linter_pb2_grpc
-from linter_implementation import LinterImpl
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
 
-from linter_base import LinterBase
+from linter_base import LinterBase, LintSession, Violation
+from tracing import JsonlSpanExporter, Tracer
 
 
 # This file is moved to the correct path by Dockerfile, a bit hacky to avoid code duplication.
 
+# name under which health of the linter is reported, "" reports health of the whole server
+LINTER_SERVICE_NAME = linter_pb2.DESCRIPTOR.services_by_name["Linter"].full_name
+
+
+# LinterImpl from a file of implementations/, used to host linters without building images
+def load_implementation(path: str) -> LinterBase:
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.LinterImpl()
+
+
 class LinterWrapper(linter_pb2_grpc.LinterServicer):
-    def __init__(self):
+    # without linters, the one which Dockerfile copied to linter_implementation.py is served;
+    # sessions not edited for session_idle_timeout seconds are dropped, load balancer drops its sessions earlier
+    def __init__(self, *linters: LinterBase, tracer: Tracer = None, session_idle_timeout: float = 900):
         super().__init__()
-        self.linter: LinterBase = LinterImpl()
+        if not linters:
+            from linter_implementation import LinterImpl
+            linters = (LinterImpl(),)
+        # (name, version) -> linter, requests choose one of them by linter_name and linter_version
+        self.linters: Dict[Tuple[str, str], LinterBase] = {(linter.get_name(), linter.get_version()): linter
+                                                           for linter in linters}
+        # a server hosting one linter serves it whatever the request names, like before requests named linters
+        self.only_linter: LinterBase | None = linters[0] if len(self.linters) == 1 else None
+        self.tracer = tracer if tracer is not None else Tracer("linter")
+
+        # load balancer sends edits of a session one at a time, the lock only guards the dicts
+        self.sessions: Dict[str, LintSession] = {}
+        self.session_last_used: Dict[str, float] = {}
+        self.session_idle_timeout = session_idle_timeout
+        self.last_session_eviction = time.monotonic()
+        self.sessions_lock = threading.Lock()
+
+    def choose_linter(self, request: linter_pb2.LintingRequest, context) -> LinterBase:
+        if self.only_linter is not None:
+            return self.only_linter
+        linter = self.linters.get((request.linter_name, request.linter_version))
+        if linter is None:
+            context.abort(grpc.StatusCode.NOT_FOUND,
+                          f"Linter {request.linter_name} v {request.linter_version} is not served here")
+        return linter
 
     def LintCode(self, request: linter_pb2.LintingRequest, context) -> linter_pb2.LintingResult:
         """Missing associated documentation comment in .proto file."""
-        sent_code = request.code
-        status_code, response_text = self.linter.lint_code(sent_code)
-        response = linter_pb2.LintingResult(status=status_code, comment=response_text)
-        return response
+        # traced only if load balancer sampled the request, the span starts once a worker thread takes the request
+        with self.tracer.start_span("linter.lint_code", Tracer.from_metadata(context.invocation_metadata()),
+                                    code_length=len(request.code)):
+            linter = self.choose_linter(request, context)
+            sent_code = request.code
+            status_code, response_text, violations = linter.lint(sent_code)
+        return self.make_result(status_code, response_text, violations)
+
+    @staticmethod
+    def make_result(status_code: int, comment: str, violations: List[Violation]) -> linter_pb2.LintingResult:
+        return linter_pb2.LintingResult(
+            status=status_code, comment=comment,
+            violations=[linter_pb2.Violation(line=violation.line, column=violation.column, message=violation.message)
+                        for violation in violations])
+
+    def LintCodeBatch(self, request: linter_pb2.LintingBatchRequest, context) -> linter_pb2.LintingBatchResult:
+        """Lints many pieces of code in one call, results are in the order of requests."""
+        results = [self.LintCode(linting_request, context) for linting_request in request.requests]
+        return linter_pb2.LintingBatchResult(results=results)
+
+    def LintSessionEdits(self, request: linter_pb2.LintingSessionRequest, context) -> linter_pb2.LintingResult:
+        """Lints the code of a session after changing some of its lines, only the changed part is scanned again when
+        the linter can do it. Aborts with NOT_FOUND if the server does not know the session and reset is not set.
+        """
+        with self.tracer.start_span("linter.lint_session_edits", Tracer.from_metadata(context.invocation_metadata()),
+                                    reset=request.reset, n_edits=len(request.edits)):
+            linter = self.choose_linter(request, context)
+            session = self.get_session(request, linter, context)
+            try:
+                for edit in request.edits:
+                    session.edit(edit.start_line, edit.end_line, list(edit.lines))
+            except ValueError as exc:
+                # the session is left half edited
+                self.end_session(request.session_id)
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exc))
+            status_code, response_text, violations = session.lint()
+        return self.make_result(status_code, response_text, violations)
+
+    def get_session(self, request: linter_pb2.LintingSessionRequest, linter: LinterBase, context) -> LintSession:
+        now = time.monotonic()
+        session = linter.start_session(request.code) if request.reset else None
+        with self.sessions_lock:
+            if session is not None:
+                self.sessions[request.session_id] = session
+            else:
+                session = self.sessions.get(request.session_id)
+            if session is not None:
+                self.session_last_used[request.session_id] = now
+
+            # idle sessions are looked for twice per idle timeout, so an edit rarely walks all of them
+            if now - self.last_session_eviction > self.session_idle_timeout / 2:
+                self.last_session_eviction = now
+                for session_id in [session_id for session_id, last_used in self.session_last_used.items()
+                                   if now - last_used > self.session_idle_timeout]:
+                    self.sessions.pop(session_id)
+                    self.session_last_used.pop(session_id)
+
+        # a session of another linter served here is not continued either
+        if session is None or session.linter is not linter:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"No session {request.session_id}, start it again with reset")
+        return session
+
+    def end_session(self, session_id: str):
+        with self.sessions_lock:
+            self.sessions.pop(session_id, None)
+            self.session_last_used.pop(session_id, None)
+
+
+# port and implementations are given when the server runs outside of a container, see LocalProcessContainerManager;
+# a container serves the implementations named in LINTER_IMPLEMENTATIONS, or linter_implementation.py
+def serve(port: int = 50051, implementations: List[str] = None):
+    async def start_and_wait():
+        server, _ = await start_server(port, implementations)
+        print(f"Server started, listening on {port}")
+        await server.wait_for_termination()
+
+    asyncio.run(start_and_wait())
+
+
+# port 0 takes any free port, returns the server and its port
+async def start_server(port: int, implementations: List[str] = None,
+                       host: str = "[::]") -> Tuple[grpc.aio.Server, int]:
+    # Lints are blocking and run on the thread pool, health is async and answered on the event loop, so that probes
+    # don't wait behind lints when all threads are busy. A sync grpc.server runs every RPC on its one pool.
+    # Clients keep channels open and ping them every 30 seconds, see ChannelPool in linter_client.py.
+    server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10),
+                             options=[("grpc.keepalive_permit_without_calls", 1),
+                                      ("grpc.http2.min_recv_ping_interval_without_data_ms", 20000)])
+
+    health_servicer = health.aio.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    for service in ["", LINTER_SERVICE_NAME]:
+        await health_servicer.set(service, health_pb2.HealthCheckResponse.NOT_SERVING)
+
+    # if the implementation does not load, the server keeps reporting NOT_SERVING, so that health check replaces it
+    # spans of traced requests go to this file, mount it from the host to read them
+    trace_file = os.environ.get("LINTER_TRACE_FILE")
+    tracer = Tracer("linter", JsonlSpanExporter(trace_file) if trace_file else None)
 
+    try:
+        if not implementations and os.environ.get("LINTER_IMPLEMENTATIONS"):
+            implementations = [os.path.join("implementations", file_name)
+                               for file_name in os.environ["LINTER_IMPLEMENTATIONS"].split(",")]
+        linters = [load_implementation(implementation) for implementation in implementations or []]
+        linter_wrapper = LinterWrapper(*linters, tracer=tracer)
+        linter_pb2_grpc.add_LinterServicer_to_server(linter_wrapper, server)
+    except Exception:
+        logging.exception("Could not load linter implementation")
+        linter_wrapper = None
 
-def serve():
-    port = "50051"
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    linter_pb2_grpc.add_LinterServicer_to_server(LinterWrapper(), server)
-    server.add_insecure_port("[::]:" + port)
-    server.start()
-    print(f"Server started, listening on {port} (inside container)")
-    server.wait_for_termination()
+    port = server.add_insecure_port(f"{host}:{port}")
+    await server.start()
+    if linter_wrapper is not None:
+        for service in ["", LINTER_SERVICE_NAME]:
+            await health_servicer.set(service, health_pb2.HealthCheckResponse.SERVING)
+    return server, port
 
 
 if __name__ == "__main__":
     logging.basicConfig()
-    serve()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-port', '--port', type=int, default=50051)
+    parser.add_argument('-implementation', '--implementation', action="append", default=None,
+                        help="file with LinterImpl, can be given many times, linter_implementation.py by default")
+    parsed_args = parser.parse_args()
+    serve(parsed_args.port, parsed_args.implementation)
@@ -1,5 +1,9 @@
 docker push ghcr.io/chedatomasz/no_semicolons:v0
 docker push ghcr.io/chedatomasz/no_semicolons:v1
 docker push ghcr.io/chedatomasz/no_semicolons:v2
+docker push ghcr.io/chedatomasz/no_semicolons:v3
 docker push ghcr.io/chedatomasz/spaces_around_equals:v0
-docker push ghcr.io/chedatomasz/spaces_around_equals:v1
\ No newline at end of file
+docker push ghcr.io/chedatomasz/spaces_around_equals:v1
+docker push ghcr.io/chedatomasz/spaces_around_equals:v2
+docker push ghcr.io/chedatomasz/style:v0
+docker push ghcr.io/chedatomasz/multi_linter:v0
\ No newline at end of file
@@ -1,19 +1,217 @@
-from typing import Tuple
+import asyncio
+import inspect
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
 
 import grpc
+from grpc_health.v1 import health_pb2, health_pb2_grpc
 
 import linter_pb2
 import linter_pb2_grpc
+from tracing import TraceContext, Tracer
 
+# name under which linter servers report health of the linter
+LINTER_SERVICE_NAME = linter_pb2.DESCRIPTOR.services_by_name["Linter"].full_name
 
-# This could be a function, but it is a class to simplify tests.
+# (line, column, message), lines and columns count from 0
+Violation = Tuple[int, int, str]
+# (start_line, end_line, lines): replaces lines [start_line, end_line) of the code, lines count from 0 and have
+# no newlines, like LineEdit in linter.proto
+LineEdit = Tuple[int, int, List[str]]
+
+
+# the linter instance does not have the session, it has to be started again with the whole code
+class LintSessionNotFound(RuntimeError):
+    pass
+
+
+# Keeps one open channel per linter instance, so requests don't pay for connection setup.
+class ChannelPool:
+    # linter servers accept pings this often, see linter_server.py
+    CHANNEL_OPTIONS = [("grpc.keepalive_time_ms", 30000),
+                       ("grpc.keepalive_timeout_ms", 10000),
+                       ("grpc.keepalive_permit_without_calls", 1),
+                       ("grpc.http2.max_pings_without_data", 0)]
+
+    def __init__(self, idle_timeout: float = 300, channel_factory=grpc.insecure_channel):
+        # channels not used for idle_timeout seconds are closed
+        self.idle_timeout = idle_timeout
+        self.channel_factory = channel_factory
+        self.channels: Dict[str, grpc.Channel] = {}
+        self.last_used: Dict[str, float] = {}
+        self.last_eviction = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.n_created = 0
+        self.n_reused = 0
+        self.n_closed = 0
+
+    def get_channel(self, host_port: str) -> grpc.Channel:
+        now = time.monotonic()
+        with self.lock:
+            channel = self.channels.get(host_port)
+            if channel is None:
+                channel = self.channel_factory(host_port, options=self.CHANNEL_OPTIONS)
+                self.channels[host_port] = channel
+                self.n_created += 1
+            else:
+                self.n_reused += 1
+            self.last_used[host_port] = now
+
+            # scanning all channels on every request would be wasteful
+            if now - self.last_eviction > self.idle_timeout / 2:
+                self.last_eviction = now
+                self._evict_idle(now)
+        return channel
+
+    # close channel to an instance which is no longer running
+    def remove(self, host_port: str):
+        with self.lock:
+            self._close(host_port)
+
+    # close channels to all instances except the given ones; RPCs in flight on grpc.aio channels get grace seconds
+    # to finish before they are cancelled
+    def retain(self, host_ports: Iterable[str], grace: float = None):
+        host_ports = set(host_ports)
+        with self.lock:
+            for host_port in [host_port for host_port in self.channels if host_port not in host_ports]:
+                self._close(host_port, grace)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"open_channels": len(self.channels), "created": self.n_created, "reused": self.n_reused,
+                    "closed": self.n_closed}
+
+    def _evict_idle(self, now: float):
+        for host_port in [host_port for host_port, last_used in self.last_used.items()
+                          if now - last_used > self.idle_timeout]:
+            self._close(host_port)
+
+    def _close(self, host_port: str, grace: float = None):
+        channel = self.channels.pop(host_port, None)
+        self.last_used.pop(host_port, None)
+        if channel is not None:
+            closed = channel.close(grace) if isinstance(channel, grpc.aio.Channel) else channel.close()
+            # grpc.aio channels are closed asynchronously
+            if inspect.isawaitable(closed):
+                asyncio.ensure_future(closed)
+            self.n_closed += 1
+
+
+# Serving status updates of a single linter, see LinterClient.watch_health
+class HealthWatch:
+    def __init__(self, call):
+        self.call = call
+
+    # yields True when the linter is serving and False when it is not, raises RuntimeError when the stream breaks
+    def __iter__(self):
+        try:
+            for response in self.call:
+                yield response.status == health_pb2.HealthCheckResponse.SERVING
+        except grpc.RpcError as exc:
+            # linters without the health service can only be probed with LinterClient.check_health
+            if exc.code() not in (grpc.StatusCode.CANCELLED, grpc.StatusCode.UNIMPLEMENTED):
+                raise RuntimeError(f"Health watch failed: {exc.code()}") from exc
+
+    def cancel(self):
+        self.call.cancel()
+
+
+# This could be a function, but it is a class to simplify tests and to keep channels between requests.
 class LinterClient:
-    @staticmethod
-    def lint_code(host_port, code) -> Tuple[int, str]:
-        channel = grpc.insecure_channel(host_port)
-        stub = linter_pb2_grpc.LinterStub(channel)
+    def __init__(self, channel_pool: ChannelPool = None, tracer: Tracer = None):
+        self.channel_pool = channel_pool if channel_pool is not None else ChannelPool()
+        self.tracer = tracer if tracer is not None else Tracer("linter_client")
+
+    # timeout in seconds, None means waiting as long as it takes;
+    # linter_name and linter_version choose the linter on servers hosting many
+    def lint_code(self, host_port, code, timeout: float = None, trace_context: TraceContext = None,
+                  linter_name: str = "", linter_version: str = "") -> Tuple[int, str]:
+        with self.tracer.start_span("linter_client.lint_code", trace_context, instance=host_port) as span:
+            span.set_attribute("new_channel", host_port not in self.channel_pool.channels)
+            stub = linter_pb2_grpc.LinterStub(self.channel_pool.get_channel(host_port))
 
-        response = stub.LintCode(linter_pb2.LintingRequest(code=code))
+            try:
+                request = linter_pb2.LintingRequest(code=code, linter_name=linter_name, linter_version=linter_version)
+                response = stub.LintCode(request, timeout=timeout, metadata=Tracer.to_metadata(span.context()))
+            except grpc.RpcError as exc:
+                raise RuntimeError(f"Linter {host_port} failed: {exc.code()}") from exc
         status_code = response.status
         comment = response.comment
         return status_code, comment
+
+    # returns whether the linter is serving, raises RuntimeError if it does not answer;
+    # linters from images built without the health service count as serving once they accept connections
+    def check_health(self, host_port, timeout: float = None) -> bool:
+        stub = health_pb2_grpc.HealthStub(self.channel_pool.get_channel(host_port))
+
+        try:
+            response = stub.Check(health_pb2.HealthCheckRequest(service=LINTER_SERVICE_NAME), timeout=timeout)
+        except grpc.RpcError as exc:
+            if exc.code() == grpc.StatusCode.UNIMPLEMENTED:
+                return True
+            raise RuntimeError(f"Linter {host_port} failed: {exc.code()}") from exc
+        return response.status == health_pb2.HealthCheckResponse.SERVING
+
+    # streams serving status of the linter as soon as it changes
+    def watch_health(self, host_port) -> HealthWatch:
+        stub = health_pb2_grpc.HealthStub(self.channel_pool.get_channel(host_port))
+        return HealthWatch(stub.Watch(health_pb2.HealthCheckRequest(service=LINTER_SERVICE_NAME)))
+
+
+# Used by load balancer, so that a single process can have many lints in flight.
+class AsyncLinterClient:
+    def __init__(self, channel_pool: ChannelPool = None, tracer: Tracer = None):
+        self.channel_pool = channel_pool if channel_pool is not None else ChannelPool(
+            channel_factory=grpc.aio.insecure_channel)
+        self.tracer = tracer if tracer is not None else Tracer("linter_client")
+
+    async def lint_code(self, host_port, code, trace_context: TraceContext = None, linter_name: str = "",
+                        linter_version: str = "") -> Tuple[int, str]:
+        with self.tracer.start_span("linter_client.lint_code", trace_context, instance=host_port) as span:
+            # a new channel has to connect first
+            span.set_attribute("new_channel", host_port not in self.channel_pool.channels)
+            stub = linter_pb2_grpc.LinterStub(self.channel_pool.get_channel(host_port))
+
+            try:
+                request = linter_pb2.LintingRequest(code=code, linter_name=linter_name, linter_version=linter_version)
+                response = await stub.LintCode(request, metadata=Tracer.to_metadata(span.context()))
+            except grpc.RpcError as exc:
+                raise RuntimeError(f"Linter {host_port} failed: {exc.code()}") from exc
+        status_code = response.status
+        comment = response.comment
+        return status_code, comment
+
+    async def lint_code_batch(self, host_port, codes: List[str], linter_name: str = "",
+                              linter_version: str = "") -> List[Tuple[int, str]]:
+        stub = linter_pb2_grpc.LinterStub(self.channel_pool.get_channel(host_port))
+        request = linter_pb2.LintingBatchRequest(requests=[
+            linter_pb2.LintingRequest(code=code, linter_name=linter_name, linter_version=linter_version)
+            for code in codes])
+
+        try:
+            response = await stub.LintCodeBatch(request)
+        except grpc.RpcError as exc:
+            raise RuntimeError(f"Linter {host_port} failed: {exc.code()}") from exc
+        return [(result.status, result.comment) for result in response.results]
+
+    # applies edits to the code of the session, after setting it to code if reset is given
+    async def lint_session_edits(self, host_port, session_id: str, edits: List[LineEdit], reset: bool = False,
+                                 code: str = "", trace_context: TraceContext = None, linter_name: str = "",
+                                 linter_version: str = "") -> Tuple[int, str, List[Violation]]:
+        with self.tracer.start_span("linter_client.lint_session_edits", trace_context, instance=host_port) as span:
+            stub = linter_pb2_grpc.LinterStub(self.channel_pool.get_channel(host_port))
+            request = linter_pb2.LintingSessionRequest(
+                session_id=session_id, linter_name=linter_name, linter_version=linter_version, reset=reset, code=code,
+                edits=[linter_pb2.LineEdit(start_line=start_line, end_line=end_line, lines=lines)
+                       for start_line, end_line, lines in edits])
+
+            try:
+                response = await stub.LintSessionEdits(request, metadata=Tracer.to_metadata(span.context()))
+            except grpc.RpcError as exc:
+                if exc.code() == grpc.StatusCode.NOT_FOUND:
+                    raise LintSessionNotFound(f"Linter {host_port} has no session {session_id}") from exc
+                raise RuntimeError(f"Linter {host_port} failed: {exc.code()}") from exc
+        return response.status, response.comment, [(violation.line, violation.column, violation.message)
+                                                    for violation in response.violations]
@@ -13,7 +13,7 @@ from google.protobuf.internal import builder as _builder
 _sym_db = _symbol_database.Default()
 
 DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(
-    b'\n\x0clinter.proto\"\x1e\n\x0eLintingRequest\x12\x0c\n\x04\x63ode\x18\x01 \x01(\t\"0\n\rLintingResult\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\x0f\n\x07\x63omment\x18\x02 \x01(\t27\n\x06Linter\x12-\n\x08LintCode\x12\x0f.LintingRequest\x1a\x0e.LintingResult\"\x00\x62\x06proto3')
+    b'\n\x0clinter.proto\"K\n\x0eLintingRequest\x12\x0c\n\x04\x63ode\x18\x01 \x01(\t\x12\x13\n\x0blinter_name\x18\x02 \x01(\t\x12\x16\n\x0elinter_version\x18\x03 \x01(\t\":\n\tViolation\x12\x0c\n\x04line\x18\x01 \x01(\x05\x12\x0e\n\x06\x63olumn\x18\x02 \x01(\x05\x12\x0f\n\x07message\x18\x03 \x01(\t\"P\n\rLintingResult\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\x0f\n\x07\x63omment\x18\x02 \x01(\t\x12\x1e\n\nviolations\x18\x03 \x03(\x0b\x32\n.Violation\"8\n\x13LintingBatchRequest\x12!\n\x08requests\x18\x01 \x03(\x0b\x32\x0f.LintingRequest\"5\n\x12LintingBatchResult\x12\x1f\n\x07results\x18\x01 \x03(\x0b\x32\x0e.LintingResult\"?\n\x08LineEdit\x12\x12\n\nstart_line\x18\x01 \x01(\x05\x12\x10\n\x08\x65nd_line\x18\x02 \x01(\x05\x12\r\n\x05lines\x18\x03 \x03(\t\"\x8f\x01\n\x15LintingSessionRequest\x12\x12\n\nsession_id\x18\x01 \x01(\t\x12\x13\n\x0blinter_name\x18\x02 \x01(\t\x12\x16\n\x0elinter_version\x18\x03 \x01(\t\x12\r\n\x05reset\x18\x04 \x01(\x08\x12\x0c\n\x04\x63ode\x18\x05 \x01(\t\x12\x18\n\x05\x65\x64its\x18\x06 \x03(\x0b\x32\t.LineEdit2\xb3\x01\n\x06Linter\x12-\n\x08LintCode\x12\x0f.LintingRequest\x1a\x0e.LintingResult\"\x00\x12<\n\rLintCodeBatch\x12\x14.LintingBatchRequest\x1a\x13.LintingBatchResult\"\x00\x12<\n\x10LintSessionEdits\x12\x16.LintingSessionRequest\x1a\x0e.LintingResult\"\x00\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -21,9 +21,19 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'linter_pb2', _globals)
 if _descriptor._USE_C_DESCRIPTORS == False:
     DESCRIPTOR._options = None
     _globals['_LINTINGREQUEST']._serialized_start = 16
-    _globals['_LINTINGREQUEST']._serialized_end = 46
-    _globals['_LINTINGRESULT']._serialized_start = 48
-    _globals['_LINTINGRESULT']._serialized_end = 96
-    _globals['_LINTER']._serialized_start = 98
-    _globals['_LINTER']._serialized_end = 153
+    _globals['_LINTINGREQUEST']._serialized_end = 91
+    _globals['_VIOLATION']._serialized_start = 93
+    _globals['_VIOLATION']._serialized_end = 151
+    _globals['_LINTINGRESULT']._serialized_start = 153
+    _globals['_LINTINGRESULT']._serialized_end = 233
+    _globals['_LINTINGBATCHREQUEST']._serialized_start = 235
+    _globals['_LINTINGBATCHREQUEST']._serialized_end = 291
+    _globals['_LINTINGBATCHRESULT']._serialized_start = 293
+    _globals['_LINTINGBATCHRESULT']._serialized_end = 346
+    _globals['_LINEEDIT']._serialized_start = 348
+    _globals['_LINEEDIT']._serialized_end = 411
+    _globals['_LINTINGSESSIONREQUEST']._serialized_start = 414
+    _globals['_LINTINGSESSIONREQUEST']._serialized_end = 557
+    _globals['_LINTER']._serialized_start = 560
+    _globals['_LINTER']._serialized_end = 739
 # @@protoc_insertion_point(module_scope)
@@ -1,5 +1,6 @@
-from typing import ClassVar as _ClassVar, Optional as _Optional
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
+from google.protobuf.internal import containers as _containers
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
 
@@ -7,18 +8,88 @@ DESCRIPTOR: _descriptor.FileDescriptor
 
 
 class LintingRequest(_message.Message):
-    __slots__ = ("code",)
+    __slots__ = ("code", "linter_name", "linter_version")
     CODE_FIELD_NUMBER: _ClassVar[int]
+    LINTER_NAME_FIELD_NUMBER: _ClassVar[int]
+    LINTER_VERSION_FIELD_NUMBER: _ClassVar[int]
     code: str
+    linter_name: str
+    linter_version: str
 
-    def __init__(self, code: _Optional[str] = ...) -> None: ...
+    def __init__(self, code: _Optional[str] = ..., linter_name: _Optional[str] = ...,
+                 linter_version: _Optional[str] = ...) -> None: ...
+
+
+class Violation(_message.Message):
+    __slots__ = ("line", "column", "message")
+    LINE_FIELD_NUMBER: _ClassVar[int]
+    COLUMN_FIELD_NUMBER: _ClassVar[int]
+    MESSAGE_FIELD_NUMBER: _ClassVar[int]
+    line: int
+    column: int
+    message: str
+
+    def __init__(self, line: _Optional[int] = ..., column: _Optional[int] = ...,
+                 message: _Optional[str] = ...) -> None: ...
 
 
 class LintingResult(_message.Message):
-    __slots__ = ("status", "comment")
+    __slots__ = ("status", "comment", "violations")
     STATUS_FIELD_NUMBER: _ClassVar[int]
     COMMENT_FIELD_NUMBER: _ClassVar[int]
+    VIOLATIONS_FIELD_NUMBER: _ClassVar[int]
     status: int
     comment: str
+    violations: _containers.RepeatedCompositeFieldContainer[Violation]
+
+    def __init__(self, status: _Optional[int] = ..., comment: _Optional[str] = ...,
+                 violations: _Optional[_Iterable[_Union[Violation, _Mapping]]] = ...) -> None: ...
+
+
+class LintingBatchRequest(_message.Message):
+    __slots__ = ("requests",)
+    REQUESTS_FIELD_NUMBER: _ClassVar[int]
+    requests: _containers.RepeatedCompositeFieldContainer[LintingRequest]
+
+    def __init__(self, requests: _Optional[_Iterable[_Union[LintingRequest, _Mapping]]] = ...) -> None: ...
+
+
+class LintingBatchResult(_message.Message):
+    __slots__ = ("results",)
+    RESULTS_FIELD_NUMBER: _ClassVar[int]
+    results: _containers.RepeatedCompositeFieldContainer[LintingResult]
+
+    def __init__(self, results: _Optional[_Iterable[_Union[LintingResult, _Mapping]]] = ...) -> None: ...
+
+
+class LineEdit(_message.Message):
+    __slots__ = ("start_line", "end_line", "lines")
+    START_LINE_FIELD_NUMBER: _ClassVar[int]
+    END_LINE_FIELD_NUMBER: _ClassVar[int]
+    LINES_FIELD_NUMBER: _ClassVar[int]
+    start_line: int
+    end_line: int
+    lines: _containers.RepeatedScalarFieldContainer[str]
+
+    def __init__(self, start_line: _Optional[int] = ..., end_line: _Optional[int] = ...,
+                 lines: _Optional[_Iterable[str]] = ...) -> None: ...
+
+
+class LintingSessionRequest(_message.Message):
+    __slots__ = ("session_id", "linter_name", "linter_version", "reset", "code", "edits")
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    LINTER_NAME_FIELD_NUMBER: _ClassVar[int]
+    LINTER_VERSION_FIELD_NUMBER: _ClassVar[int]
+    RESET_FIELD_NUMBER: _ClassVar[int]
+    CODE_FIELD_NUMBER: _ClassVar[int]
+    EDITS_FIELD_NUMBER: _ClassVar[int]
+    session_id: str
+    linter_name: str
+    linter_version: str
+    reset: bool
+    code: str
+    edits: _containers.RepeatedCompositeFieldContainer[LineEdit]
 
-    def __init__(self, status: _Optional[int] = ..., comment: _Optional[str] = ...) -> None: ...
+    def __init__(self, session_id: _Optional[str] = ..., linter_name: _Optional[str] = ...,
+                 linter_version: _Optional[str] = ..., reset: bool = ..., code: _Optional[str] = ...,
+                 edits: _Optional[_Iterable[_Union[LineEdit, _Mapping]]] = ...) -> None: ...
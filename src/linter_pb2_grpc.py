@@ -20,6 +20,16 @@ class LinterStub(object):
             request_serializer=linter__pb2.LintingRequest.SerializeToString,
             response_deserializer=linter__pb2.LintingResult.FromString,
         )
+        self.LintCodeBatch = channel.unary_unary(
+            '/Linter/LintCodeBatch',
+            request_serializer=linter__pb2.LintingBatchRequest.SerializeToString,
+            response_deserializer=linter__pb2.LintingBatchResult.FromString,
+        )
+        self.LintSessionEdits = channel.unary_unary(
+            '/Linter/LintSessionEdits',
+            request_serializer=linter__pb2.LintingSessionRequest.SerializeToString,
+            response_deserializer=linter__pb2.LintingResult.FromString,
+        )
 
 
 class LinterServicer(object):
@@ -32,6 +42,21 @@ class LinterServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def LintCodeBatch(self, request, context):
+        """Lints many pieces of code in one call, results are in the order of requests.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def LintSessionEdits(self, request, context):
+        """Lints the code of a session after changing some of its lines, only the changed part is scanned again when
+        the linter can do it. Aborts with NOT_FOUND if the server does not know the session and reset is not set.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_LinterServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -40,6 +65,16 @@ def add_LinterServicer_to_server(servicer, server):
             request_deserializer=linter__pb2.LintingRequest.FromString,
             response_serializer=linter__pb2.LintingResult.SerializeToString,
         ),
+        'LintCodeBatch': grpc.unary_unary_rpc_method_handler(
+            servicer.LintCodeBatch,
+            request_deserializer=linter__pb2.LintingBatchRequest.FromString,
+            response_serializer=linter__pb2.LintingBatchResult.SerializeToString,
+        ),
+        'LintSessionEdits': grpc.unary_unary_rpc_method_handler(
+            servicer.LintSessionEdits,
+            request_deserializer=linter__pb2.LintingSessionRequest.FromString,
+            response_serializer=linter__pb2.LintingResult.SerializeToString,
+        ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
         'Linter', rpc_method_handlers)
@@ -67,3 +102,37 @@ class Linter(object):
                                              linter__pb2.LintingResult.FromString,
                                              options, channel_credentials,
                                              insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def LintCodeBatch(request,
+                      target,
+                      options=(),
+                      channel_credentials=None,
+                      call_credentials=None,
+                      insecure=False,
+                      compression=None,
+                      wait_for_ready=None,
+                      timeout=None,
+                      metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Linter/LintCodeBatch',
+                                             linter__pb2.LintingBatchRequest.SerializeToString,
+                                             linter__pb2.LintingBatchResult.FromString,
+                                             options, channel_credentials,
+                                             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def LintSessionEdits(request,
+                         target,
+                         options=(),
+                         channel_credentials=None,
+                         call_credentials=None,
+                         insecure=False,
+                         compression=None,
+                         wait_for_ready=None,
+                         timeout=None,
+                         metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Linter/LintSessionEdits',
+                                             linter__pb2.LintingSessionRequest.SerializeToString,
+                                             linter__pb2.LintingResult.FromString,
+                                             options, channel_credentials,
+                                             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
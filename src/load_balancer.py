@@ -1,27 +1,32 @@
+import asyncio
+import logging
+import math
 import random
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Set
 
-import requests
+import httpx
 
-from linter_client import LinterClient
+from lint_cache import CacheKey, LintResultCache
+from lint_sessions import LintSession, LintSessionStore, apply_edits
+from linter_client import AsyncLinterClient, LineEdit, LintSessionNotFound, Violation
+from metrics import MetricsRegistry
+from tracing import TraceContext, Tracer
 
 
 # used to make load balancer communicate with machine management service
 class MachineManagementClient:
     def __init__(self, machine_management_url):
         self.machine_management_url = machine_management_url
+        self.http_client = httpx.AsyncClient()
 
-    # returns list of host_ports of all linters instances with matching linter name
-    # and which are of current version stored in machine management
-    def get_linters_with_curr_version(self, linter_name) -> List[str]:
-        url = f"{self.machine_management_url}/list_linters_with_curr_version/"
-        return requests.get(url, params={"linter_name": linter_name}).json()
-
-    # returns list of host_ports of all linter instances with matching name and version
-    def get_linter_instances(self, name, version) -> List[str]:
-        url = f"{self.machine_management_url}/list_linter_instances/"
-        return requests.get(url, params={"linter_name": name, "linter_version": version}).json()
+    # returns dictionary {"epoch": ..., "curr_versions": {...}, "instances": [{"name": ..., "version": ...,
+    # "hostport": ...}, ...]} describing all running linter instances
+    async def get_routing_table(self) -> dict:
+        response = await self.http_client.get(f"{self.machine_management_url}/routing_table/")
+        return response.json()
 
 
 ################################
@@ -54,6 +59,72 @@ class TrafficData:
         return self.sent_to_new / (self.sent_to_old + self.sent_to_new) < desired_percent / 100
 
 
+# Immutable list of host_ports which computes its hash only once, so that strategies can keep state per list
+# of instances without looking at every instance on each request
+class HostPortList(tuple):
+    def __new__(cls, host_ports):
+        host_port_list = super().__new__(cls, host_ports)
+        host_port_list.hash = tuple.__hash__(host_port_list)
+        return host_port_list
+
+    def __hash__(self):
+        return self.hash
+
+
+EMPTY_HOST_PORT_LIST = HostPortList([])
+
+
+# Local copy of the linter instances known to machine management. Machine management pushes a new snapshot
+# on every change, so choosing an instance does not need to ask it anything.
+class RoutingTable:
+    def __init__(self):
+        # epoch of the last applied snapshot, used to ignore notifications delivered out of order
+        self.epoch = None
+        # (linter_name -> current version, (linter_name, linter_version) -> host_ports), replaced as a whole
+        # on update so readers never see half of an update
+        self.snapshot: Tuple[Dict[str, str], Dict[Tuple[str, str], HostPortList]] = ({}, {})
+        self.last_update = None
+        self.lock = threading.Lock()
+
+    # instances is a list of dictionaries [{"name": ..., "version": ..., "hostport": ...}, ...]
+    # returns False if the snapshot is older than the one already applied
+    def update(self, epoch: int, curr_versions: Dict[str, str], instances: List[dict]) -> bool:
+        host_ports: Dict[Tuple[str, str], List[str]] = {}
+        for instance in instances:
+            host_ports.setdefault((instance["name"], instance["version"]), []).append(instance["hostport"])
+        linter_instances = {linter: HostPortList(linter_host_ports) for linter, linter_host_ports in host_ports.items()}
+
+        with self.lock:
+            if self.epoch is not None and epoch < self.epoch:
+                return False
+            self.epoch = epoch
+            self.snapshot = (dict(curr_versions), linter_instances)
+            self.last_update = time.monotonic()
+        return True
+
+    # seconds since the last update, infinite if there was none
+    def age(self) -> float:
+        if self.last_update is None:
+            return math.inf
+        return time.monotonic() - self.last_update
+
+    def get_curr_version(self, linter_name) -> str:
+        curr_versions, _ = self.snapshot
+        return curr_versions.get(linter_name)
+
+    def get_linters_with_curr_version(self, linter_name) -> HostPortList:
+        curr_versions, linter_instances = self.snapshot
+        return linter_instances.get((linter_name, curr_versions.get(linter_name)), EMPTY_HOST_PORT_LIST)
+
+    def get_linter_instances(self, linter_name, linter_version) -> HostPortList:
+        _, linter_instances = self.snapshot
+        return linter_instances.get((linter_name, linter_version), EMPTY_HOST_PORT_LIST)
+
+    def get_all_host_ports(self) -> List[str]:
+        _, linter_instances = self.snapshot
+        return [host_port for host_ports in linter_instances.values() for host_port in host_ports]
+
+
 class RolloutManager:
     def __init__(self):
         self.linter_name_to_rollout_data: Dict[str, RolloutData] = {}
@@ -88,6 +159,21 @@ class LoadBalancingStrategy(ABC):
     def choose_linter_instance(self, host_port_list: List[str]) -> str:
         raise NotImplementedError
 
+    # called when a request is sent to the instance
+    def on_request_start(self, host_port: str):
+        pass
+
+    # called when the instance responded or failed, latency in seconds
+    def on_request_end(self, host_port: str, latency: float, success: bool):
+        pass
+
+    # called with host_ports of all running instances whenever they change
+    def on_topology_change(self, host_ports: List[str]):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
 
 # on average case very good strategy
 class RandomStrategy(LoadBalancingStrategy):
@@ -95,58 +181,462 @@ class RandomStrategy(LoadBalancingStrategy):
         return random.choice(host_port_list)
 
 
-# It's not exactly round-robin, but something that works very similar
+# Rotates over each list of instances it is given. Lists from the routing table are looked up in constant time,
+# other lists are copied into a tuple first.
 class RoundRobinStrategy(LoadBalancingStrategy):
+    # limits remembered lists when topology changes are not reported
+    MAX_ROTATIONS = 1024
+
     def __init__(self):
-        self.load_counters: dict[str, int] = {}
+        # list of instances -> index of the instance to choose next
+        self.cursors: Dict[Tuple[str, ...], int] = {}
+        self.lock = threading.Lock()
+
+    def choose_linter_instance(self, host_port_list: List[str]) -> str:
+        key = host_port_list if isinstance(host_port_list, tuple) else tuple(host_port_list)
+        if not key:
+            raise IndexError("No linter instances to choose from")
+
+        with self.lock:
+            cursor = self.cursors.get(key)
+            if cursor is None:
+                if len(self.cursors) >= self.MAX_ROTATIONS:
+                    self.cursors.clear()
+                # start at a random instance, so that new lists don't all begin with the first one
+                cursor = random.randrange(len(key))
+            self.cursors[key] = (cursor + 1) % len(key)
+
+        return key[cursor]
+
+    # lists from the previous routing table are not used anymore
+    def on_topology_change(self, host_ports: List[str]):
+        with self.lock:
+            self.cursors.clear()
+
+
+class InstanceLoad:
+    def __init__(self):
+        self.in_flight = 0
+        # exponentially weighted moving average of latency in seconds, None until the first request ends
+        self.ewma_latency: float | None = None
+
+
+# Base for strategies which look at requests in flight and latency of each instance
+class LoadTrackingStrategy(LoadBalancingStrategy, ABC):
+    # failed requests count as this slow, so that a failing instance does not attract traffic by failing fast
+    FAILURE_LATENCY = 1.0
+
+    def __init__(self, ewma_weight: float = 0.3):
+        # weight of the newest latency in the moving average
+        self.ewma_weight = ewma_weight
+        self.instance_loads: Dict[str, InstanceLoad] = {}
+        # moving average of latency over all instances, expected from instances which did not answer yet, so that
+        # new instances neither look free and get all requests nor look slow and get none
+        self.prior_latency = 0.0
+        # instances gone from the topology, their loads are dropped when their requests in flight end
+        self.removed_host_ports: Set[str] = set()
+
+    def get_load(self, host_port: str) -> InstanceLoad:
+        load = self.instance_loads.get(host_port)
+        if load is None:
+            load = self.instance_loads[host_port] = InstanceLoad()
+        return load
+
+    def on_request_start(self, host_port: str):
+        self.get_load(host_port).in_flight += 1
+
+    def on_request_end(self, host_port: str, latency: float, success: bool):
+        load = self.instance_loads.get(host_port)
+        if load is None:
+            return
+        load.in_flight -= 1
+        if not success:
+            latency = max(latency, self.FAILURE_LATENCY)
+        if load.ewma_latency is None:
+            load.ewma_latency = latency
+        else:
+            load.ewma_latency += self.ewma_weight * (latency - load.ewma_latency)
+        self.prior_latency += self.ewma_weight * (latency - self.prior_latency)
+
+        if load.in_flight == 0 and host_port in self.removed_host_ports:
+            self.removed_host_ports.remove(host_port)
+            del self.instance_loads[host_port]
+
+    def expected_latency(self, load: InstanceLoad) -> float:
+        return load.ewma_latency if load.ewma_latency is not None else self.prior_latency
+
+    def on_topology_change(self, host_ports: List[str]):
+        host_ports = set(host_ports)
+        self.removed_host_ports -= host_ports
+        for host_port in [host_port for host_port in self.instance_loads if host_port not in host_ports]:
+            if self.instance_loads[host_port].in_flight > 0:
+                self.removed_host_ports.add(host_port)
+            else:
+                del self.instance_loads[host_port]
+
+    def stats(self) -> dict:
+        return {host_port: {"in_flight": load.in_flight, "ewma_latency": self.expected_latency(load)}
+                for host_port, load in self.instance_loads.items()}
+
+
+# Sends request to the instance with the fewest requests in flight, the faster one if there is a tie
+class LeastOutstandingStrategy(LoadTrackingStrategy):
+    def choose_linter_instance(self, host_port_list: List[str]) -> str:
+        def key(host_port):
+            load = self.get_load(host_port)
+            return load.in_flight, self.expected_latency(load)
+
+        return min(host_port_list, key=key)
+
+
+# Compares two random instances by expected wait, which is cheap for many instances and avoids sending
+# everything to the single best looking one
+class PowerOfTwoChoicesStrategy(LoadTrackingStrategy):
+    def cost(self, host_port: str) -> float:
+        load = self.get_load(host_port)
+        return (load.in_flight + 1) * self.expected_latency(load)
 
-    # The counters will grow infinitely, but it won't be a problem
     def choose_linter_instance(self, host_port_list: List[str]) -> str:
-        for host_port in host_port_list:
-            if host_port not in self.load_counters:
-                self.load_counters[host_port] = 0
+        if len(host_port_list) == 1:
+            return host_port_list[0]
+        first, second = random.sample(host_port_list, 2)
+        return first if self.cost(first) <= self.cost(second) else second
 
-        host_port_with_least_load = host_port_list[0]
-        for host_port, load in self.load_counters.items():
-            if host_port in host_port_list:
-                if load < self.load_counters[host_port_with_least_load]:
-                    host_port_with_least_load = host_port
 
-        self.load_counters[host_port_with_least_load] += 1
+class LinterLoad:
+    def __init__(self):
+        # lints finished since load balancer started, with their total latency in seconds
+        self.n_requests = 0
+        self.n_failures = 0
+        self.latency_sum = 0.0
+        self.in_flight = 0
 
-        return host_port_with_least_load
+
+# Load of every linter version as seen by load balancer, autoscaler in machine management derives request rates
+# from the differences between reports. Lints answered from the cache are not counted, they take no linter time.
+class LinterLoadTracker:
+    def __init__(self):
+        self.loads: Dict[Tuple[str, str], LinterLoad] = {}
+
+    def get_load(self, linter_name: str, linter_version: str) -> LinterLoad:
+        load = self.loads.get((linter_name, linter_version))
+        if load is None:
+            load = self.loads[linter_name, linter_version] = LinterLoad()
+        return load
+
+    def on_request_start(self, linter_name: str, linter_version: str, n_requests: int = 1):
+        self.get_load(linter_name, linter_version).in_flight += n_requests
+
+    # latency of each of the n_requests lints
+    def on_request_end(self, linter_name: str, linter_version: str, latency: float, success: bool,
+                       n_requests: int = 1):
+        load = self.get_load(linter_name, linter_version)
+        load.in_flight -= n_requests
+        load.n_requests += n_requests
+        load.latency_sum += latency * n_requests
+        if not success:
+            load.n_failures += n_requests
+
+    def report(self) -> List[dict]:
+        return [{"linter_name": linter_name, "linter_version": linter_version, "n_requests": load.n_requests,
+                 "n_failures": load.n_failures, "latency_sum": load.latency_sum, "in_flight": load.in_flight}
+                for (linter_name, linter_version), load in self.loads.items()]
 
 
 class LoadBalancer:
+    # lints in flight on instances removed from the routing table get that many seconds to finish before their
+    # channels are closed, machine management stops scaled down instances after AutoscalingPolicy.scale_down_drain
+    REMOVED_INSTANCE_GRACE = 30
 
     def __init__(self, strategy: LoadBalancingStrategy, machine_management_client: MachineManagementClient,
-                 linter_client: LinterClient):
+                 linter_client: AsyncLinterClient, routing_table_max_staleness: float = 30,
+                 lint_cache: LintResultCache = None, metrics: MetricsRegistry = None, tracer: Tracer = None,
+                 lint_sessions: LintSessionStore = None):
         self.rollout_manager = RolloutManager()
         self.machine_management_client = machine_management_client
         self.strategy = strategy
         self.linter_client = linter_client
+        self.routing_table = RoutingTable()
+        # routing table is refreshed from machine management if no notification came for that long
+        self.routing_table_max_staleness = routing_table_max_staleness
+        self.lint_cache = lint_cache if lint_cache is not None else LintResultCache()
+        self.lint_sessions = lint_sessions if lint_sessions is not None else LintSessionStore()
+        # lints sent to linter instances and not answered yet, identical lints wait for them instead of being sent
+        self.lints_in_flight: Dict[CacheKey, asyncio.Task] = {}
+        self.n_coalesced_lints = 0
+        self.load_tracker = LinterLoadTracker()
+        self.tracer = tracer if tracer is not None else Tracer("load_balancer")
+
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.version_choices = self.metrics.counter(
+            "lint_version_choices_total", "Lint requests by chosen linter version, shows the rollout split",
+            ["linter", "version"])
+        self.lint_latency = self.metrics.histogram(
+            "lint_latency_seconds", "Latency of lints sent to linter instances", ["linter", "version", "instance"])
+        self.lint_failures = self.metrics.counter(
+            "lint_failures_total", "Lints which linter instances failed to answer", ["linter", "version", "instance"])
+        self.in_flight_gauge = self.metrics.gauge(
+            "lint_in_flight", "Lints sent to linter instances and not answered yet", ["linter", "version"])
+        self.cache_gauges = {name: self.metrics.gauge(f"lint_cache_{name}", f"Lint result cache {name}")
+                             for name in ["entries", "bytes", "max_bytes"]}
+        self.cache_counters = {name: self.metrics.counter(f"lint_cache_{name}_total", f"Lint result cache {name}")
+                               for name in ["hits", "misses", "evictions", "expirations"]}
+        self.strategy_gauge = self.metrics.gauge(
+            "load_balancing_strategy_stat", "Per instance state of the load balancing strategy", ["instance", "stat"])
+        self.channel_pool_gauge = self.metrics.gauge(
+            "channel_pool_open_channels", "Open channels to linter instances")
+        self.channel_pool_counters = {name: self.metrics.counter(f"channel_pool_{name}_total", f"Channels {name}")
+                                      for name in ["created", "reused", "closed"]}
+        self.coalesced_lints = self.metrics.counter(
+            "lint_coalesced_total", "Lints which got the result of an identical lint in flight", ["linter", "version"])
+        self.lint_sessions_gauge = self.metrics.gauge("lint_sessions_open", "Open lint sessions")
+        self.lint_sessions_counters = {
+            name: self.metrics.counter(f"lint_sessions_{name}_total", f"Lint sessions {name}")
+            for name in ["started", "ended", "evicted", "resets"]}
+        self.metrics.add_collector(self.collect_metrics)
+
+    def update_routing_table(self, epoch: int, curr_versions: Dict[str, str], instances: List[dict]):
+        if self.routing_table.update(epoch, curr_versions, instances):
+            # drop connections and load data of instances which are gone
+            host_ports = self.routing_table.get_all_host_ports()
+            self.linter_client.channel_pool.retain(host_ports, grace=self.REMOVED_INSTANCE_GRACE)
+            self.strategy.on_topology_change(host_ports)
+            self.lint_latency.retain("instance", host_ports)
+            self.lint_failures.retain("instance", host_ports)
+
+    # copies stats kept by other parts of load balancer into metrics
+    def collect_metrics(self):
+        for load in self.load_tracker.report():
+            self.in_flight_gauge.labels(load["linter_name"], load["linter_version"]).set(load["in_flight"])
+
+        cache_stats = self.lint_cache.stats()
+        for name, gauge in self.cache_gauges.items():
+            gauge.set(cache_stats[name])
+        for name, counter in self.cache_counters.items():
+            counter.labels().set(cache_stats[name])
+
+        self.strategy_gauge.clear()
+        for host_port, instance_stats in self.strategy.stats().items():
+            for stat, value in instance_stats.items():
+                self.strategy_gauge.labels(host_port, stat).set(value)
+
+        channel_pool_stats = self.linter_client.channel_pool.stats()
+        self.channel_pool_gauge.set(channel_pool_stats["open_channels"])
+        for name, counter in self.channel_pool_counters.items():
+            counter.labels().set(channel_pool_stats[name])
+
+        lint_sessions_stats = self.lint_sessions.stats()
+        self.lint_sessions_gauge.set(lint_sessions_stats["open"])
+        for name, counter in self.lint_sessions_counters.items():
+            counter.labels().set(lint_sessions_stats[name])
+
+    async def refresh_routing_table(self):
+        table = await self.machine_management_client.get_routing_table()
+        self.update_routing_table(table["epoch"], table["curr_versions"], table["instances"])
+
+    # fallback for lost notifications, e.g. when machine management could not reach us
+    async def refresh_routing_table_if_stale(self):
+        if self.routing_table.age() > self.routing_table_max_staleness:
+            logging.info("Routing table is stale, fetching it from machine management")
+            await self.refresh_routing_table()
+
+    # during rollout the version is chosen to keep the traffic split, otherwise it is the current version
+    # raises KeyError for linters which machine management does not know, before their names get into metrics
+    def choose_version(self, linter_name) -> str:
+        if self.rollout_manager.is_rollout(linter_name):
+            return self.rollout_manager.choose_version(linter_name)
+        version = self.routing_table.get_curr_version(linter_name)
+        if version is None:
+            raise KeyError(f"Unknown linter {linter_name}")
+        return version
 
-    def choose_linter(self, linter_name):
+    def choose_linter_instance(self, linter_name, version) -> str:
+        return self.strategy.choose_linter_instance(self.routing_table.get_linter_instances(linter_name, version))
 
+    def choose_linter(self, linter_name):
         # first choose needed version, then apply load balancing
-        if self.rollout_manager.is_rollout(linter_name):
-            version = self.rollout_manager.choose_version(linter_name)
-            host_port = self.strategy.choose_linter_instance(
-                self.machine_management_client.get_linter_instances(linter_name, version))
+        return self.choose_linter_instance(linter_name, self.choose_version(linter_name))
+
+    # latency of each of the n_requests lints sent together
+    def on_lint_end(self, linter_name: str, version: str, host_port: str, latency: float, success: bool,
+                    n_requests: int = 1):
+        self.strategy.on_request_end(host_port, latency, success)
+        self.load_tracker.on_request_end(linter_name, version, latency, success, n_requests)
+        if success:
+            self.lint_latency.labels(linter_name, version, host_port).observe(latency, n_requests)
+        else:
+            self.lint_failures.labels(linter_name, version, host_port).inc(n_requests)
+
+    # trace_id is given for sampled requests, see tracing.py
+    async def lint_code(self, linter_name: str, code: str, trace_id: str = None) -> Tuple[int, str]:
+        trace_context = (trace_id, None) if trace_id is not None else None
+        with self.tracer.start_span("load_balancer.lint_code", trace_context, linter=linter_name) as span:
+            return await self._lint_code(linter_name, code, span)
+
+    async def _lint_code(self, linter_name: str, code: str, span) -> Tuple[int, str]:
+        # version is chosen before looking into cache, so cached results follow the rollout split
+        version = self.choose_version(linter_name)
+        span.set_attribute("version", version)
+        self.version_choices.labels(linter_name, version).inc()
+        cache_key = self.lint_cache.make_key(linter_name, version, code)
+        cached_result = self.lint_cache.get(cache_key)
+        span.set_attribute("cache_hit", cached_result is not None)
+        if cached_result is not None:
+            return cached_result
+
+        # identical lints in flight share one request to a linter, it is not cancelled with the lint which sent it
+        lint = self.lints_in_flight.get(cache_key)
+        span.set_attribute("coalesced", lint is not None)
+        if lint is not None:
+            self.n_coalesced_lints += 1
+            self.coalesced_lints.labels(linter_name, version).inc()
+        else:
+            lint = asyncio.ensure_future(self._send_lint(linter_name, version, code, cache_key, span.context()))
+            self.lints_in_flight[cache_key] = lint
+            lint.add_done_callback(lambda _: self.lints_in_flight.pop(cache_key, None))
+        host_port, result = await asyncio.shield(lint)
+        span.set_attribute("instance", host_port)
+        return result
+
+    # returns the instance and its result; the request may outlive the lint which sent it, so it has its own span,
+    # a child of that lint's span
+    async def _send_lint(self, linter_name: str, version: str, code: str, cache_key: CacheKey,
+                         trace_context: TraceContext) -> Tuple[str, Tuple[int, str]]:
+        with self.tracer.start_span("load_balancer.send_lint", trace_context, linter=linter_name,
+                                    version=version) as span:
+            # keep the code in memory
+            host_port = self.choose_linter_instance(linter_name, version)
+            span.set_attribute("instance", host_port)
+
+            # Real linting happens here
+            self.strategy.on_request_start(host_port)
+            self.load_tracker.on_request_start(linter_name, version)
+            start = time.perf_counter()
+            try:
+                status_code, message = await self.linter_client.lint_code(
+                    host_port, code, trace_context=span.context(), linter_name=linter_name, linter_version=version)
+            except RuntimeError:
+                self.on_lint_end(linter_name, version, host_port, time.perf_counter() - start, success=False)
+                status_code, message = 1, "linter error"
+                return host_port, (status_code, message)
+            self.on_lint_end(linter_name, version, host_port, time.perf_counter() - start, success=True)
+
+            self.lint_cache.put(cache_key, (status_code, message))
+            return host_port, (status_code, message)
+
+    async def lint_code_batch(self, linter_name: str, codes: List[str]) -> List[Tuple[int, str]]:
+        results: List[Tuple[int, str]] = [(1, "linter error")] * len(codes)
+        cache_keys = []
+
+        # version and instance are chosen for every piece of code as if it was sent on its own,
+        # then the code sent to the same instance goes there in one request
+        host_port_to_indices: Dict[str, List[int]] = {}
+        # instances of one version are chosen for one host_port
+        host_port_to_version: Dict[str, str] = {}
+        for i, code in enumerate(codes):
+            version = self.choose_version(linter_name)
+            self.version_choices.labels(linter_name, version).inc()
+            cache_keys.append(self.lint_cache.make_key(linter_name, version, code))
+            cached_result = self.lint_cache.get(cache_keys[i])
+            if cached_result is not None:
+                results[i] = cached_result
+            else:
+                host_port = self.choose_linter_instance(linter_name, version)
+                host_port_to_indices.setdefault(host_port, []).append(i)
+                host_port_to_version[host_port] = version
+
+        async def lint_sub_batch(host_port, indices):
+            version = host_port_to_version[host_port]
+            self.strategy.on_request_start(host_port)
+            self.load_tracker.on_request_start(linter_name, version, n_requests=len(indices))
+            start = time.perf_counter()
+            try:
+                sub_batch_results = await self.linter_client.lint_code_batch(
+                    host_port, [codes[i] for i in indices], linter_name=linter_name, linter_version=version)
+            except RuntimeError:
+                self.on_lint_end(linter_name, version, host_port, time.perf_counter() - start, success=False,
+                                 n_requests=len(indices))
+                return
+            # strategies compare latencies of single lints
+            self.on_lint_end(linter_name, version, host_port, (time.perf_counter() - start) / len(indices),
+                             success=True, n_requests=len(indices))
+            for i, result in zip(indices, sub_batch_results):
+                results[i] = result
+                self.lint_cache.put(cache_keys[i], result)
+
+        await asyncio.gather(*[lint_sub_batch(host_port, indices)
+                               for host_port, indices in host_port_to_indices.items()])
+        return results
+
+    # starts a session with the whole code, later lints of the session only send changed lines, see lint_sessions.py;
+    # raises KeyError for unknown linters and linters without instances, no session is kept for them
+    async def start_lint_session(self, linter_name: str, code: str) -> Tuple[str, Tuple[int, str, List[Violation]]]:
+        version = self.choose_version(linter_name)
+        host_ports = self.routing_table.get_linter_instances(linter_name, version)
+        if not host_ports:
+            raise KeyError(f"No instances of linter {linter_name} in version {version}")
+        self.version_choices.labels(linter_name, version).inc()
+        session = self.lint_sessions.start(linter_name, version, code)
+        session.host_port = self.strategy.choose_linter_instance(host_ports)
+        return session.session_id, await self._lint_session(session, [])
+
+    # raises KeyError for unknown or evicted sessions and ValueError for edits of lines which are not in the code
+    async def lint_session_edits(self, session_id: str, edits: List[LineEdit]) -> Tuple[int, str, List[Violation]]:
+        session = self.lint_sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"No lint session {session_id}")
+        return await self._lint_session(session, edits)
+
+    def coalescing_stats(self) -> dict:
+        return {"in_flight": len(self.lints_in_flight), "coalesced": self.n_coalesced_lints}
+
+    def end_lint_session(self, session_id: str) -> bool:
+        return self.lint_sessions.end(session_id)
+
+    async def _lint_session(self, session: LintSession, edits: List[LineEdit]) -> Tuple[int, str, List[Violation]]:
+        async with session.lock:
+            apply_edits(session.lines, edits)
+
+            # the session sticks to its instance while it runs, then goes to another one with the whole code
+            linter_name = session.linter_name
+            if not self.routing_table.get_linter_instances(linter_name, session.linter_version):
+                session.linter_version = self.choose_version(linter_name)
+                session.host_port = None
+            if session.host_port not in self.routing_table.get_linter_instances(linter_name, session.linter_version):
+                session.host_port = self.choose_linter_instance(linter_name, session.linter_version)
+                session.needs_reset = True
+
+            version = session.linter_version
+            host_port = session.host_port
+            self.strategy.on_request_start(host_port)
+            self.load_tracker.on_request_start(linter_name, version)
+            start = time.perf_counter()
+            try:
+                try:
+                    result = await self._send_lint_session(session, edits)
+                except LintSessionNotFound:
+                    # the instance restarted or dropped the idle session
+                    session.needs_reset = True
+                    result = await self._send_lint_session(session, edits)
+            except RuntimeError:
+                self.on_lint_end(linter_name, version, host_port, time.perf_counter() - start, success=False)
+                # the instance may have missed the edits
+                session.needs_reset = True
+                return 1, "linter error", []
+            self.on_lint_end(linter_name, version, host_port, time.perf_counter() - start, success=True)
+            return result
+
+    async def _send_lint_session(self, session: LintSession, edits: List[LineEdit]) -> Tuple[int, str, List[Violation]]:
+        if session.needs_reset:
+            if session.started:
+                self.lint_sessions.n_resets += 1
+            result = await self.linter_client.lint_session_edits(
+                session.host_port, session.session_id, [], reset=True, code=session.get_code(),
+                linter_name=session.linter_name, linter_version=session.linter_version)
         else:
-            host_port = self.strategy.choose_linter_instance(
-                self.machine_management_client.get_linters_with_curr_version(linter_name))
-
-        return host_port
-
-    def lint_code(self, linter_name: str, code: str) -> Tuple[int, str]:
-        # keep the code in memory
-        host_port = self.choose_linter(linter_name)
-
-        # Real linting happens here
-        try:
-            status_code, message = self.linter_client.lint_code(host_port, code)
-            return status_code, message
-        except RuntimeError:
-            status_code, message = 1, "linter error"
-            return status_code, message
+            result = await self.linter_client.lint_session_edits(
+                session.host_port, session.session_id, edits, linter_name=session.linter_name,
+                linter_version=session.linter_version)
+        session.needs_reset = False
+        session.started = True
+        return result
@@ -1,43 +1,164 @@
 import argparse
+import asyncio
 import logging
 import sys
+from contextlib import asynccontextmanager
+from typing import Dict, List
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
-from linter_client import LinterClient
-from load_balancer import LoadBalancer, MachineManagementClient, RolloutData, RoundRobinStrategy
+from linter_client import AsyncLinterClient
+from lint_cache import LintResultCache
+from lint_sessions import LintSessionStore, edits_from_unified_diff
+from load_balancer import LoadBalancer, MachineManagementClient, RolloutData, RoundRobinStrategy, RandomStrategy, \
+    LeastOutstandingStrategy, PowerOfTwoChoicesStrategy
+from tracing import JsonlSpanExporter, Tracer
+
+STRATEGIES = {"round_robin": RoundRobinStrategy,
+              "random": RandomStrategy,
+              "least_outstanding": LeastOutstandingStrategy,
+              "power_of_two_choices": PowerOfTwoChoicesStrategy}
 
 
 # app takes linter_client only for testing simplicity
-def create_app(strategy, machine_management_client, linter_client):
-    app = FastAPI()
-    load_balancer = LoadBalancer(strategy, machine_management_client, linter_client)
+def create_app(strategy, machine_management_client, linter_client, routing_table_max_staleness=30,
+               routing_table_poll_interval=5, lint_cache=None, tracer=None, lint_sessions=None):
+    load_balancer = LoadBalancer(strategy, machine_management_client, linter_client, routing_table_max_staleness,
+                                 lint_cache, tracer=tracer, lint_sessions=lint_sessions)
+
+    async def routing_table_refresher():
+        while True:
+            try:
+                await load_balancer.refresh_routing_table_if_stale()
+            except Exception as exc:
+                logging.warning(f"Could not refresh routing table: {exc}")
+            await asyncio.sleep(routing_table_poll_interval)
+
+    @asynccontextmanager
+    async def routing_table_refresher_starter(app_arg):
+        task = asyncio.create_task(routing_table_refresher())
+
+        yield
+
+        task.cancel()
+
+    app = FastAPI(lifespan=routing_table_refresher_starter)
 
     class LintingRequest(BaseModel):
         linter_name: str
         code: str
 
+    class LintingBatchRequest(BaseModel):
+        linter_name: str
+        codes: List[str]
+
     class ResponseMessage(BaseModel):
         status_code: int
         message: str
 
+    class LintSessionStart(BaseModel):
+        linter_name: str
+        code: str
+
+    class LineEdit(BaseModel):
+        start_line: int
+        end_line: int
+        lines: List[str]
+
+    # changes since the last lint of the session, as line edits applied in order or as a unified diff
+    class LintSessionEdits(BaseModel):
+        edits: List[LineEdit] = []
+        diff: str | None = None
+
+    class ViolationMessage(BaseModel):
+        line: int
+        column: int
+        message: str
+
+    class LintSessionResponse(BaseModel):
+        session_id: str
+        status_code: int
+        message: str
+        violations: List[ViolationMessage]
+
     class RolloutRequest(BaseModel):
         linter_name: str
         old_version: str
         new_version: str
         traffic_percent_to_new_version: float
 
+    class LinterInstance(BaseModel):
+        hostport: str
+        name: str
+        version: str
+
+    class RoutingTableUpdate(BaseModel):
+        epoch: int
+        curr_versions: Dict[str, str]
+        instances: List[LinterInstance]
+
     # Order matters here - routes are greedily applied top-down
+    # request with X-Trace-Id header is traced under that id, others are sampled, see tracing.py
     @app.post("/lint_code/", response_model=ResponseMessage)
-    async def lint_code_endpoint(request: LintingRequest):
+    async def lint_code_endpoint(request: LintingRequest, response: Response,
+                                 x_trace_id: str | None = Header(default=None)):
         linter_name = request.linter_name
         code = request.code
-        status_code, message = load_balancer.lint_code(linter_name, code)
+        trace_id = load_balancer.tracer.sample(x_trace_id)
+        if trace_id is not None:
+            response.headers["X-Trace-Id"] = trace_id
+        try:
+            status_code, message = await load_balancer.lint_code(linter_name, code, trace_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Unknown linter {linter_name}")
         return ResponseMessage(status_code=status_code, message=message)
 
+    # results are in the order of codes in the request
+    @app.post("/lint_batch/", response_model=List[ResponseMessage])
+    async def lint_batch_endpoint(request: LintingBatchRequest):
+        try:
+            results = await load_balancer.lint_code_batch(request.linter_name, request.codes)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Unknown linter {request.linter_name}")
+        return [ResponseMessage(status_code=status_code, message=message) for status_code, message in results]
+
+    def lint_session_response(session_id, result):
+        status_code, message, violations = result
+        return LintSessionResponse(session_id=session_id, status_code=status_code, message=message,
+                                   violations=[ViolationMessage(line=line, column=column, message=violation_message)
+                                               for line, column, violation_message in violations])
+
+    # editors start a session with the whole code and then send only what changed, the session stays on one linter
+    # instance and is dropped after --lint_session_idle_timeout seconds without edits
+    @app.post("/lint_session/", response_model=LintSessionResponse)
+    async def start_lint_session_endpoint(request: LintSessionStart):
+        try:
+            return lint_session_response(*await load_balancer.start_lint_session(request.linter_name, request.code))
+        except KeyError as exc:
+            raise HTTPException(status_code=404, detail=exc.args[0])
+
+    @app.post("/lint_session/{session_id}", response_model=LintSessionResponse)
+    async def lint_session_edits_endpoint(session_id: str, request: LintSessionEdits):
+        edits = [(edit.start_line, edit.end_line, edit.lines) for edit in request.edits]
+        if request.diff is not None:
+            edits += edits_from_unified_diff(request.diff)
+        try:
+            result = await load_balancer.lint_session_edits(session_id, edits)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Unknown lint session, start a new one")
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        return lint_session_response(session_id, result)
+
+    @app.delete("/lint_session/{session_id}")
+    async def end_lint_session_endpoint(session_id: str):
+        if not load_balancer.end_lint_session(session_id):
+            raise HTTPException(status_code=404, detail="Unknown lint session")
+
     @app.post("/rollout/")
     async def rollout_endpoint(request: RolloutRequest):
         logging.info(
@@ -55,6 +176,29 @@ def create_app(strategy, machine_management_client, linter_client):
     async def rollback_endpoint(linter_name: str):
         load_balancer.rollout_manager.end_rollout(linter_name)
 
+    # called by machine management whenever linter instances or current versions change
+    @app.post("/update_routing_table/")
+    async def update_routing_table_endpoint(request: RoutingTableUpdate):
+        load_balancer.update_routing_table(request.epoch, request.curr_versions,
+                                           [instance.model_dump() for instance in request.instances])
+
+    # cumulative lint counts and latencies of every linter version, read by the autoscaler in machine management
+    @app.get("/load_report/")
+    async def load_report_endpoint() -> List[dict]:
+        return load_balancer.load_tracker.report()
+
+    @app.get("/stats/")
+    async def stats_endpoint() -> dict:
+        return {"channel_pool": load_balancer.linter_client.channel_pool.stats(),
+                "lint_cache": load_balancer.lint_cache.stats(),
+                "lint_coalescing": load_balancer.coalescing_stats(),
+                "lint_sessions": load_balancer.lint_sessions.stats(),
+                "strategy": load_balancer.strategy.stats()}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics_endpoint():
+        return PlainTextResponse(load_balancer.metrics.render(), media_type=load_balancer.metrics.CONTENT_TYPE)
+
     app.mount("/", StaticFiles(directory="./static", html=True))
 
     return app
@@ -66,11 +210,24 @@ def main():
     parser.add_argument('-host', '--host')
     parser.add_argument('-port', '--port')
     parser.add_argument('-mma', '--machine_management_address')
+    parser.add_argument('-strategy', '--strategy', choices=STRATEGIES.keys(), default="round_robin")
+    parser.add_argument('-cache_mb', '--lint_cache_mb', type=int, default=64)
+    parser.add_argument('-cache_ttl', '--lint_cache_ttl', type=float, default=3600)
+    parser.add_argument('-session_idle', '--lint_session_idle_timeout', type=float, default=600,
+                        help="seconds after which lint sessions without edits are dropped")
+    parser.add_argument('-trace_file', '--trace_file', default=None, help="JSONL file for spans of traced requests")
+    parser.add_argument('-trace_rate', '--trace_sample_rate', type=float, default=0.01,
+                        help="fraction of requests traced without X-Trace-Id header")
     parsed_args = parser.parse_args()
 
     machine_management_client = MachineManagementClient(machine_management_url=parsed_args.machine_management_address)
-    app = create_app(strategy=RoundRobinStrategy(), machine_management_client=machine_management_client,
-                     linter_client=LinterClient())
+    lint_cache = LintResultCache(max_bytes=parsed_args.lint_cache_mb * 1024 * 1024, ttl=parsed_args.lint_cache_ttl)
+    exporter = JsonlSpanExporter(parsed_args.trace_file) if parsed_args.trace_file is not None else None
+    linter_client = AsyncLinterClient(tracer=Tracer("linter_client", exporter))
+    app = create_app(strategy=STRATEGIES[parsed_args.strategy](), machine_management_client=machine_management_client,
+                     linter_client=linter_client, lint_cache=lint_cache,
+                     tracer=Tracer("load_balancer", exporter, parsed_args.trace_sample_rate),
+                     lint_sessions=LintSessionStore(idle_timeout=parsed_args.lint_session_idle_timeout))
 
     uvicorn.run(app, port=int(parsed_args.port), host=parsed_args.host)
 
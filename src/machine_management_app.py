@@ -2,32 +2,57 @@ import argparse
 import logging
 import sys
 import threading
+from contextlib import asynccontextmanager
 from typing import List, Tuple
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 
-from container_manager import SSHContainerManager
+from autoscaler import Autoscaler, AutoscalingPolicy, AutoscalingStatus
+from container_manager import SSHContainerManager, LocalProcessContainerManager
 from machine_manager import LoadBalancerClient, LinterEndpoint, MachineManager, RegisterLinterData, RolloutRequest, \
-    StartLintersRequest, AutoRolloutRequest
+    StartLintersRequest, AutoRolloutRequest, RoutingTable, StartLintersOperation, \
+    ColdStartTimes, WarmPoolRequest, WarmPoolStatus
 
+CONTAINER_MANAGERS = {"ssh": SSHContainerManager,
+                      "local": LocalProcessContainerManager}
 
-def create_app(load_balancer_client):
-    app = FastAPI()
+
+def create_app(load_balancer_client, container_manager_factory=SSHContainerManager, max_parallel_starts_per_machine=4,
+               warm_pool_size=0, autoscaling_interval=10):
     machine_manager = MachineManager(load_balancer_client=load_balancer_client,
-                                     container_manager_factory=SSHContainerManager)
+                                     container_manager_factory=container_manager_factory,
+                                     max_parallel_starts_per_machine=max_parallel_starts_per_machine,
+                                     warm_pool_size=warm_pool_size)
+    autoscaler = Autoscaler(machine_manager, load_balancer_client.get_load_report, interval=autoscaling_interval)
+
+    @asynccontextmanager
+    async def autoscaler_starter(app_arg):
+        threading.Thread(target=autoscaler.run, daemon=True).start()
+
+        yield
+
+        autoscaler.stop()
+
+    app = FastAPI(lifespan=autoscaler_starter)
+    # handlers which wait for machines or load balancer are plain functions, FastAPI runs them in its thread pool,
+    # so that polling of start operations and of the routing table is answered in the meantime
 
     class AddMachine(BaseModel):
         host: str
 
     @app.post("/add_machine/")
-    async def add_machine(request: AddMachine):
+    def add_machine(request: AddMachine):
         return machine_manager.add_machine(request.host)
 
-    @app.post("delete_machine/")
-    async def delete_machine(host: str):
-        return machine_manager.delete_machine(host)
+    @app.post("/delete_machine/")
+    def delete_machine(host: str):
+        try:
+            return machine_manager.delete_machine(host)
+        except ValueError as exc:
+            raise HTTPException(status_code=409, detail=str(exc))
 
     @app.get("/list_machines/")
     async def list_machines() -> List[str]:
@@ -36,12 +61,12 @@ def create_app(load_balancer_client):
     # Linter management
 
     @app.post("/register_linter/")
-    async def register_linter(request: RegisterLinterData):
+    def register_linter(request: RegisterLinterData):
         """Register a new linter or a new version, but without starting any instances."""
         machine_manager.register_linter(request.linter_name, request.linter_version, request.docker_image)
 
     @app.post("/remove_linter/")
-    async def remove_linter(linter_name: str, linter_version: str):
+    def remove_linter(linter_name: str, linter_version: str):
         """Deregister a given linter version, killing all its running instances."""
         return machine_manager.remove_linter(linter_name, linter_version)
 
@@ -62,12 +87,60 @@ def create_app(load_balancer_client):
     async def list_linter_instances(linter_name: str, linter_version: str) -> List[str]:
         return machine_manager.list_linters_instances(linter_name, linter_version)
 
+    @app.get("/routing_table/")
+    async def routing_table() -> RoutingTable:
+        """Everything load balancer needs to route requests, also pushed to it on every change."""
+        return machine_manager.get_routing_table()
+
     @app.post("/start_linters/")
-    async def start_linters(request: StartLintersRequest):
+    def start_linters(request: StartLintersRequest) -> StartLintersOperation:
+        """Start instances in the background, returns operation which can be polled for progress."""
         return machine_manager.start_linters(request)
 
+    @app.get("/start_linters/{operation_id}")
+    async def start_linters_progress(operation_id: str) -> StartLintersOperation:
+        operation = machine_manager.get_start_operation(operation_id)
+        if operation is None:
+            raise HTTPException(status_code=404, detail="Unknown operation")
+        return operation
+
+    @app.post("/warm_pool/")
+    def set_warm_pool_size(request: WarmPoolRequest):
+        """Keep started containers of a linter version ready for scale-ups and restarts."""
+        try:
+            machine_manager.set_warm_pool_size(request.linter_name, request.linter_version, request.size)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Unknown linter")
+
+    @app.get("/warm_pool/")
+    async def warm_pools() -> List[WarmPoolStatus]:
+        return machine_manager.get_warm_pools()
+
+    @app.post("/autoscaler/policy/")
+    async def set_autoscaling_policy(policy: AutoscalingPolicy):
+        """Scale the current version of the linter with load reported by load balancer."""
+        autoscaler.set_policy(policy)
+
+    @app.post("/autoscaler/remove_policy/")
+    async def remove_autoscaling_policy(linter_name: str):
+        autoscaler.remove_policy(linter_name)
+
+    @app.get("/autoscaler/policies/")
+    async def autoscaling_policies() -> List[AutoscalingPolicy]:
+        return autoscaler.get_policies()
+
+    @app.get("/autoscaler/")
+    async def autoscaling_statuses() -> List[AutoscalingStatus]:
+        """Load and desired number of instances of autoscaled linters, as of the last autoscaler step."""
+        return autoscaler.get_statuses()
+
+    @app.get("/cold_start_times/")
+    async def cold_start_times() -> List[ColdStartTimes]:
+        """Time from starting a container to the linter serving, per docker image."""
+        return machine_manager.get_cold_start_times()
+
     @app.post("/rollout/")
-    async def rollout(request: RolloutRequest):
+    def rollout(request: RolloutRequest):
         return machine_manager.rollout(request)
 
     @app.post("/auto_rollout/")
@@ -78,25 +151,29 @@ def create_app(load_balancer_client):
         return
 
     @app.post("/rollback/")
-    async def rollback(linter_name: str, linter_version: str | None = None):
+    def rollback(linter_name: str, linter_version: str | None = None):
         logging.info("machine_management got rollback request")
         return machine_manager.rollback(linter_name, linter_version)
 
     # receive report from health check and restart broken linters
     @app.post("/report_broken_linters/")
-    async def report_broken_linters(host_ports: List[str]):
+    def report_broken_linters(host_ports: List[str]):
         logging.info("machine_management got broken linters report")
         return machine_manager.restart_broken_linters(host_ports)
 
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        return PlainTextResponse(machine_manager.metrics.render(), media_type=machine_manager.metrics.CONTENT_TYPE)
+
     ########################
     # DEBUG ENDPOINTS
     ########################
     @app.post("/unsafe_start_linter/")  # debug and admin intervention, works for previously added linter
-    async def start_linter(linter_name: str, linter_version: str, host: str) -> Tuple[str, int]:
+    def start_linter(linter_name: str, linter_version: str, host: str) -> Tuple[str, int]:
         return machine_manager.start_linter_instance(linter_name, linter_version, host)
 
     @app.post("/unsafe_stop_linter/")  # debug and admin intervention
-    async def stop_linter(machine: str, container_name: str):
+    def stop_linter(machine: str, container_name: str):
         return machine_manager.stop_linter_instance(machine, container_name)
 
     return app
@@ -108,11 +185,22 @@ def main():
     parser.add_argument('-host', '--host')
     parser.add_argument('-port', '--port')
     parser.add_argument('-lba', '--load_balancer_address')
+    parser.add_argument('-starts', '--max_parallel_starts_per_machine', type=int, default=4)
+    parser.add_argument('-warm', '--warm_pool_size', type=int, default=0,
+                        help="started containers kept ready for each linter version")
+    parser.add_argument('-autoscaling', '--autoscaling_interval', type=float, default=10,
+                        help="seconds between autoscaler steps")
+    parser.add_argument('-cm', '--container_manager', choices=CONTAINER_MANAGERS.keys(), default="ssh",
+                        help="local runs linters as processes of this machine instead of Docker containers")
     parsed_args = parser.parse_args()
 
     load_balancer_client = LoadBalancerClient(load_balancer_url=parsed_args.load_balancer_address)
 
-    app = create_app(load_balancer_client=load_balancer_client)
+    app = create_app(load_balancer_client=load_balancer_client,
+                     container_manager_factory=CONTAINER_MANAGERS[parsed_args.container_manager],
+                     max_parallel_starts_per_machine=parsed_args.max_parallel_starts_per_machine,
+                     warm_pool_size=parsed_args.warm_pool_size,
+                     autoscaling_interval=parsed_args.autoscaling_interval)
 
     uvicorn.run(app, port=int(parsed_args.port), host=parsed_args.host)
 
@@ -1,12 +1,16 @@
 import logging
 import threading
 import time
-from typing import Callable, Dict, List, Tuple
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple
 
 import requests
 from pydantic import BaseModel
 
 from container_manager import ContainerManager
+from metrics import MetricsRegistry
 
 
 class LoadBalancerClient:
@@ -19,6 +23,24 @@ class LoadBalancerClient:
     def rollback(self, linter_name):
         requests.post(f"{self.load_balancer_url}/rollback/", params={"linter_name": linter_name})
 
+    # cumulative lint counts and latencies of every linter version, see LinterLoadTracker in load_balancer.py
+    def get_load_report(self) -> List[dict]:
+        response = requests.get(f"{self.load_balancer_url}/load_report/", timeout=5)
+        response.raise_for_status()
+        return response.json()
+
+    # best effort, load balancer polls the routing table itself if it misses an update
+    def update_routing_table(self, routing_table):
+        try:
+            requests.post(f"{self.load_balancer_url}/update_routing_table/", json=routing_table.model_dump(),
+                          timeout=5)
+        except requests.RequestException as exc:
+            logging.warning(f"Could not send routing table to load balancer: {exc}")
+
+
+# (container name, linter name, linter version)
+InstanceKey = Tuple[str, str, str]
+
 
 class RunningLinter(BaseModel):
     # machine means only host not port, because we connect by ssh using default ssh port
@@ -31,6 +53,13 @@ class RunningLinter(BaseModel):
     def get_host_port(self):
         return f"{self.machine.split(':')[0]}:{self.exposed_port}"
 
+    def key(self) -> InstanceKey:
+        return self.container_name, self.linter_name, self.linter_version
+
+    # instance of another linter served by the same container
+    def with_linter(self, linter_name: str, linter_version: str) -> "RunningLinter":
+        return self.model_copy(update={"linter_name": linter_name, "linter_version": linter_version})
+
 
 # The public counterpart to RunningLinter
 class LinterEndpoint(BaseModel):
@@ -39,6 +68,116 @@ class LinterEndpoint(BaseModel):
     version: str
 
 
+# Everything load balancer needs to choose a linter instance
+class RoutingTable(BaseModel):
+    # grows with every change, lets load balancer ignore notifications delivered out of order
+    epoch: int
+    curr_versions: Dict[str, str]
+    instances: List[LinterEndpoint]
+
+
+# Running linter instances indexed by everything machine manager looks them up by, so lookups don't depend on
+# the number of instances. A container serving many linters is an instance of each of them, instances are keyed
+# by (container name, linter name, linter version). Not thread safe, machine manager guards it with its lock.
+class LinterRegistry:
+    def __init__(self):
+        self.by_key: Dict[InstanceKey, RunningLinter] = {}
+        # container name -> key -> instance, container names are unique
+        self.by_container_name: Dict[str, Dict[InstanceKey, RunningLinter]] = {}
+        self.by_host_port: Dict[str, Dict[InstanceKey, RunningLinter]] = {}
+        # (linter_name, linter_version) -> key -> instance
+        self.by_name_version: Dict[Tuple[str, str], Dict[InstanceKey, RunningLinter]] = {}
+        # machine -> key -> instance
+        self.by_machine: Dict[str, Dict[InstanceKey, RunningLinter]] = {}
+
+        # built on first use after a change, callers must not modify them
+        self.host_ports_cache: Dict[Tuple[str, str], List[str]] = {}
+        self.endpoints_cache: List[LinterEndpoint] | None = None
+
+    def __len__(self):
+        return len(self.by_key)
+
+    def __iter__(self) -> Iterator[RunningLinter]:
+        return iter(self.by_key.values())
+
+    def add(self, linter: RunningLinter):
+        key = linter.key()
+        self.by_key[key] = linter
+        self.by_container_name.setdefault(linter.container_name, {})[key] = linter
+        self.by_host_port.setdefault(linter.get_host_port(), {})[key] = linter
+        self.by_name_version.setdefault((linter.linter_name, linter.linter_version), {})[key] = linter
+        self.by_machine.setdefault(linter.machine, {})[key] = linter
+        self._invalidate(linter)
+
+    # removes all instances in the container, returns them
+    def remove(self, machine: str, container_name: str) -> List[RunningLinter]:
+        linters = self.in_container(container_name)
+        if not linters or linters[0].machine != machine:
+            return []
+        for linter in linters:
+            self.remove_instance(linter)
+        return linters
+
+    # returns False if there is no such instance
+    def remove_instance(self, linter: RunningLinter) -> bool:
+        key = linter.key()
+        if key not in self.by_key:
+            return False
+
+        del self.by_key[key]
+        self._remove_from_index(self.by_container_name, linter.container_name, key)
+        self._remove_from_index(self.by_host_port, linter.get_host_port(), key)
+        self._remove_from_index(self.by_name_version, (linter.linter_name, linter.linter_version), key)
+        self._remove_from_index(self.by_machine, linter.machine, key)
+        self._invalidate(linter)
+        return True
+
+    def contains(self, linter: RunningLinter) -> bool:
+        return linter.key() in self.by_key
+
+    def at_host_port(self, host_port: str) -> List[RunningLinter]:
+        return list(self.by_host_port.get(host_port, {}).values())
+
+    def in_container(self, container_name: str) -> List[RunningLinter]:
+        return list(self.by_container_name.get(container_name, {}).values())
+
+    def with_name_version(self, linter_name: str, linter_version: str) -> List[RunningLinter]:
+        return list(self.by_name_version.get((linter_name, linter_version), {}).values())
+
+    def count(self, linter_name: str, linter_version: str) -> int:
+        return len(self.by_name_version.get((linter_name, linter_version), ()))
+
+    def on_machine(self, machine: str) -> List[RunningLinter]:
+        return list(self.by_machine.get(machine, {}).values())
+
+    def host_ports(self, linter_name: str, linter_version: str) -> List[str]:
+        key = (linter_name, linter_version)
+        host_ports = self.host_ports_cache.get(key)
+        if host_ports is None:
+            host_ports = [linter.get_host_port() for linter in self.by_name_version.get(key, {}).values()]
+            self.host_ports_cache[key] = host_ports
+        return host_ports
+
+    def endpoints(self) -> List[LinterEndpoint]:
+        if self.endpoints_cache is None:
+            # hostport: get only host from machine and add port to particular linter
+            self.endpoints_cache = [LinterEndpoint(hostport=linter.get_host_port(),
+                                                   name=linter.linter_name,
+                                                   version=linter.linter_version) for linter in self]
+        return self.endpoints_cache
+
+    @staticmethod
+    def _remove_from_index(index: Dict, key, instance_key: InstanceKey):
+        linters = index[key]
+        del linters[instance_key]
+        if not linters:
+            del index[key]
+
+    def _invalidate(self, linter: RunningLinter):
+        self.host_ports_cache.pop((linter.linter_name, linter.linter_version), None)
+        self.endpoints_cache = None
+
+
 class RegisterLinterData(BaseModel):
     linter_name: str
     linter_version: str
@@ -51,6 +190,45 @@ class StartLintersRequest(BaseModel):
     n_instances: int
 
 
+# Progress of starting linter instances requested with one StartLintersRequest
+class StartLintersOperation(BaseModel):
+    operation_id: str
+    linter_name: str
+    linter_version: str
+    n_instances: int
+    n_started: int = 0
+    # started instances which were taken from the warm pool
+    n_from_warm_pool: int = 0
+    # started instances served by already running containers of the same docker image
+    n_from_shared_containers: int = 0
+    n_failed: int = 0
+    errors: List[str] = []
+    done: bool = False
+
+
+# How long it takes for instances of a docker image to start answering requests, over the recent starts
+class ColdStartTimes(BaseModel):
+    docker_image: str
+    n_starts: int
+    mean: float
+    max: float
+    last: float
+
+
+class WarmPoolRequest(BaseModel):
+    linter_name: str
+    linter_version: str
+    size: int
+
+
+class WarmPoolStatus(BaseModel):
+    linter_name: str
+    linter_version: str
+    size: int
+    n_ready: int
+    n_starting: int
+
+
 class RolloutRequest(BaseModel):
     linter_name: str
     old_version: str
@@ -73,8 +251,14 @@ class AutoRolloutRequest(BaseModel):
 
 class MachineManager:
 
+    # keeps that many finished operations for polling
+    MAX_OPERATIONS = 1000
+    # keeps that many cold start times per docker image
+    MAX_COLD_STARTS = 100
+
     def __init__(self, container_manager_factory: Callable[[str], ContainerManager],
-                 load_balancer_client: LoadBalancerClient):
+                 load_balancer_client: LoadBalancerClient, max_parallel_starts_per_machine: int = 4,
+                 warm_pool_size: int = 0, metrics: MetricsRegistry = None):
         self.container_manager_factory = container_manager_factory
         self.load_balancer_client = load_balancer_client
 
@@ -82,20 +266,62 @@ class MachineManager:
 
         self.container_managers: Dict[str, ContainerManager] = {}
 
-        # for each machine gives current number of linters working there
+        # for each machine gives current number of linters working or being started there
         self.machine_to_n_linters: Dict[str, int] = {}
+        # for each machine the number of containers being started there, which use its container manager
+        self.machine_to_n_starting: Dict[str, int] = {}
 
-        self.running_linters: List[RunningLinter] = []
+        # guards the registry, machine_to_n_linters and current versions, which are changed by parallel starts
+        self.lock = threading.RLock()
+
+        # containers are started in parallel, but each machine runs at most that many docker commands at once
+        self.max_parallel_starts_per_machine = max_parallel_starts_per_machine
+        self.machine_start_semaphores: Dict[str, threading.Semaphore] = {}
+        self.start_executor = ThreadPoolExecutor(max_workers=64)
+        self.start_operations: OrderedDict[str, StartLintersOperation] = OrderedDict()
+
+        self.registry = LinterRegistry()
 
         # (linter_name, linter_version) -> docker image
         self.linter_images: Dict[Tuple[str, str], str] = {}
 
         self.linter_name_to_curr_version: Dict[str, str] = {}
 
+        # started but not registered containers, which scale-ups and restarts take instead of starting new ones;
+        # each registered linter version gets warm_pool_size of them unless set otherwise
+        self.default_warm_pool_size = warm_pool_size
+        # (linter_name, linter_version) -> number of containers to keep in the pool
+        self.warm_pool_sizes: Dict[Tuple[str, str], int] = {}
+        # (linter_name, linter_version) -> ready containers, counted in machine_to_n_linters
+        self.warm_pools: Dict[Tuple[str, str], deque] = {}
+        self.warm_pool_n_starting: Dict[Tuple[str, str], int] = {}
+
+        # docker image -> seconds from starting a container to the linter serving, most recent last
+        self.cold_start_times: Dict[str, deque] = {}
+
         self.rollout_lock = threading.Lock()
         # tells if there is auto rollout active for current linter
         self.linter_name_to_auto_rollout: Dict[str, bool] = {}
 
+        # starts from current time so that load balancer accepts updates after machine management restart
+        self.routing_epoch = time.time_ns()
+
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.container_start_duration = self.metrics.histogram(
+            "container_start_duration_seconds", "Time from starting a container to the linter serving",
+            ["linter", "version", "machine"])
+        self.container_start_failures = self.metrics.counter(
+            "container_start_failures_total", "Containers which failed to start", ["linter", "version", "machine"])
+        self.container_stop_duration = self.metrics.histogram(
+            "container_stop_duration_seconds", "Time to stop a container", ["machine"])
+        self.linter_instances_gauge = self.metrics.gauge(
+            "linter_instances", "Registered linter instances", ["linter", "version"])
+        self.warm_pool_gauge = self.metrics.gauge(
+            "warm_pool_ready", "Started containers waiting in the warm pool", ["linter", "version"])
+        self.machine_linters_gauge = self.metrics.gauge(
+            "machine_linters", "Linter containers running or starting on a machine", ["machine"])
+        self.metrics.add_collector(self.collect_metrics)
+
     #############
     # MACHINES
     #############
@@ -103,15 +329,45 @@ class MachineManager:
         container_manager = self.container_manager_factory(host)
         self.registered_machines.append(host)
         self.container_managers[host] = container_manager
-        self.machine_to_n_linters[host] = 0
+        self.machine_start_semaphores[host] = threading.Semaphore(self.max_parallel_starts_per_machine)
+        with self.lock:
+            self.machine_to_n_linters[host] = 0
+            self.machine_to_n_starting[host] = 0
         logging.info(f"Added machine {host}")
 
+    # raises ValueError while containers are being started on the machine, they need its container manager,
+    # and while linters run there, they would stay registered on a machine which is gone.
+    # Containers waiting in warm pools on the machine are stopped, the pools are refilled on other machines.
     def delete_machine(self, host: str) -> None:
+        with self.lock:
+            if self.machine_to_n_starting[host] > 0:
+                raise ValueError(f"Containers are being started on {host}, delete the machine when they are started")
+            pooled_on_host = []
+            for pool in self.warm_pools.values():
+                pooled_on_host += [linter_instance for linter_instance in pool if linter_instance.machine == host]
+            # registered and draining containers
+            if self.machine_to_n_linters[host] > len(pooled_on_host):
+                raise ValueError(f"Linters are running on {host}, stop them before deleting the machine")
+            # the machine is not chosen for new starts anymore
+            self.machine_to_n_linters.pop(host)
+            self.machine_to_n_starting.pop(host)
+            for key, pool in self.warm_pools.items():
+                self.warm_pools[key] = deque(linter_instance for linter_instance in pool
+                                             if linter_instance.machine != host)
+
+        for linter_instance in pooled_on_host:
+            try:
+                self._stop_container(host, linter_instance.container_name)
+            except Exception:
+                logging.exception(f"Could not stop container {linter_instance.container_name} on {host}")
         self.registered_machines.remove(host)
-        self.container_managers.pop(host)
-        self.machine_to_n_linters.pop(host)
+        self.container_managers.pop(host).close()
+        self.machine_start_semaphores.pop(host)
         logging.info(f"Removed machine {host}")
 
+        for linter_name, linter_version in {(linter.linter_name, linter.linter_version) for linter in pooled_on_host}:
+            self._refill_warm_pool(linter_name, linter_version)
+
     def list_machines(self):
         return self.registered_machines
 
@@ -121,17 +377,19 @@ class MachineManager:
     def register_linter(self, linter_name, linter_version, docker_image):
         self.linter_images[linter_name, linter_version] = docker_image
         logging.info(f"Registered linter {linter_name} in version {linter_version}")
+        self.set_warm_pool_size(linter_name, linter_version, self.default_warm_pool_size)
 
     def remove_linter(self, linter_name, linter_version):
         """Kill all linter instances and deregister"""
         logging.info(f"Removing linter named {linter_name}, version {linter_version}")
 
         self.linter_images.pop((linter_name, linter_version), "ignore if not exists")
+        self.set_warm_pool_size(linter_name, linter_version, 0)
 
-        running_instances = [linter for linter in self.running_linters if
-                             linter.linter_name == linter_name and linter.linter_version == linter_version]
+        with self.lock:
+            running_instances = self.registry.with_name_version(linter_name, linter_version)
         for linter in running_instances:
-            self.stop_linter_instance(linter.machine, linter.container_name)
+            self._stop_linter_instance_of_container(linter)
 
         # remove docker images of all versions of linter with [linter_name]
         # versions = [version for (name, version) in self.linter_images.keys() if name == linter_name]
@@ -147,65 +405,368 @@ class MachineManager:
     #############
     def start_linter_instance(self, linter_name, linter_version, machine) -> Tuple[str, int]:
         """Start a new instance of a given registered linter"""
+        with self.lock:
+            self._reserve_machine(machine)
+        return self._start_linter_instance_on_reserved_machine(linter_name, linter_version, machine)
+
+    # the place on [machine] must be already counted in machine_to_n_linters, so that parallel starts
+    # see it when choosing machines
+    def _start_linter_instance_on_reserved_machine(self, linter_name, linter_version, machine) -> Tuple[str, int]:
         logging.info(f"Starting linter {linter_name} v {linter_version} instance on {machine}")
+        linter_instance = self._start_container_on_reserved_machine(linter_name, linter_version, machine)
+        logging.info(f"Started linter {linter_name} v {linter_version} instance on {machine} "
+                     f"port {linter_instance.exposed_port} as {linter_instance.container_name}")
+
+        self._register_linter_instances([linter_instance])
+
+        return linter_instance.container_name, linter_instance.exposed_port
 
+    # counts a container about to be started on [machine], which is then started by
+    # _start_container_on_reserved_machine; raises KeyError for machines which are not registered.
+    # Must be called with the lock held.
+    def _reserve_machine(self, machine):
+        self.machine_to_n_linters[machine] += 1
+        self.machine_to_n_starting[machine] += 1
+
+    # starts a container without registering it, releases the place on [machine] if that fails
+    def _start_container_on_reserved_machine(self, linter_name, linter_version, machine) -> RunningLinter:
+        try:
+            cont_manager = self.container_managers[machine]
+            docker_image = self.linter_images[linter_name, linter_version]
+            with self.machine_start_semaphores[machine]:
+                start_time = time.monotonic()
+                port, container_name = cont_manager.start_container(docker_image=docker_image)
+                cold_start_time = time.monotonic() - start_time
+        except Exception:
+            with self.lock:
+                self.machine_to_n_linters[machine] -= 1
+                self.machine_to_n_starting[machine] -= 1
+            self.container_start_failures.labels(linter_name, linter_version, machine).inc()
+            raise
+
+        with self.lock:
+            self.machine_to_n_starting[machine] -= 1
+            self.cold_start_times.setdefault(docker_image, deque(maxlen=self.MAX_COLD_STARTS)).append(cold_start_time)
+        self.container_start_duration.labels(linter_name, linter_version, machine).observe(cold_start_time)
+
+        return RunningLinter(machine=machine,
+                             container_name=container_name,
+                             linter_version=linter_version,
+                             linter_name=linter_name,
+                             exposed_port=port)
+
+    # make started containers visible to load balancer and health check
+    def _register_linter_instances(self, linter_instances: List[RunningLinter]):
+        with self.lock:
+            for linter_instance in linter_instances:
+                self._add_linter_instance(linter_instance)
+
+        self.publish_routing_table()
+
+    # must be called with the lock held
+    def _add_linter_instance(self, linter_instance: RunningLinter):
         # if we add the very first linter of the name [linter_name] set current version
         # for its name to its version
-        if linter_name not in self.linter_name_to_curr_version:
-            self.linter_name_to_curr_version[linter_name] = linter_version
-
-        cont_manager = self.container_managers[machine]
-        docker_image = self.linter_images[linter_name, linter_version]
-        port, container_name = cont_manager.start_container(docker_image=docker_image)
-        logging.info(
-            f"Started linter {linter_name} v {linter_version} instance on {machine} port {port} as {container_name}")
-        linter_instance = RunningLinter(machine=machine,
-                                        container_name=container_name,
-                                        linter_version=linter_version,
-                                        linter_name=linter_name,
-                                        exposed_port=port)
-
-        self.running_linters.append(linter_instance)
-
-        # If we appended a new running linter we can safely increase this dict
-        self.machine_to_n_linters[machine] += 1
-
-        return container_name, port
+        if linter_instance.linter_name not in self.linter_name_to_curr_version:
+            self.linter_name_to_curr_version[linter_instance.linter_name] = linter_instance.linter_version
+
+        self.registry.add(linter_instance)
+
+    # An instance of a linter in a running container of the same docker image which does not serve that linter yet,
+    # None if there is no such container. Images of multi-linter servers are registered once for each linter they
+    # serve, so these linters share containers instead of each starting its own.
+    # Must be called with the lock held, the instance is not registered.
+    def _shared_instance(self, linter_name, linter_version, machine=None, taken=()) -> RunningLinter | None:
+        docker_image = self.linter_images.get((linter_name, linter_version))
+        if docker_image is None:
+            return None
+        for other_name, other_version in self.linter_images:
+            if self.linter_images[other_name, other_version] != docker_image or \
+                    (other_name, other_version) == (linter_name, linter_version):
+                continue
+            for linter in self.registry.with_name_version(other_name, other_version):
+                if linter.container_name in taken or (machine is not None and linter.machine != machine):
+                    continue
+                shared = linter.with_linter(linter_name, linter_version)
+                if not self.registry.contains(shared):
+                    return shared
+        return None
 
     def stop_linter_instance(self, machine, container_name):
-        """Kill a linter instance"""
+        """Kill a linter container with instances of all linters it serves"""
+        if not self._stop_registered_container(machine, container_name):
+            raise ValueError(f"No linter instance {container_name} on {machine}")
+
+    # stops a container unless it was deregistered already, e.g. by another report of the same broken linter;
+    # returns the linter instances it served, empty if there was nothing to stop
+    def _stop_registered_container(self, machine, container_name) -> List[RunningLinter]:
+        # deregister first, so that neither load balancer nor health check talk to a stopping linter
+        with self.lock:
+            removed = self.registry.remove(machine, container_name)
+            if not removed:
+                return []
+            self.machine_to_n_linters[machine] -= 1
+
+        self.publish_routing_table()
+
+        self._stop_container(machine, container_name)
+        return removed
+
+    # deregisters one linter served by a container, the container is stopped with its last linter,
+    # drain_seconds after load balancer was told that the linter is gone
+    def _stop_linter_instance_of_container(self, linter: RunningLinter, drain_seconds: float = 0):
+        with self.lock:
+            if not self.registry.remove_instance(linter):
+                return
+            last_in_container = not self.registry.in_container(linter.container_name)
+            # a draining container runs on the machine until it is stopped
+            if last_in_container and drain_seconds <= 0:
+                self.machine_to_n_linters[linter.machine] -= 1
+
+        self.publish_routing_table()
+
+        if last_in_container and drain_seconds > 0:
+            timer = threading.Timer(drain_seconds, self._stop_drained_container,
+                                    (linter.machine, linter.container_name))
+            timer.daemon = True
+            timer.start()
+        elif last_in_container:
+            self._stop_container(linter.machine, linter.container_name)
+
+    def _stop_drained_container(self, machine, container_name):
+        try:
+            self._stop_container(machine, container_name)
+        except Exception:
+            logging.exception(f"Could not stop drained container {container_name} on {machine}")
+        with self.lock:
+            self.machine_to_n_linters[machine] -= 1
+
+    def _stop_container(self, machine, container_name):
+        start_time = time.monotonic()
         self.container_managers[machine].stop_container(container_name)
-
-        linter_instance = None
-        for linter in self.running_linters:
-            if linter.machine == machine and linter.container_name == container_name:
-                linter_instance = linter
-                break
-        self.running_linters.remove(linter_instance)
-        self.machine_to_n_linters[machine] -= 1
+        self.container_stop_duration.labels(machine).observe(time.monotonic() - start_time)
+
+    def stop_linter_instances(self, linter_name, linter_version, n_instances, drain_seconds: float = 0):
+        """Stop [n_instances] instances of a linter version, taking them from the most loaded machines first.
+        Their containers keep running for [drain_seconds] after the routing table without them is published,
+        so that lints in flight on them can finish"""
+        with self.lock:
+            instances = sorted(self.registry.with_name_version(linter_name, linter_version),
+                               key=lambda linter: self.machine_to_n_linters[linter.machine], reverse=True)
+        for linter in instances[:n_instances]:
+            self._stop_linter_instance_of_container(linter, drain_seconds)
+
+    def count_linter_instances(self, linter_name, linter_version) -> int:
+        with self.lock:
+            return self.registry.count(linter_name, linter_version)
+
+    def get_curr_version(self, linter_name) -> str | None:
+        with self.lock:
+            return self.linter_name_to_curr_version.get(linter_name)
 
     def list_linters(self) -> List[LinterEndpoint]:
-        # hostport: get only host from machine and add port to particular linter
-        return [LinterEndpoint(hostport=linter.get_host_port(),
-                               name=linter.linter_name,
-                               version=linter.linter_version) for linter in self.running_linters]
+        with self.lock:
+            return list(self.registry.endpoints())
 
     # returns list of host_ports of linter instances with linter_name and current version
     def list_linters_with_curr_version(self, linter_name: str):
-        return [linter.get_host_port() for linter in self.running_linters if linter.linter_name == linter_name
-                and linter.linter_version == self.linter_name_to_curr_version[linter_name]]
+        with self.lock:
+            curr_version = self.linter_name_to_curr_version.get(linter_name)
+            if curr_version is None:
+                return []
+            return self.registry.host_ports(linter_name, curr_version)
 
     def list_linters_instances(self, linter_name: str, linter_version: str):
-        return [linter.get_host_port() for linter in self.running_linters if linter.linter_name == linter_name
-                and linter.linter_version == linter_version]
+        with self.lock:
+            return self.registry.host_ports(linter_name, linter_version)
 
-    def get_machine_with_least_linters(self) -> str:
-        return min(self.machine_to_n_linters, key=self.machine_to_n_linters.get)
+    #############
+    # WARM POOL
+    #############
+    def set_warm_pool_size(self, linter_name, linter_version, size):
+        """Keep [size] started containers of a registered linter ready to be taken"""
+        key = (linter_name, linter_version)
+        with self.lock:
+            if size > 0 and key not in self.linter_images:
+                raise KeyError(f"Linter {linter_name} in version {linter_version} is not registered")
+            self.warm_pool_sizes[key] = size
+            pool = self.warm_pools.get(key, deque())
+            excess = [pool.pop() for _ in range(max(0, len(pool) - size))]
+
+        for linter_instance in excess:
+            self._stop_unregistered_container(linter_instance)
+        self._refill_warm_pool(linter_name, linter_version)
+
+    def get_warm_pools(self) -> List[WarmPoolStatus]:
+        with self.lock:
+            return [WarmPoolStatus(linter_name=name, linter_version=version, size=size,
+                                   n_ready=len(self.warm_pools.get((name, version), ())),
+                                   n_starting=self.warm_pool_n_starting.get((name, version), 0))
+                    for (name, version), size in self.warm_pool_sizes.items()]
+
+    # pooled containers are not health checked while they wait, so each one is probed before it's taken and
+    # stopped if its linter doesn't answer. Must be called without the lock held, probes can take a while.
+    def _take_from_warm_pool(self, linter_name, linter_version) -> RunningLinter | None:
+        while True:
+            with self.lock:
+                pool = self.warm_pools.get((linter_name, linter_version))
+                if not pool:
+                    return None
+                linter_instance = pool.popleft()
+                container_manager = self.container_managers[linter_instance.machine]
+            if container_manager.is_serving(linter_instance.exposed_port):
+                return linter_instance
+            logging.warning(f"Linter {linter_name} v {linter_version} in the warm pool at "
+                            f"{linter_instance.get_host_port()} is not serving, stopping it")
+            try:
+                self._stop_unregistered_container(linter_instance)
+            except Exception:
+                logging.exception(f"Could not stop container {linter_instance.container_name}")
+
+    # start containers missing in the pool in the background
+    def _refill_warm_pool(self, linter_name, linter_version):
+        key = (linter_name, linter_version)
+        with self.lock:
+            if not self.machine_to_n_linters:
+                return
+            n_missing = (self.warm_pool_sizes.get(key, 0) - len(self.warm_pools.get(key, ()))
+                         - self.warm_pool_n_starting.get(key, 0))
+            for _ in range(n_missing):
+                machine = self.get_machine_with_least_linters()
+                self._reserve_machine(machine)
+                self.warm_pool_n_starting[key] = self.warm_pool_n_starting.get(key, 0) + 1
+                self.start_executor.submit(self._start_warm_container, linter_name, linter_version, machine)
+
+    def _start_warm_container(self, linter_name, linter_version, machine):
+        key = (linter_name, linter_version)
+        try:
+            linter_instance = self._start_container_on_reserved_machine(linter_name, linter_version, machine)
+        except Exception:
+            # not retried right away, the next take from the pool tries again
+            logging.exception(f"Could not start linter {linter_name} v {linter_version} for the warm pool")
+            with self.lock:
+                self.warm_pool_n_starting[key] -= 1
+            return
+
+        with self.lock:
+            self.warm_pool_n_starting[key] -= 1
+            # the pool could have been shrunk in the meantime
+            keep = len(self.warm_pools.get(key, ())) < self.warm_pool_sizes.get(key, 0)
+            if keep:
+                self.warm_pools.setdefault(key, deque()).append(linter_instance)
+        if not keep:
+            self._stop_unregistered_container(linter_instance)
+
+    def _stop_unregistered_container(self, linter_instance: RunningLinter):
+        with self.lock:
+            self.machine_to_n_linters[linter_instance.machine] -= 1
+        self._stop_container(linter_instance.machine, linter_instance.container_name)
+
+    # copies current state into metrics
+    def collect_metrics(self):
+        with self.lock:
+            self.linter_instances_gauge.clear()
+            for linter_name, linter_version in self.registry.by_name_version:
+                self.linter_instances_gauge.labels(linter_name, linter_version).set(
+                    self.registry.count(linter_name, linter_version))
+            self.warm_pool_gauge.clear()
+            for (linter_name, linter_version), pool in self.warm_pools.items():
+                self.warm_pool_gauge.labels(linter_name, linter_version).set(len(pool))
+            self.machine_linters_gauge.clear()
+            for machine, n_linters in self.machine_to_n_linters.items():
+                self.machine_linters_gauge.labels(machine).set(n_linters)
+
+    def get_cold_start_times(self) -> List[ColdStartTimes]:
+        with self.lock:
+            return [ColdStartTimes(docker_image=docker_image, n_starts=len(times), mean=sum(times) / len(times),
+                                   max=max(times), last=times[-1])
+                    for docker_image, times in self.cold_start_times.items()]
+
+    def get_routing_table(self) -> RoutingTable:
+        with self.lock:
+            return RoutingTable(epoch=self.routing_epoch, curr_versions=dict(self.linter_name_to_curr_version),
+                                instances=self.list_linters())
+
+    # notify load balancer about changed linter instances or current versions
+    def publish_routing_table(self):
+        with self.lock:
+            self.routing_epoch += 1
+            routing_table = self.get_routing_table()
+        self.load_balancer_client.update_routing_table(routing_table)
 
-    def start_linters(self, request: StartLintersRequest):
-        for i in range(request.n_instances):
-            machine = self.get_machine_with_least_linters()
-            self.start_linter_instance(request.linter_name, request.linter_version, machine)
+    def get_machine_with_least_linters(self) -> str:
+        with self.lock:
+            return min(self.machine_to_n_linters, key=self.machine_to_n_linters.get)
+
+    def start_linters(self, request: StartLintersRequest) -> StartLintersOperation:
+        """Serve the linter from running containers of the same image, take instances from the warm pool
+        and start the rest in the background, the returned operation can be polled with get_start_operation"""
+        operation = StartLintersOperation(operation_id=str(uuid.uuid4()), linter_name=request.linter_name,
+                                          linter_version=request.linter_version, n_instances=request.n_instances)
+        pooled_instances = []
+        with self.lock:
+            self.start_operations[operation.operation_id] = operation
+            while len(self.start_operations) > self.MAX_OPERATIONS:
+                self.start_operations.popitem(last=False)
+
+            # added under the lock, so that the shared containers can't be stopped before
+            shared_containers = set()
+            while len(shared_containers) < request.n_instances:
+                linter_instance = self._shared_instance(request.linter_name, request.linter_version,
+                                                        taken=shared_containers)
+                if linter_instance is None:
+                    break
+                self._add_linter_instance(linter_instance)
+                shared_containers.add(linter_instance.container_name)
+                operation.n_started += 1
+                operation.n_from_shared_containers += 1
+
+        while len(shared_containers) + len(pooled_instances) < request.n_instances:
+            linter_instance = self._take_from_warm_pool(request.linter_name, request.linter_version)
+            if linter_instance is None:
+                break
+            pooled_instances.append(linter_instance)
+
+        with self.lock:
+            operation.n_started += len(pooled_instances)
+            operation.n_from_warm_pool += len(pooled_instances)
+            for _ in range(request.n_instances - operation.n_started):
+                # reserve the place right away, so that the next instance goes to another machine
+                machine = self.get_machine_with_least_linters()
+                self._reserve_machine(machine)
+                self.start_executor.submit(self._start_linter_instance_for_operation, operation, machine)
+
+            operation.done = operation.n_started == operation.n_instances
+            operation_copy = operation.model_copy()
+
+        if pooled_instances:
+            self._register_linter_instances(pooled_instances)
+        elif shared_containers:
+            self.publish_routing_table()
+        # also replaces pooled containers which were stopped as not serving
+        self._refill_warm_pool(request.linter_name, request.linter_version)
+        return operation_copy
+
+    def _start_linter_instance_for_operation(self, operation: StartLintersOperation, machine):
+        try:
+            self._start_linter_instance_on_reserved_machine(operation.linter_name, operation.linter_version, machine)
+            error = None
+        except Exception as exc:
+            logging.exception(f"Could not start linter {operation.linter_name} v {operation.linter_version}")
+            error = f"{machine}: {exc}"
+
+        with self.lock:
+            if error is None:
+                operation.n_started += 1
+            else:
+                operation.n_failed += 1
+                operation.errors.append(error)
+            operation.done = operation.n_started + operation.n_failed == operation.n_instances
+
+    def get_start_operation(self, operation_id: str) -> StartLintersOperation | None:
+        with self.lock:
+            operation = self.start_operations.get(operation_id)
+            return operation.model_copy(deep=True) if operation is not None else None
 
     # if the percent to new version == 100 we end rollout and change current version
     def rollout(self, request: RolloutRequest):
@@ -214,9 +775,11 @@ class MachineManager:
                       f" traffic_to_new = {request.traffic_percent_to_new_version}")
 
         if request.traffic_percent_to_new_version == 100:
-            self.linter_name_to_curr_version[request.linter_name] = request.new_version
+            with self.lock:
+                self.linter_name_to_curr_version[request.linter_name] = request.new_version
             logging.info(
                 f"got 100 percent rollout changed current version of {request.linter_name} to {request.new_version}")
+            self.publish_routing_table()
         self.load_balancer_client.rollout(request)
 
     def auto_rollout(self, request: AutoRolloutRequest):
@@ -251,7 +814,9 @@ class MachineManager:
     # if the version is not specified rollback to current version
     def rollback(self, linter_name, linter_version=None):
         if linter_version is not None:
-            self.linter_name_to_curr_version[linter_name] = linter_version
+            with self.lock:
+                self.linter_name_to_curr_version[linter_name] = linter_version
+            self.publish_routing_table()
 
         self.rollout_lock.acquire()
         # does not have effect if there is no automatic rollout
@@ -261,9 +826,31 @@ class MachineManager:
 
     def restart_broken_linters(self, host_ports):
 
-        to_restart = list(filter(lambda l: l.get_host_port() in host_ports, self.running_linters))
+        with self.lock:
+            # a linter reported twice is restarted once, a container serving many linters is stopped once
+            reported = [linter for host_port in dict.fromkeys(host_ports)
+                        for linter in self.registry.at_host_port(host_port)]
+
+        # reports overlap, health check sends them from sweeps and from health watches; linters of a container
+        # are restarted by the report which stopped it
+        to_restart = []
+        for machine, container_name in dict.fromkeys((linter.machine, linter.container_name) for linter in reported):
+            to_restart += self._stop_registered_container(machine, container_name)
 
         for linter in to_restart:
-            self.stop_linter_instance(linter.machine, linter.container_name)
-            time.sleep(1)
-            self.start_linter_instance(linter.linter_name, linter.linter_version, linter.machine)
+            linter_instance = self._take_from_warm_pool(linter.linter_name, linter.linter_version)
+            if linter_instance is None:
+                # the container started for another linter of the broken one can serve this one too
+                with self.lock:
+                    linter_instance = self._shared_instance(linter.linter_name, linter.linter_version, linter.machine)
+            if linter_instance is not None:
+                self._register_linter_instances([linter_instance])
+            else:
+                with self.lock:
+                    # the machine may have been deleted in the meantime
+                    machine = linter.machine if linter.machine in self.machine_to_n_linters \
+                        else self.get_machine_with_least_linters()
+                self.start_linter_instance(linter.linter_name, linter.linter_version, machine)
+
+        for linter_name, linter_version in {(linter.linter_name, linter.linter_version) for linter in to_restart}:
+            self._refill_warm_pool(linter_name, linter_version)
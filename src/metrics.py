@@ -0,0 +1,196 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Metrics rendered in the Prometheus text exposition format, served by every app at GET /metrics.
+# Recording looks up the labelled child in a dict and updates a number under its lock, so it can stay on in the
+# hot path. Children stay until removed with retain or clear, so labels must come from a bounded set
+# (linters, versions, instances).
+
+# seconds, from a cached-channel lint to a slow container start
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def format_labels(label_names: Sequence[str], label_values: Sequence[str]) -> str:
+    if not label_names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in label_values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(label_names, escaped)) + "}"
+
+
+class ValueChild:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self.lock:
+            self.value -= amount
+
+    # for values counted elsewhere and copied in by collectors
+    def set(self, value: float):
+        self.value = value
+
+
+class HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # bucket_counts[i] counts observations in (buckets[i - 1], buckets[i]], the last one those above all buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    # [count] observations of the same value
+    def observe(self, value: float, count: int = 1):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.bucket_counts[index] += count
+            self.sum += value * count
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *label_values: str):
+        child = self.children.get(label_values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(label_values)
+                if child is None:
+                    child = self.children[label_values] = self.new_child()
+        return child
+
+    # drop children whose [label_name] is not one of [values], e.g. of instances which are gone
+    def retain(self, label_name: str, values):
+        index = self.label_names.index(label_name)
+        values = set(values)
+        with self.lock:
+            for label_values in [label_values for label_values in self.children if label_values[index] not in values]:
+                del self.children[label_values]
+
+    def clear(self):
+        with self.lock:
+            self.children.clear()
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"] + self.samples()
+
+
+class ValueMetric(Metric):
+    def new_child(self):
+        return ValueChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            children = list(self.children.items())
+        return [f"{self.name}{format_labels(self.label_names, label_values)} {format_value(child.value)}"
+                for label_values, child in children]
+
+
+class Counter(ValueMetric):
+    type_name = "counter"
+
+
+class Gauge(ValueMetric):
+    type_name = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float, count: int = 1):
+        self.labels().observe(value, count)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            children = list(self.children.items())
+        lines = []
+        bucket_label_names = self.label_names + ("le",)
+        for label_values, child in children:
+            with child.lock:
+                bucket_counts = list(child.bucket_counts)
+                total = child.sum
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative += count
+                labels = format_labels(bucket_label_names, label_values + (format_value(upper_bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# Metrics of one app. Collectors run before rendering and copy in values which are kept elsewhere.
+class MetricsRegistry:
+    # Content-Type of the rendered metrics
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
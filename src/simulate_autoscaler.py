@@ -0,0 +1,182 @@
+import argparse
+import math
+import threading
+import time
+import uuid
+
+from autoscaler import Autoscaler, AutoscalingPolicy
+from container_manager import ContainerManager
+from machine_manager import MachineManager
+
+# Replays a load curve against the autoscaler with real MachineManager and fake containers, in simulated time.
+# Linters are modelled as a fluid queue: every ready instance lints instance_concurrency codes at once, each taking
+# service_time seconds, lints which don't fit wait in a backlog. Containers start serving start_delay seconds after
+# they are started. The default curve is a quiet baseline with an hourly CI spike.
+# Run from the src directory: python3 simulate_autoscaler.py, or with -curve file.csv of "seconds,lints per second"
+# points, the rate is interpolated linearly between them.
+
+LINTER_NAME = "spaces"
+LINTER_VERSION = "v1"
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SimulatedContainerManager(ContainerManager):
+    def __init__(self, machine, clock, start_delay):
+        self.machine = machine
+        self.clock = clock
+        self.start_delay = start_delay
+        self.next_port = 12301
+        # container name -> simulated time when it starts serving
+        self.ready_at = {}
+        self.lock = threading.Lock()
+
+    def start_container(self, docker_image):
+        with self.lock:
+            port = self.next_port
+            self.next_port += 1
+            container_name = str(uuid.uuid4())
+            self.ready_at[container_name] = self.clock() + self.start_delay
+        return port, container_name
+
+    def stop_container(self, container_name):
+        with self.lock:
+            self.ready_at.pop(container_name)
+
+
+class NullLoadBalancerClient:
+    def rollout(self, request):
+        pass
+
+    def rollback(self, linter_name):
+        pass
+
+    def update_routing_table(self, routing_table):
+        pass
+
+
+def default_curve(hours):
+    points = []
+    for hour in range(hours):
+        start = hour * 3600
+        points += [(start, 20), (start + 1200, 20), (start + 1320, 400), (start + 1800, 400), (start + 1920, 20)]
+    return points + [(hours * 3600, 20)]
+
+
+def read_curve(path):
+    with open(path) as curve_file:
+        return [tuple(map(float, line.split(","))) for line in curve_file if line.strip()]
+
+
+def rate_at(curve, now):
+    for (t0, rate0), (t1, rate1) in zip(curve, curve[1:]):
+        if t0 <= now <= t1:
+            return rate0 + (rate1 - rate0) * (now - t0) / (t1 - t0) if t1 > t0 else rate1
+    return curve[-1][1]
+
+
+def wait_for_scale_ups(machine_manager, autoscaler):
+    for operation_id in list(autoscaler.scale_up_operations.values()):
+        while not machine_manager.get_start_operation(operation_id).done:
+            time.sleep(0.001)
+
+
+def simulate(curve, policy, n_machines, service_time, start_delay, step):
+    clock = SimulatedClock()
+    container_managers = []
+
+    def container_manager_factory(machine):
+        container_managers.append(SimulatedContainerManager(machine, clock, start_delay))
+        return container_managers[-1]
+
+    machine_manager = MachineManager(container_manager_factory, NullLoadBalancerClient())
+    for i in range(n_machines):
+        machine_manager.add_machine(f"machine{i}")
+    machine_manager.register_linter(LINTER_NAME, LINTER_VERSION, "spaces-linter:v1")
+    machine_manager.start_linter_instance(LINTER_NAME, LINTER_VERSION, "machine0")
+    # the first instance is serving when the simulation starts
+    container_managers[0].ready_at = dict.fromkeys(container_managers[0].ready_at, 0.0)
+
+    # what load balancer would report, see LinterLoadTracker
+    load = {"linter_name": LINTER_NAME, "linter_version": LINTER_VERSION, "n_requests": 0, "n_failures": 0,
+            "latency_sum": 0.0, "in_flight": 0}
+    autoscaler = Autoscaler(machine_manager, lambda: [dict(load)], interval=step, clock=clock)
+    autoscaler.set_policy(policy)
+
+    backlog = 0.0
+    samples = []
+    while clock.now < curve[-1][0]:
+        rate = rate_at(curve, clock.now)
+        n_ready = sum(ready_at <= clock.now for container_manager in container_managers
+                      for ready_at in container_manager.ready_at.values())
+        capacity = n_ready * policy.instance_concurrency / service_time
+
+        arrived = rate * step
+        served = min(backlog + arrived, capacity * step)
+        backlog += arrived - served
+        latency = service_time + (backlog / capacity if capacity > 0 else step)
+        utilization = served / step * service_time / (n_ready * policy.instance_concurrency) if n_ready else 1.0
+
+        load["n_requests"] += round(served)
+        load["latency_sum"] += served * latency
+        load["in_flight"] = round(served / step * service_time + backlog)
+        samples.append((clock.now, rate, n_ready, utilization, latency, backlog))
+
+        clock.now += step
+        autoscaler.step()
+        wait_for_scale_ups(machine_manager, autoscaler)
+
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-curve', '--curve', type=str, default=None, help="csv file with seconds,rate points")
+    parser.add_argument('-hours', '--hours', type=int, default=3, help="length of the default curve")
+    parser.add_argument('-machines', '--n_machines', type=int, default=4)
+    parser.add_argument('-s', '--service_time', type=float, default=0.1, help="seconds per lint")
+    parser.add_argument('-start', '--start_delay', type=float, default=20, help="seconds until a container serves")
+    parser.add_argument('-step', '--step', type=float, default=10, help="seconds between autoscaler steps")
+    parser.add_argument('-min', '--min_instances', type=int, default=1)
+    parser.add_argument('-max', '--max_instances', type=int, default=10)
+    parser.add_argument('-u', '--target_utilization', type=float, default=0.7)
+    parser.add_argument('-up', '--scale_up_cooldown', type=float, default=30)
+    parser.add_argument('-down', '--scale_down_cooldown', type=float, default=300)
+    parser.add_argument('-print', '--print_every', type=float, default=300, help="seconds between printed rows")
+    parsed_args = parser.parse_args()
+
+    curve = read_curve(parsed_args.curve) if parsed_args.curve is not None else default_curve(parsed_args.hours)
+    policy = AutoscalingPolicy(linter_name=LINTER_NAME, min_instances=parsed_args.min_instances,
+                               max_instances=parsed_args.max_instances,
+                               target_utilization=parsed_args.target_utilization,
+                               scale_up_cooldown=parsed_args.scale_up_cooldown,
+                               scale_down_cooldown=parsed_args.scale_down_cooldown,
+                               # drain timers run in real time, so containers are stopped right away instead
+                               scale_down_drain=0)
+    samples = simulate(curve, policy, parsed_args.n_machines, parsed_args.service_time, parsed_args.start_delay,
+                       parsed_args.step)
+
+    print(f"{'time s':>8}{'lints/s':>10}{'instances':>11}{'utilization':>13}{'latency ms':>12}{'backlog':>10}")
+    rows_every = max(1, round(parsed_args.print_every / parsed_args.step))
+    for now, rate, n_ready, utilization, latency, backlog in samples[::rows_every]:
+        print(f"{now:>8.0f}{rate:>10.1f}{n_ready:>11}{utilization:>13.2f}{latency * 1000:>12.1f}{backlog:>10.0f}")
+
+    duration = len(samples) * parsed_args.step
+    instance_hours = sum(n_ready for _, _, n_ready, _, _, _ in samples) * parsed_args.step / 3600
+    saturated = sum(backlog > 0 for _, _, _, _, _, backlog in samples) / len(samples)
+    peak_needed = math.ceil(max(rate for _, rate, _, _, _, _ in samples) * parsed_args.service_time
+                            / (policy.instance_concurrency * policy.target_utilization))
+    print(f"instance hours: {instance_hours:.1f} (always {peak_needed} instances for the peak: "
+          f"{peak_needed * duration / 3600:.1f})")
+    print(f"max latency: {max(latency for _, _, _, _, latency, _ in samples) * 1000:.1f} ms, "
+          f"saturated {saturated * 100:.1f}% of the time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import time
+import uuid
+from unittest.mock import Mock
+
+import pytest
+
+from autoscaler import Autoscaler, AutoscalingPolicy
+from container_manager import ContainerManager
+from machine_manager import MachineManager
+
+
+class InstantContainerManager(ContainerManager):
+    def __init__(self, machine):
+        self.machine = machine
+        self.next_port = 12301
+        self.stopped = []
+
+    def start_container(self, docker_image):
+        self.next_port += 1
+        return self.next_port, str(uuid.uuid4())
+
+    def stop_container(self, container_name):
+        self.stopped.append(container_name)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def machine_manager():
+    machine_manager = MachineManager(InstantContainerManager, Mock())
+    machine_manager.add_machine("machine1")
+    machine_manager.register_linter("spaces", "v1", "spaces:v1")
+    machine_manager.start_linter_instance("spaces", "v1", "machine1")
+    return machine_manager
+
+
+def load(n_requests, latency_sum, in_flight=0):
+    return [{"linter_name": "spaces", "linter_version": "v1", "n_requests": n_requests, "n_failures": 0,
+             "latency_sum": latency_sum, "in_flight": in_flight}]
+
+
+def step(autoscaler, machine_manager):
+    autoscaler.step()
+    for operation_id in autoscaler.scale_up_operations.values():
+        while not machine_manager.get_start_operation(operation_id).done:
+            time.sleep(0.01)
+
+
+def test_desired_instances():
+    policy = AutoscalingPolicy(linter_name="spaces", min_instances=2, max_instances=8, instance_concurrency=10,
+                               target_utilization=0.5)
+    assert Autoscaler.desired_instances(policy, request_rate=0, mean_latency=0, in_flight=0) == 2
+    # 100 lints per second taking 0.2 s keep 20 lints in flight, 5 per instance
+    assert Autoscaler.desired_instances(policy, request_rate=100, mean_latency=0.2, in_flight=0) == 4
+    assert Autoscaler.desired_instances(policy, request_rate=100, mean_latency=0.2, in_flight=30) == 6
+    assert Autoscaler.desired_instances(policy, request_rate=1000, mean_latency=0.2, in_flight=0) == 8
+
+
+def test_scale_up_and_down_with_cooldowns(machine_manager):
+    clock = FakeClock()
+    report = load(0, 0.0)
+    autoscaler = Autoscaler(machine_manager, lambda: report, clock=clock)
+    autoscaler.set_policy(AutoscalingPolicy(linter_name="spaces", min_instances=1, max_instances=5,
+                                            instance_concurrency=10, target_utilization=0.5,
+                                            scale_up_cooldown=30, scale_down_cooldown=300))
+    step(autoscaler, machine_manager)
+    assert machine_manager.count_linter_instances("spaces", "v1") == 1
+
+    # 100 lints per second taking 0.1 s
+    clock.now, report = 10, load(1000, 100.0)
+    step(autoscaler, machine_manager)
+    assert machine_manager.count_linter_instances("spaces", "v1") == 2
+    assert autoscaler.get_statuses()[0].request_rate == pytest.approx(100)
+
+    # twice the load, but still in the cooldown
+    clock.now, report = 20, load(3000, 300.0)
+    step(autoscaler, machine_manager)
+    assert machine_manager.count_linter_instances("spaces", "v1") == 2
+
+    clock.now, report = 40, load(7000, 700.0)
+    step(autoscaler, machine_manager)
+    assert machine_manager.count_linter_instances("spaces", "v1") == 4
+
+    # load is gone, scale down waits for its longer cooldown
+    clock.now, report = 100, load(7000, 700.0)
+    step(autoscaler, machine_manager)
+    assert machine_manager.count_linter_instances("spaces", "v1") == 4
+
+    clock.now = 340
+    step(autoscaler, machine_manager)
+    assert machine_manager.count_linter_instances("spaces", "v1") == 1
+
+
+def test_scale_down_drains_instances(machine_manager):
+    clock = FakeClock()
+    report = load(0, 0.0, in_flight=20)
+    autoscaler = Autoscaler(machine_manager, lambda: report, clock=clock)
+    autoscaler.set_policy(AutoscalingPolicy(linter_name="spaces", min_instances=1, max_instances=5,
+                                            instance_concurrency=10, target_utilization=0.5,
+                                            scale_down_cooldown=0, scale_down_drain=0.2))
+    step(autoscaler, machine_manager)
+    assert machine_manager.count_linter_instances("spaces", "v1") == 4
+
+    clock.now, report = 10, load(0, 0.0)
+    step(autoscaler, machine_manager)
+    # load balancer is told first, the containers are stopped once lints in flight had time to finish
+    assert machine_manager.count_linter_instances("spaces", "v1") == 1
+    routing_table = machine_manager.load_balancer_client.update_routing_table.call_args.args[0]
+    assert len(routing_table.instances) == 1
+    container_manager = machine_manager.container_managers["machine1"]
+    assert container_manager.stopped == []
+    time.sleep(0.5)
+    assert len(container_manager.stopped) == 3
+
+
+def test_no_load_report_without_policies(machine_manager):
+    load_report_source = Mock(return_value=load(0, 0.0))
+    autoscaler = Autoscaler(machine_manager, load_report_source)
+    autoscaler.step()
+    load_report_source.assert_not_called()
+
+    autoscaler.set_policy(AutoscalingPolicy(linter_name="spaces"))
+    autoscaler.step()
+    load_report_source.assert_called_once()
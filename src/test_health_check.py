@@ -5,6 +5,7 @@ from unittest.mock import Mock
 
 import uvicorn
 
+from health_check import HealthCheck
 from health_check_app import create_app
 
 
@@ -14,20 +15,19 @@ class TestHealthCheck(unittest.TestCase):
                     {"name": "ccc", "version": "v1", "hostport": "hp3"},
                     {"name": "ddd", "version": "v1", "hostport": "hp4"}]
 
-    # 0: success, 1: failure (for linter client)
-    success_fail_list = [0, 0, 1, 1, 1, 0]
+    # linters are probed concurrently, so each one has its own sequence of 0: success, 1: failure
+    success_fail_lists = {"hp1": [0], "hp2": [1, 0], "hp3": [1, 1, 1], "hp4": [1, 1, 0]}
 
     health_check_delay = 3
 
-    # n good and 1 bad, n good 1 bad, ...
-    # n_reliable = 3
-
-    def unreliable(self):
-        if self.success_fail_list[self.curr_success_fail_idx] == 0:
-            self.curr_success_fail_idx = (self.curr_success_fail_idx + 1) % len(self.success_fail_list)
-        else:
-            self.curr_success_fail_idx = (self.curr_success_fail_idx + 1) % len(self.success_fail_list)
+    def unreliable(self, host_port):
+        with self.lock:
+            idx = self.curr_success_fail_idx.get(host_port, 0)
+            success_fail_list = self.success_fail_lists[host_port]
+            self.curr_success_fail_idx[host_port] = (idx + 1) % len(success_fail_list)
+        if success_fail_list[idx] == 1:
             raise RuntimeError()
+        return True
 
     def fresh_client(self):
         self.machine_management_client = Mock()
@@ -35,7 +35,8 @@ class TestHealthCheck(unittest.TestCase):
         self.machine_management_client.report_broken_linters.return_value = None
 
         linter_client = Mock()
-        linter_client.lint_code.side_effect = lambda x, y: self.unreliable()
+        linter_client.check_health.side_effect = lambda host_port, timeout: self.unreliable(host_port)
+        linter_client.watch_health.side_effect = lambda host_port: FakeHealthWatch([])
 
         app = create_app(machine_management_client=self.machine_management_client, linter_client=linter_client,
                          health_check_delay=self.health_check_delay)
@@ -46,7 +47,8 @@ class TestHealthCheck(unittest.TestCase):
         thread.start()
 
     def setUp(self):
-        self.curr_success_fail_idx = 0
+        self.curr_success_fail_idx = {}
+        self.lock = threading.Lock()
         self.fresh_client()
 
     def test_health_check(self):
@@ -57,5 +59,99 @@ class TestHealthCheck(unittest.TestCase):
         self.machine_management_client.report_broken_linters.assert_called_with(["hp3"])
 
 
+class TestSweep(unittest.TestCase):
+    def test_probes_run_concurrently(self):
+        machine_management_client = Mock()
+        machine_management_client.get_all_linters.return_value = [{"name": "aaa", "version": "v1", "hostport": f"hp{i}"}
+                                                                  for i in range(20)]
+        linter_client = Mock()
+        def slow_check_health(host_port, timeout):
+            time.sleep(0.2)
+            return True
+
+        linter_client.check_health.side_effect = slow_check_health
+
+        health_check = HealthCheck(machine_management_client, linter_client, health_check_delay=0,
+                                   max_concurrent_probes=20, watch_health=False)
+        report = health_check.sweep()
+
+        self.assertLess(report.duration, 1)
+        self.assertEqual(len(report.probe_latencies), 20)
+        self.assertEqual(report.broken_host_ports, [])
+
+    def test_retries_with_backoff(self):
+        machine_management_client = Mock()
+        machine_management_client.get_all_linters.return_value = [{"name": "aaa", "version": "v1", "hostport": "hp1"}]
+        linter_client = Mock()
+        linter_client.check_health.side_effect = RuntimeError()
+
+        health_check = HealthCheck(machine_management_client, linter_client, health_check_delay=0, probe_timeout=0.5,
+                                   max_tries=3, retry_backoff=0.1, watch_health=False)
+        report = health_check.sweep()
+
+        self.assertEqual(report.broken_host_ports, ["hp1"])
+        # waits 0.1 and 0.2 seconds between tries
+        self.assertGreaterEqual(report.probe_latencies["hp1"], 0.3)
+        linter_client.check_health.assert_called_with("hp1", timeout=0.5)
+
+    def test_watch_reports_failure(self):
+        machine_management_client = Mock()
+        machine_management_client.get_all_linters.return_value = [{"name": "aaa", "version": "v1", "hostport": "hp1"},
+                                                                  {"name": "aaa", "version": "v1", "hostport": "hp2"}]
+        linter_client = Mock()
+        # hp1 stops serving after the sweep, hp2 keeps serving
+        is_serving = {"hp1": True, "hp2": True}
+        linter_client.check_health.side_effect = lambda host_port, timeout: is_serving[host_port]
+        hp1_watch = FakeHealthWatch([True, False])
+        linter_client.watch_health.side_effect = lambda host_port: hp1_watch if host_port == "hp1" else FakeHealthWatch(
+            [True])
+
+        health_check = HealthCheck(machine_management_client, linter_client, health_check_delay=0, retry_backoff=0)
+        report = health_check.sweep()
+        self.assertEqual(report.broken_host_ports, [])
+
+        is_serving["hp1"] = False
+        hp1_watch.release()
+        time.sleep(0.5)
+        machine_management_client.report_broken_linters.assert_called_once_with(["hp1"])
+
+    def test_watch_of_stopped_linter_not_reported(self):
+        machine_management_client = Mock()
+        machine_management_client.get_all_linters.return_value = [{"name": "aaa", "version": "v1", "hostport": "hp1"}]
+        linter_client = Mock()
+        linter_client.check_health.return_value = True
+        hp1_watch = FakeHealthWatch([True, False])
+        linter_client.watch_health.return_value = hp1_watch
+
+        health_check = HealthCheck(machine_management_client, linter_client, health_check_delay=0, retry_backoff=0)
+        health_check.sweep()
+
+        # machine management stops the linter before the next sweep
+        machine_management_client.get_all_linters.return_value = []
+        linter_client.check_health.return_value = False
+        hp1_watch.release()
+        time.sleep(0.5)
+        machine_management_client.report_broken_linters.assert_not_called()
+
+
+# yields the first status right away and the rest after release()
+class FakeHealthWatch:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.released = threading.Event()
+
+    def __iter__(self):
+        for i, status in enumerate(self.statuses):
+            if i > 0:
+                self.released.wait()
+            yield status
+
+    def release(self):
+        self.released.set()
+
+    def cancel(self):
+        pass
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,160 @@
+import asyncio
+import time
+import unittest
+from concurrent import futures
+
+import grpc
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+
+import linter_pb2
+import linter_pb2_grpc
+from linter_client import AsyncLinterClient, ChannelPool, LinterClient, LINTER_SERVICE_NAME
+from tracing import InMemorySpanExporter, Tracer
+
+
+class EchoLinter(linter_pb2_grpc.LinterServicer):
+    def __init__(self, delay=0.0):
+        # trace context received with every LintCode call
+        self.trace_contexts = []
+        self.delay = delay
+
+    def LintCode(self, request, context):
+        time.sleep(self.delay)
+        self.trace_contexts.append(Tracer.from_metadata(context.invocation_metadata()))
+        return linter_pb2.LintingResult(status=0, comment=request.code)
+
+    def LintCodeBatch(self, request, context):
+        return linter_pb2.LintingBatchResult(results=[self.LintCode(r, context) for r in request.requests])
+
+
+class TestLinterClient(unittest.TestCase):
+    def setUp(self):
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        self.linter = EchoLinter()
+        linter_pb2_grpc.add_LinterServicer_to_server(self.linter, self.server)
+        self.health_servicer = health.HealthServicer()
+        health_pb2_grpc.add_HealthServicer_to_server(self.health_servicer, self.server)
+        self.health_servicer.set(LINTER_SERVICE_NAME, health_pb2.HealthCheckResponse.SERVING)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        self.host_port = f"localhost:{port}"
+
+    def tearDown(self):
+        self.server.stop(None)
+
+    def test_check_health(self):
+        linter_client = LinterClient()
+        self.assertTrue(linter_client.check_health(self.host_port, timeout=1))
+        self.health_servicer.set(LINTER_SERVICE_NAME, health_pb2.HealthCheckResponse.NOT_SERVING)
+        self.assertFalse(linter_client.check_health(self.host_port, timeout=1))
+
+    def test_linter_without_health_service(self):
+        # images built before linters served grpc.health.v1
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        linter_pb2_grpc.add_LinterServicer_to_server(EchoLinter(), server)
+        host_port = f"localhost:{server.add_insecure_port('localhost:0')}"
+        server.start()
+        try:
+            linter_client = LinterClient()
+            self.assertTrue(linter_client.check_health(host_port, timeout=1))
+            self.assertEqual(list(linter_client.watch_health(host_port)), [])
+        finally:
+            server.stop(None)
+
+    def test_watch_health(self):
+        linter_client = LinterClient()
+        health_watch = linter_client.watch_health(self.host_port)
+        statuses = iter(health_watch)
+        self.assertTrue(next(statuses))
+
+        self.health_servicer.set(LINTER_SERVICE_NAME, health_pb2.HealthCheckResponse.NOT_SERVING)
+        self.assertFalse(next(statuses))
+
+        self.server.stop(None)
+        self.assertRaises(RuntimeError, next, statuses)
+
+    def test_channel_reused(self):
+        linter_client = LinterClient()
+        self.assertEqual(linter_client.lint_code(self.host_port, "abc"), (0, "abc"))
+        self.assertEqual(linter_client.lint_code(self.host_port, "def"), (0, "def"))
+
+        stats = linter_client.channel_pool.stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 1)
+
+    def test_trace_context_propagated(self):
+        exporter = InMemorySpanExporter()
+        linter_client = LinterClient(tracer=Tracer("linter_client", exporter))
+        linter_client.lint_code(self.host_port, "abc", trace_context=("trace1", "parent1"))
+        linter_client.lint_code(self.host_port, "abc")
+
+        [span] = exporter.spans
+        self.assertEqual((span["trace_id"], span["parent_id"]), ("trace1", "parent1"))
+        self.assertTrue(span["attributes"]["new_channel"])
+        # the linter gets the client span as its parent, untraced requests carry no trace id
+        self.assertEqual(self.linter.trace_contexts, [("trace1", span["span_id"]), None])
+
+    def test_unreachable_linter(self):
+        linter_client = LinterClient()
+        self.server.stop(None)
+        self.assertRaises(RuntimeError, linter_client.lint_code, self.host_port, "abc")
+
+
+class TestAsyncLinterClient(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        self.linter = EchoLinter()
+        linter_pb2_grpc.add_LinterServicer_to_server(self.linter, self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        self.host_port = f"localhost:{port}"
+
+    def tearDown(self):
+        self.server.stop(None)
+
+    async def test_concurrent_linting(self):
+        linter_client = AsyncLinterClient()
+        results = await asyncio.gather(*[linter_client.lint_code(self.host_port, str(i)) for i in range(10)])
+        self.assertEqual(results, [(0, str(i)) for i in range(10)])
+        self.assertEqual(linter_client.channel_pool.stats()["created"], 1)
+
+    async def test_batch_linting(self):
+        linter_client = AsyncLinterClient()
+        self.assertEqual(await linter_client.lint_code_batch(self.host_port, ["a", "b", "c"]),
+                         [(0, "a"), (0, "b"), (0, "c")])
+
+    async def test_lint_in_flight_finishes_after_instance_removed(self):
+        self.linter.delay = 0.2
+        linter_client = AsyncLinterClient()
+        lint = asyncio.ensure_future(linter_client.lint_code(self.host_port, "abc"))
+        await asyncio.sleep(0.05)
+        linter_client.channel_pool.retain([], grace=5)
+        self.assertEqual(await lint, (0, "abc"))
+        self.assertEqual(linter_client.channel_pool.stats()["open_channels"], 0)
+
+    async def test_unreachable_linter(self):
+        linter_client = AsyncLinterClient()
+        self.server.stop(None)
+        with self.assertRaises(RuntimeError):
+            await linter_client.lint_code(self.host_port, "abc")
+
+
+class TestChannelPool(unittest.TestCase):
+    def test_retain(self):
+        channel_pool = ChannelPool()
+        channel_pool.get_channel("hp1")
+        channel_pool.get_channel("hp2")
+        channel_pool.retain(["hp2"])
+        self.assertEqual(list(channel_pool.channels), ["hp2"])
+        self.assertEqual(channel_pool.stats()["closed"], 1)
+
+    def test_idle_eviction(self):
+        channel_pool = ChannelPool(idle_timeout=0)
+        channel_pool.get_channel("hp1")
+        time.sleep(0.01)
+        channel_pool.get_channel("hp2")
+        self.assertEqual(list(channel_pool.channels), ["hp2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import Mock, patch
+
+import grpc
+
+import linter_pb2
+import linter_pb2_grpc
+from container_manager import LINTER_DIR
+from linter_client import LinterClient
+
+sys.path.append(LINTER_DIR)
+from linter_base import CODE_FAILURE, CODE_SUCCESS, Violation  # noqa: E402
+from linter_server import LinterWrapper, load_implementation, start_server  # noqa: E402
+
+
+def implementation(file_name):
+    return load_implementation(os.path.join(LINTER_DIR, "implementations", file_name))
+
+
+class TestScanningLinters(unittest.TestCase):
+    def test_all_semicolons_found(self):
+        linter = implementation("no_semicolons_linter_v3.py")
+        code = ('x = 1; y = 2\n'
+                's = "a;b"  # c;d\n'
+                '"""doc;\n'
+                ';string"""\n'
+                't = \'it\\\'s;\'; u = 3\n')
+        status, comment, violations = linter.lint(code)
+        self.assertEqual(status, CODE_FAILURE)
+        self.assertEqual(violations, [Violation(0, 5, "found semicolon"), Violation(4, 12, "found semicolon")])
+        self.assertEqual(comment, "ERROR: found semicolon in line 0 at position 5\n"
+                                  "ERROR: found semicolon in line 4 at position 12")
+        self.assertEqual(linter.lint_code("x = 1\n")[0], CODE_SUCCESS)
+
+    def test_spaces_around_assignment(self):
+        linter = implementation("spaces_around_assignment_linter_v2.py")
+        code = ('x=1\n'
+                'if a==b and c <= d and e!=f:\n'
+                '    z += 1\n'
+                '    w**=2\n'
+                'f(k=1)\n'
+                'if (n := 3) and (m :=4):\n'
+                'q  =  "a=b"\n')
+        _, _, violations = linter.lint(code)
+        self.assertEqual([(violation.line, violation.column) for violation in violations], [(0, 1), (3, 5), (4, 3)])
+
+    def test_rules_in_contexts(self):
+        linter = implementation("style_linter_v0.py")
+        code = ('x=1; y = 2  \n'
+                '# TODO fix;  \n'
+                '# TODO(ab) x=1\n'
+                '\tz = "TODO;"\n')
+        _, _, violations = linter.lint(code)
+        self.assertEqual([(violation.line, violation.column) for violation in violations],
+                         [(0, 1), (0, 3), (0, 10), (1, 2), (1, 11), (3, 0)])
+
+        linter = type(linter)(enabled_rules=["semicolon", "todo_without_owner"])
+        _, _, violations = linter.lint(code)
+        self.assertEqual([violation.message for violation in violations],
+                         ["found semicolon", "TODO without an owner, write TODO(name)"])
+
+    def test_violations_in_result(self):
+        context = Mock()
+        context.invocation_metadata.return_value = ()
+        linter_wrapper = LinterWrapper(implementation("no_semicolons_linter_v3.py"))
+        result = linter_wrapper.LintCode(linter_pb2.LintingRequest(code="a;\nb;"), context)
+        self.assertEqual([(violation.line, violation.column) for violation in result.violations], [(0, 1), (1, 1)])
+
+        # linters which stop at the first violation only have the comment
+        linter_wrapper = LinterWrapper(implementation("no_semicolons_linter_v0.py"))
+        result = linter_wrapper.LintCode(linter_pb2.LintingRequest(code="a;\nb;"), context)
+        self.assertEqual(result.status, CODE_FAILURE)
+        self.assertEqual(len(result.violations), 0)
+
+    def test_multi_linter_server(self):
+        context = Mock()
+        context.invocation_metadata.return_value = ()
+        context.abort.side_effect = Exception("aborted")
+        linter_wrapper = LinterWrapper(implementation("no_semicolons_linter_v3.py"),
+                                       implementation("spaces_around_assignment_linter_v2.py"))
+        code = "a=1;\n"
+        result = linter_wrapper.LintCode(linter_pb2.LintingRequest(code=code, linter_name="no_semicolons",
+                                                                   linter_version="v3"), context)
+        self.assertEqual([violation.column for violation in result.violations], [3])
+        result = linter_wrapper.LintCode(linter_pb2.LintingRequest(code=code, linter_name="spaces_around_equals",
+                                                                   linter_version="v2"), context)
+        self.assertEqual([violation.column for violation in result.violations], [1])
+
+        with self.assertRaises(Exception):
+            linter_wrapper.LintCode(linter_pb2.LintingRequest(code=code, linter_name="no_semicolons",
+                                                              linter_version="v2"), context)
+        self.assertEqual(context.abort.call_args[0][0], grpc.StatusCode.NOT_FOUND)
+
+    def test_session_rescans_edited_lines(self):
+        linter = implementation("no_semicolons_linter_v3.py")
+        code = ('a;\n'
+                '"""doc;\n'
+                'b;\n'
+                '"""\n'
+                'c;')
+        session = linter.start_session(code)
+        self.assertEqual(session.lint(), linter.lint(code))
+
+        # closing the docstring early makes the rest of the code a docstring, until the next triple quotes
+        for start_line, end_line, lines in [(1, 2, ['"""doc"""']), (2, 2, ["'s\\", 'x;"']), (0, 1, []),
+                                            (1, 2, ['"""'])]:
+            session.edit(start_line, end_line, lines)
+            self.assertEqual(session.lint(), linter.lint(session.get_code()))
+
+    def test_session_with_more_violations_than_reported(self):
+        linter = implementation("style_linter_v0.py")
+        n_lines = linter.max_violations + 500
+        session = linter.start_session("x = 1;\n" * n_lines)
+        self.assertEqual(len(session.lint()[2]), linter.max_violations)
+
+        # violations after the first max_violations are reported once the first ones are fixed
+        session.edit(0, linter.max_violations, ["x = 1"] * linter.max_violations)
+        self.assertEqual(session.lint(), linter.lint(session.get_code()))
+        self.assertEqual(len(session.lint()[2]), 500)
+
+    def test_session_of_linter_which_does_not_scan(self):
+        linter = implementation("no_semicolons_linter_v2.py")
+        session = linter.start_session('x = 1\n"""doc\n')
+        session.edit(1, 2, ['"""doc;'])
+        self.assertEqual(session.lint(), linter.lint('x = 1\n"""doc;\n'))
+        self.assertRaises(ValueError, session.edit, 2, 4, [])
+
+    def test_session_edits(self):
+        context = Mock()
+        context.invocation_metadata.return_value = ()
+        context.abort.side_effect = Exception("aborted")
+        linter_wrapper = LinterWrapper(implementation("no_semicolons_linter_v3.py"))
+
+        result = linter_wrapper.LintSessionEdits(linter_pb2.LintingSessionRequest(
+            session_id="s1", reset=True, code="a\nb;"), context)
+        self.assertEqual([(violation.line, violation.column) for violation in result.violations], [(1, 1)])
+        result = linter_wrapper.LintSessionEdits(linter_pb2.LintingSessionRequest(
+            session_id="s1", edits=[linter_pb2.LineEdit(start_line=0, end_line=1, lines=["a;", "c;"])]), context)
+        self.assertEqual([(violation.line, violation.column) for violation in result.violations],
+                         [(0, 1), (1, 1), (2, 1)])
+
+        with self.assertRaises(Exception):
+            linter_wrapper.LintSessionEdits(linter_pb2.LintingSessionRequest(session_id="s2"), context)
+        self.assertEqual(context.abort.call_args[0][0], grpc.StatusCode.NOT_FOUND)
+
+
+class TestLinterServer(unittest.TestCase):
+    def test_health_answered_while_all_threads_lint(self):
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        lints_may_end = threading.Event()
+
+        def slow_lint_code(linter_wrapper, request, context):
+            lints_may_end.wait()
+            return linter_pb2.LintingResult(status=CODE_SUCCESS)
+
+        with patch.object(LinterWrapper, "LintCode", slow_lint_code):
+            server, port = asyncio.run_coroutine_threadsafe(
+                start_server(0, [os.path.join(LINTER_DIR, "implementations", "no_semicolons_linter_v3.py")]),
+                loop).result()
+        host_port = f"localhost:{port}"
+        linter_client = LinterClient()
+        try:
+            # more lints than threads of the server
+            stub = linter_pb2_grpc.LinterStub(linter_client.channel_pool.get_channel(host_port))
+            lints = [stub.LintCode.future(linter_pb2.LintingRequest(code="x")) for _ in range(20)]
+            self.assertTrue(linter_client.check_health(host_port, timeout=1))
+            lints_may_end.set()
+            self.assertEqual([lint.result().status for lint in lints], [CODE_SUCCESS] * len(lints))
+        finally:
+            lints_may_end.set()
+            linter_client.channel_pool.retain([])
+            asyncio.run_coroutine_threadsafe(server.stop(None), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,31 +1,117 @@
+import asyncio
+import difflib
 import json
+import time
 import unittest
 from collections import Counter
-from unittest.mock import Mock
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, Mock
 
 from starlette.testclient import TestClient
 
 import load_balancer
+from lint_cache import LintResultCache
+from lint_sessions import LintSessionStore, apply_edits, edits_from_unified_diff
+from linter_client import ChannelPool, LintSessionNotFound
 from load_balancer import RoundRobinStrategy
 from load_balancer_app import create_app
+from tracing import InMemorySpanExporter, Tracer
 
 
 class RoundRobinStrategyTester(unittest.TestCase):
     def test_equal_distribution(self):
         round_robin_strategy = load_balancer.RoundRobinStrategy()
-        round_robin_strategy.load_counters = {"aa": 3, "bb": 3, "cc": 2}
         linters_host_ports = ["aa", "bb", "cc"]
-        self.assertEqual(round_robin_strategy.choose_linter_instance(linters_host_ports), "cc")  # add assertion here
+        chosen = [round_robin_strategy.choose_linter_instance(linters_host_ports) for _ in range(3)]
+        self.assertEqual(sorted(chosen), linters_host_ports)
 
     def test_equal_distribution2(self):
         round_robin_strategy = load_balancer.RoundRobinStrategy()
         linters_host_ports = ["aa", "bb", "cc"]
 
-        for i in range(10):
-            round_robin_strategy.choose_linter_instance(linters_host_ports)
+        chosen = [round_robin_strategy.choose_linter_instance(linters_host_ports) for _ in range(10)]
 
         # Use Counter to check if two lists has the same element
-        self.assertEqual(Counter(list(round_robin_strategy.load_counters.values())), Counter([4, 3, 3]))
+        self.assertEqual(Counter(Counter(chosen).values()), Counter([4, 3, 3]))
+
+    def test_separate_rotation_per_list(self):
+        round_robin_strategy = load_balancer.RoundRobinStrategy()
+        linter1_host_ports = load_balancer.HostPortList(["aa", "bb"])
+        linter2_host_ports = load_balancer.HostPortList(["cc", "dd", "ee"])
+
+        chosen1 = [round_robin_strategy.choose_linter_instance(linter1_host_ports) for _ in range(4)]
+        chosen2 = [round_robin_strategy.choose_linter_instance(linter2_host_ports) for _ in range(6)]
+
+        self.assertEqual(Counter(chosen1), Counter(["aa", "aa", "bb", "bb"]))
+        self.assertEqual(Counter(chosen2), Counter(["cc", "cc", "dd", "dd", "ee", "ee"]))
+
+    def test_topology_change_drops_state(self):
+        round_robin_strategy = load_balancer.RoundRobinStrategy()
+        round_robin_strategy.choose_linter_instance(["aa", "bb"])
+        round_robin_strategy.on_topology_change(["cc"])
+        self.assertEqual(round_robin_strategy.cursors, {})
+        self.assertEqual(round_robin_strategy.choose_linter_instance(["cc"]), "cc")
+
+    def test_concurrent_choices(self):
+        round_robin_strategy = load_balancer.RoundRobinStrategy()
+        linters_host_ports = load_balancer.HostPortList(["aa", "bb", "cc", "dd"])
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            chosen = list(executor.map(lambda _: round_robin_strategy.choose_linter_instance(linters_host_ports),
+                                       range(400)))
+
+        self.assertEqual(set(Counter(chosen).values()), {100})
+
+
+class LoadTrackingStrategyTester(unittest.TestCase):
+    def test_least_outstanding(self):
+        strategy = load_balancer.LeastOutstandingStrategy()
+        strategy.on_request_start("aa")
+        strategy.on_request_start("bb")
+        strategy.on_request_start("bb")
+        self.assertEqual(strategy.choose_linter_instance(["aa", "bb", "cc"]), "cc")
+
+        strategy.on_request_end("bb", 0.1, success=True)
+        strategy.on_request_end("bb", 0.1, success=True)
+        self.assertEqual(strategy.choose_linter_instance(["aa", "bb"]), "bb")
+
+    def test_power_of_two_choices_avoids_slow_instance(self):
+        strategy = load_balancer.PowerOfTwoChoicesStrategy()
+        strategy.on_request_start("slow")
+        strategy.on_request_end("slow", 1.0, success=True)
+        strategy.on_request_start("fast")
+        strategy.on_request_end("fast", 0.01, success=True)
+        for _ in range(10):
+            self.assertEqual(strategy.choose_linter_instance(["slow", "fast"]), "fast")
+
+    def test_failures_count_as_slow(self):
+        strategy = load_balancer.LeastOutstandingStrategy()
+        strategy.on_request_start("aa")
+        strategy.on_request_end("aa", 0.001, success=False)
+        strategy.on_request_start("bb")
+        strategy.on_request_end("bb", 0.1, success=True)
+        self.assertEqual(strategy.choose_linter_instance(["aa", "bb"]), "bb")
+
+    def test_topology_change(self):
+        strategy = load_balancer.LeastOutstandingStrategy()
+        strategy.on_request_start("aa")
+        strategy.on_request_start("bb")
+        strategy.on_topology_change(["bb"])
+        # the load of a removed instance is kept until its requests in flight end
+        self.assertEqual(list(strategy.stats()), ["aa", "bb"])
+        strategy.on_request_end("aa", 0.1, success=True)
+        self.assertEqual(list(strategy.stats()), ["bb"])
+        strategy.on_request_end("aa", 0.1, success=True)
+        self.assertEqual(list(strategy.stats()), ["bb"])
+
+    def test_new_instance_expected_as_fast_as_others(self):
+        strategy = load_balancer.PowerOfTwoChoicesStrategy()
+        strategy.on_request_start("busy")
+        strategy.on_request_end("busy", 0.1, success=True)
+        for _ in range(3):
+            strategy.on_request_start("new")
+        # three requests are in flight on the new instance, which did not answer yet
+        self.assertEqual(strategy.choose_linter_instance(["busy", "new"]), "busy")
 
 
 # used just for testing
@@ -53,25 +139,48 @@ class TestLinting(unittest.TestCase):
     def lint_result_to_dict(lint_result):
         return {"status_code": lint_result[0], "message": lint_result[1]}
 
-    def get_linters_with_curr_version(self, name):
-        return [linter.host_port for linter in self.linter_list if linter.name == name]
+    def routing_table(self, epoch):
+        return {"epoch": epoch,
+                "curr_versions": {linter.name: linter.version for linter in self.linter_list},
+                "instances": [{"name": linter.name, "version": linter.version, "hostport": linter.host_port}
+                              for linter in self.linter_list]}
 
     def fresh_client(self):
-        machine_management_client = Mock()
-        machine_management_client.get_linters_with_curr_version.side_effect = lambda \
-                name: self.get_linters_with_curr_version(name)
+        self.machine_management_client = Mock()
 
-        def fake_lint_code(host_port, code):
+        def fake_lint_code(host_port, code, trace_context=None, linter_name="", linter_version=""):
             linter = list(filter(lambda x: x.host_port == host_port, self.linter_list))[0]
             return linter.linting_function(code)
 
+        async def fake_lint_code_batch(host_port, codes, linter_name="", linter_version=""):
+            return [fake_lint_code(host_port, code) for code in codes]
+
+        # host_port -> session id -> lines, the result message is the code of the session
+        self.linter_sessions = {}
+
+        async def fake_lint_session_edits(host_port, session_id, edits, reset=False, code="", trace_context=None,
+                                          linter_name="", linter_version=""):
+            sessions = self.linter_sessions.setdefault(host_port, {})
+            if reset:
+                sessions[session_id] = code.split("\n")
+            if session_id not in sessions:
+                raise LintSessionNotFound(f"No session {session_id}")
+            apply_edits(sessions[session_id], edits)
+            return 0, "\n".join(sessions[session_id]), [(0, 0, "found")]
+
         linter_client = Mock()
-        linter_client.lint_code.side_effect = fake_lint_code
+        linter_client.channel_pool = ChannelPool()
+        linter_client.lint_code = AsyncMock(side_effect=fake_lint_code)
+        linter_client.lint_code_batch = AsyncMock(side_effect=fake_lint_code_batch)
+        linter_client.lint_session_edits = AsyncMock(side_effect=fake_lint_session_edits)
+        self.linter_client = linter_client
 
         app = create_app(strategy=RoundRobinStrategy(),
-                         machine_management_client=machine_management_client, linter_client=linter_client)
+                         machine_management_client=self.machine_management_client, linter_client=linter_client)
 
-        return TestClient(app)
+        client = TestClient(app)
+        client.post("/update_routing_table/", json=self.routing_table(epoch=1))
+        return client
 
     def setUp(self):
         self.client = self.fresh_client()
@@ -84,6 +193,263 @@ class TestLinting(unittest.TestCase):
         self.assertEqual(json.loads(response.content.decode('utf-8')),
                          TestLinting.lint_result_to_dict(linter.linting_function(code)))
 
+    def test_unknown_linter(self):
+        self.assertEqual(self.client.post("/lint_code/", json={"linter_name": "name9", "code": "a"}).status_code, 404)
+        self.assertEqual(self.client.post("/lint_batch/", json={"linter_name": "name9", "codes": ["a"]}).status_code,
+                         404)
+        # names sent by clients are not metric labels until machine management knows them
+        self.assertNotIn("name9", self.client.get("/metrics").text)
+
+    def test_linting_does_not_query_machine_management(self):
+        self.client.post("/lint_code/", json={"linter_name": "name1", "code": "abcd"})
+        self.assertEqual(self.machine_management_client.mock_calls, [])
+
+    def test_outdated_routing_table_ignored(self):
+        outdated_table = self.routing_table(epoch=0)
+        outdated_table["instances"] = []
+        self.client.post("/update_routing_table/", json=outdated_table)
+
+        linter = self.linter_list[1]
+        response = self.client.post("/lint_code/", json={"linter_name": linter.name, "code": "abcd"})
+        self.assertEqual(response.json(), TestLinting.lint_result_to_dict(linter.linting_function("abcd")))
+
+
+    def test_batch_linting(self):
+        codes = [f"code{i}" for i in range(5)]
+        response = self.client.post("/lint_batch/", json={"linter_name": "name2", "codes": codes})
+        self.assertEqual(response.json(), [TestLinting.lint_result_to_dict(Linter.lint_func2(code)) for code in codes])
+
+    def test_batch_split_between_instances(self):
+        table = self.routing_table(epoch=2)
+        table["instances"].append({"name": "name1", "version": "v1", "hostport": "hp3"})
+        self.linter_list = self.linter_list + [Linter("name1", "v1", "hp3", Linter.lint_func1)]
+        self.client.post("/update_routing_table/", json=table)
+
+        codes = [f"code{i}" for i in range(6)]
+        response = self.client.post("/lint_batch/", json={"linter_name": "name1", "codes": codes})
+        self.assertEqual(response.json(), [TestLinting.lint_result_to_dict(Linter.lint_func1(code)) for code in codes])
+
+        sub_batches = sorted(call.args for call in self.linter_client.lint_code_batch.call_args_list)
+        self.assertEqual([host_port for host_port, _ in sub_batches], ["hp1", "hp3"])
+        self.assertEqual(sorted(codes for _, codes in sub_batches),
+                         [["code0", "code2", "code4"], ["code1", "code3", "code5"]])
+
+
+    def test_cached_result(self):
+        for _ in range(3):
+            response = self.client.post("/lint_code/", json={"linter_name": "name1", "code": "abcd"})
+            self.assertEqual(response.json(), TestLinting.lint_result_to_dict(Linter.lint_func1("abcd")))
+
+        self.assertEqual(self.linter_client.lint_code.call_count, 1)
+        stats = self.client.get("/stats/").json()["lint_cache"]
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+
+    def test_cache_follows_rollout(self):
+        table = self.routing_table(epoch=2)
+        table["instances"].append({"name": "name1", "version": "v2", "hostport": "hp3"})
+        self.linter_list = self.linter_list + [Linter("name1", "v2", "hp3", Linter.lint_func2)]
+        self.client.post("/update_routing_table/", json=table)
+        self.client.post("/rollout/", json={"linter_name": "name1", "old_version": "v1", "new_version": "v2",
+                                            "traffic_percent_to_new_version": 50})
+
+        responses = [self.client.post("/lint_code/", json={"linter_name": "name1", "code": "abcd"}).json()
+                     for _ in range(4)]
+        self.assertEqual(Counter(response["status_code"] for response in responses), Counter([0, 0, 1, 1]))
+        self.assertEqual(self.linter_client.lint_code.call_count, 2)
+
+    def test_load_report(self):
+        self.client.post("/lint_code/", json={"linter_name": "name1", "code": "abcd"})
+        self.client.post("/lint_code/", json={"linter_name": "name1", "code": "abcd"})
+        self.client.post("/lint_batch/", json={"linter_name": "name2", "codes": ["a", "b", "c"]})
+
+        report = {load["linter_name"]: load for load in self.client.get("/load_report/").json()}
+        # cached lint is not counted
+        self.assertEqual(report["name1"]["n_requests"], 1)
+        self.assertEqual(report["name2"]["n_requests"], 3)
+        self.assertEqual(report["name2"]["linter_version"], "v1")
+        self.assertEqual(report["name2"]["in_flight"], 0)
+
+    def test_metrics(self):
+        self.client.post("/lint_code/", json={"linter_name": "name1", "code": "abcd"})
+        self.client.post("/lint_code/", json={"linter_name": "name1", "code": "abcd"})
+
+        response = self.client.get("/metrics")
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        lines = response.text.splitlines()
+        self.assertIn('lint_version_choices_total{linter="name1",version="v1"} 2', lines)
+        self.assertIn('lint_latency_seconds_count{linter="name1",version="v1",instance="hp1"} 1', lines)
+        self.assertIn("lint_cache_hits_total 1", lines)
+
+    def test_identical_lints_in_flight_coalesced(self):
+        async def lint_all():
+            answer = asyncio.Event()
+
+            async def slow_lint_code(host_port, code, trace_context=None, linter_name="", linter_version=""):
+                await answer.wait()
+                return 0, code
+
+            self.linter_client.lint_code = AsyncMock(side_effect=slow_lint_code)
+            balancer = load_balancer.LoadBalancer(RoundRobinStrategy(), Mock(), self.linter_client,
+                                                  tracer=Tracer("load_balancer", exporter))
+            balancer.update_routing_table(**self.routing_table(epoch=1))
+            lints = [asyncio.ensure_future(balancer.lint_code("name1", code, trace_id=f"trace{i}"))
+                     for i, code in enumerate(["a", "a", "a", "b"])]
+            await asyncio.sleep(0)
+            # the lint which sent the request goes away, the others still get its result
+            lints[0].cancel()
+            answer.set()
+            return balancer, await asyncio.gather(*lints[1:])
+
+        exporter = InMemorySpanExporter()
+        balancer, results = asyncio.run(lint_all())
+        self.assertEqual(results, [(0, "a"), (0, "a"), (0, "b")])
+        self.assertEqual(self.linter_client.lint_code.call_count, 2)
+        self.assertEqual(balancer.coalescing_stats(), {"in_flight": 0, "coalesced": 2})
+        # every lint which got a result knows the instance, also those which waited for another one
+        spans = {span["trace_id"]: span for span in exporter.spans if span["name"] == "load_balancer.lint_code"}
+        self.assertEqual([spans[f"trace{i}"]["attributes"]["instance"] for i in range(1, 4)], ["hp1"] * 3)
+        self.assertEqual([spans[f"trace{i}"]["attributes"]["coalesced"] for i in range(1, 4)], [True, True, False])
+
+    def test_lint_session(self):
+        response = self.client.post("/lint_session/", json={"linter_name": "name1", "code": "a\nb\nc"}).json()
+        self.assertEqual(response["message"], "a\nb\nc")
+        self.assertEqual(response["violations"], [{"line": 0, "column": 0, "message": "found"}])
+        session_id = response["session_id"]
+
+        edits = {"edits": [{"start_line": 1, "end_line": 2, "lines": ["B", "B2"]}]}
+        response = self.client.post(f"/lint_session/{session_id}", json=edits).json()
+        self.assertEqual(response["message"], "a\nB\nB2\nc")
+        diff = "\n".join(difflib.unified_diff(["a", "B", "B2", "c"], ["a", "B2", "c", "d"], lineterm=""))
+        response = self.client.post(f"/lint_session/{session_id}", json={"diff": diff}).json()
+        self.assertEqual(response["message"], "a\nB2\nc\nd")
+
+        # only the first lint sends the whole code, all go to the same instance
+        calls = self.linter_client.lint_session_edits.call_args_list
+        self.assertEqual([call.kwargs.get("reset", False) for call in calls], [True, False, False])
+        self.assertEqual({call.args[0] for call in calls}, {"hp1"})
+        self.assertEqual(calls[1].args[2], [(1, 2, ["B", "B2"])])
+
+        response = self.client.post(f"/lint_session/{session_id}",
+                                    json={"edits": [{"start_line": 5, "end_line": 6, "lines": []}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.delete(f"/lint_session/{session_id}").status_code, 200)
+        self.assertEqual(self.client.post(f"/lint_session/{session_id}", json={}).status_code, 404)
+
+        # no session is kept for linters which can't lint it
+        response = self.client.post("/lint_session/", json={"linter_name": "name9", "code": "a"})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get("/stats/").json()["lint_sessions"]["started"], 1)
+
+    def test_lint_session_moves_when_instance_is_gone(self):
+        table = self.routing_table(epoch=2)
+        table["instances"].append({"name": "name1", "version": "v1", "hostport": "hp3"})
+        self.client.post("/update_routing_table/", json=table)
+        session_id = self.client.post("/lint_session/", json={"linter_name": "name1", "code": "a"}).json()["session_id"]
+        [call] = self.linter_client.lint_session_edits.call_args_list
+        host_port = call.args[0]
+
+        table = self.routing_table(epoch=3)
+        table["instances"] = [{"name": "name1", "version": "v1", "hostport": "hp3" if host_port == "hp1" else "hp1"},
+                              {"name": "name2", "version": "v1", "hostport": "hp2"}]
+        self.client.post("/update_routing_table/", json=table)
+        edits = {"edits": [{"start_line": 1, "end_line": 1, "lines": ["b"]}]}
+        response = self.client.post(f"/lint_session/{session_id}", json=edits).json()
+        self.assertEqual(response["message"], "a\nb")
+
+        # a linter which lost the session gets the whole code again
+        self.linter_sessions.clear()
+        response = self.client.post(f"/lint_session/{session_id}", json=edits).json()
+        self.assertEqual(response["message"], "a\nb\nb")
+        self.assertEqual(self.client.get("/stats/").json()["lint_sessions"]["resets"], 2)
+
+    def test_traced_request(self):
+        exporter = InMemorySpanExporter()
+        app = create_app(strategy=RoundRobinStrategy(), machine_management_client=Mock(),
+                         linter_client=self.linter_client, tracer=Tracer("load_balancer", exporter))
+        client = TestClient(app)
+        client.post("/update_routing_table/", json=self.routing_table(epoch=1))
+
+        response = client.post("/lint_code/", json={"linter_name": "name1", "code": "abcd"},
+                               headers={"X-Trace-Id": "trace1"})
+        self.assertEqual(response.headers["X-Trace-Id"], "trace1")
+        send_span, span = exporter.spans
+        self.assertEqual(span["trace_id"], "trace1")
+        self.assertEqual(span["attributes"], {"linter": "name1", "version": "v1", "cache_hit": False,
+                                              "coalesced": False, "instance": "hp1"})
+        # the request to the linter has its own span, coalesced lints share it
+        self.assertEqual((send_span["name"], send_span["parent_id"]), ("load_balancer.send_lint", span["span_id"]))
+        self.assertEqual(self.linter_client.lint_code.call_args.kwargs["trace_context"],
+                         ("trace1", send_span["span_id"]))
+
+        # not sampled
+        response = client.post("/lint_code/", json={"linter_name": "name1", "code": "efgh"})
+        self.assertNotIn("X-Trace-Id", response.headers)
+        self.assertEqual(len(exporter.spans), 2)
+
+
+class LintResultCacheTester(unittest.TestCase):
+    def test_least_recently_used_evicted(self):
+        key1, key2, key3 = [LintResultCache.make_key("name", "v1", code) for code in ["a", "b", "c"]]
+        cache = LintResultCache(max_bytes=2 * (LintResultCache.ENTRY_OVERHEAD_BYTES + 100))
+        cache.put(key1, (0, "ok"))
+        cache.put(key2, (0, "ok"))
+        cache.get(key1)
+        cache.put(key3, (0, "ok"))
+
+        self.assertEqual(cache.get(key1), (0, "ok"))
+        self.assertIsNone(cache.get(key2))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expired(self):
+        key = LintResultCache.make_key("name", "v1", "a")
+        cache = LintResultCache(ttl=-1)
+        cache.put(key, (0, "ok"))
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+
+class LintSessionTester(unittest.TestCase):
+    def test_edits_from_unified_diff(self):
+        old = ["a", "b", "c", "d", "e", "f", "g", "h"]
+        new = ["x", "a", "c", "d", "", "e", "f", "g", "h", "i"]
+        for n_context_lines in [0, 1, 3]:
+            lines = list(old)
+            diff = "\n".join(difflib.unified_diff(old, new, n=n_context_lines, lineterm=""))
+            apply_edits(lines, edits_from_unified_diff(diff))
+            self.assertEqual(lines, new)
+
+    def test_idle_sessions_evicted(self):
+        store = LintSessionStore(idle_timeout=0.05)
+        session = store.start("name", "v1", "a")
+        time.sleep(0.1)
+        self.assertIsNone(store.get(session.session_id))
+        self.assertEqual(store.stats()["evicted"], 1)
+
+
+class RoutingTableTester(unittest.TestCase):
+    def test_versions(self):
+        routing_table = load_balancer.RoutingTable()
+        routing_table.update(1, {"aaa": "v1"}, [{"name": "aaa", "version": "v1", "hostport": "hp1"},
+                                                {"name": "aaa", "version": "v2", "hostport": "hp2"},
+                                                {"name": "aaa", "version": "v1", "hostport": "hp3"}])
+        self.assertEqual(routing_table.get_linters_with_curr_version("aaa"), ("hp1", "hp3"))
+        self.assertEqual(routing_table.get_linter_instances("aaa", "v2"), ("hp2",))
+        self.assertEqual(routing_table.get_linters_with_curr_version("bbb"), ())
+
+    def test_refresh_when_stale(self):
+        machine_management_client = Mock()
+        machine_management_client.get_routing_table = AsyncMock(return_value={
+            "epoch": 1, "curr_versions": {"aaa": "v1"},
+            "instances": [{"name": "aaa", "version": "v1", "hostport": "hp1"}]})
+        balancer = load_balancer.LoadBalancer(RoundRobinStrategy(), machine_management_client, Mock(),
+                                              routing_table_max_staleness=60)
+
+        asyncio.run(balancer.refresh_routing_table_if_stale())
+        asyncio.run(balancer.refresh_routing_table_if_stale())
+
+        machine_management_client.get_routing_table.assert_called_once_with()
+        self.assertEqual(balancer.choose_linter("aaa"), "hp1")
+
 
 if __name__ == '__main__':
     unittest.main()
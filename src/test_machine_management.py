@@ -1,9 +1,62 @@
-from unittest.mock import Mock
+import errno
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter
+from unittest.mock import Mock, patch
 
 import pytest
 from fastapi.testclient import TestClient
 
+import container_manager as container_manager_module
+from container_manager import ContainerManager, LocalProcessContainerManager, PortAllocator, SSHContainerManager, \
+    is_port_free, parse_listening_ports, wait_until_serving
+from linter_client import LinterClient
 from machine_management_app import create_app
+from machine_manager import LinterRegistry, MachineManager, RunningLinter, StartLintersRequest
+
+
+class FakeContainerManager(ContainerManager):
+    start_delay = 0.2
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.next_port = 12301
+        self.lock = threading.Lock()
+        # ports of linters which stopped answering
+        self.dead_ports = set()
+        self.stopped = []
+
+    def start_container(self, docker_image):
+        time.sleep(self.start_delay)
+        with self.lock:
+            port = self.next_port
+            self.next_port += 1
+        return port, str(uuid.uuid4())
+
+    def stop_container(self, container_name):
+        self.stopped.append(container_name)
+
+    def is_serving(self, port):
+        return port not in self.dead_ports
+
+
+# Runs no commands, docker run fails with the given errors before it succeeds
+class FakeSSHContainerManager(SSHContainerManager):
+    def __init__(self, docker_run_errors=(), serving=True, **kwargs):
+        self.commands = []
+        self.docker_run_errors = list(docker_run_errors)
+        super().__init__("machine1", multiplex=False, **kwargs)
+        self.linter_client = Mock()
+        self.linter_client.check_health.return_value = serving
+
+    def _ssh(self, command, capture_output=False) -> subprocess.CompletedProcess:
+        self.commands.append(command)
+        if command.startswith("docker run") and self.docker_run_errors:
+            return subprocess.CompletedProcess(command, 1, stdout="", stderr=self.docker_run_errors.pop(0))
+        return subprocess.CompletedProcess(command, 0, stdout="", stderr="")
 
 
 @pytest.fixture
@@ -20,6 +73,26 @@ def fresh_client(fresh_app):
     return TestClient(fresh_app)
 
 
+@pytest.fixture
+def fake_machines_client(example_linter_registration):
+    load_balancer_client = Mock()
+    client = TestClient(create_app(load_balancer_client=load_balancer_client,
+                                   container_manager_factory=FakeContainerManager,
+                                   max_parallel_starts_per_machine=4))
+    client.post("/add_machine/", json={"host": "machine1"})
+    client.post("/add_machine/", json={"host": "machine2"})
+    client.post("/register_linter/", json=example_linter_registration)
+    return client
+
+
+def wait_for_operation(client, operation, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not operation["done"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+        operation = client.get(f"/start_linters/{operation['operation_id']}").json()
+    return operation
+
+
 @pytest.fixture
 def example_linter_registration():
     return {"linter_name": "python_foo",
@@ -64,3 +137,426 @@ def test_deregister_linter(fresh_client, example_linter_registration):
     requery_response = client.get("/list_registered_linters/")
     assert requery_response.status_code == 200
     assert requery_response.json() == []
+
+
+def test_routing_table(fresh_client):
+    response = fresh_client.get("/routing_table/")
+    assert response.status_code == 200
+    assert response.json()["curr_versions"] == {}
+    assert response.json()["instances"] == []
+
+
+def test_start_linters_in_parallel(fake_machines_client, example_linter_registration):
+    client = fake_machines_client
+    start = time.monotonic()
+    response = client.post("/start_linters/", json={"linter_name": example_linter_registration["linter_name"],
+                                                    "linter_version": example_linter_registration["linter_version"],
+                                                    "n_instances": 8})
+    assert response.status_code == 200
+    assert not response.json()["done"]
+
+    operation = wait_for_operation(client, response.json())
+    # one by one it would take 8 * 0.2 seconds
+    assert time.monotonic() - start < 1.2
+    assert operation["n_started"] == 8
+    assert operation["n_failed"] == 0
+
+    linters = client.get("/list_linters/").json()
+    assert Counter(linter["hostport"].split(":")[0] for linter in linters) == {"machine1": 4, "machine2": 4}
+
+
+def test_machine_not_deleted_while_starting(fake_machines_client, example_linter_registration):
+    client = fake_machines_client
+    response = client.post("/start_linters/", json={"linter_name": example_linter_registration["linter_name"],
+                                                    "linter_version": example_linter_registration["linter_version"],
+                                                    "n_instances": 2})
+    assert client.post("/delete_machine/", params={"host": "machine1"}).status_code == 409
+
+    operation = wait_for_operation(client, response.json())
+    assert operation["n_started"] == 2
+    # a linter runs there
+    assert client.post("/delete_machine/", params={"host": "machine1"}).status_code == 409
+
+    client.post("/remove_linter/", params={"linter_name": example_linter_registration["linter_name"],
+                                           "linter_version": example_linter_registration["linter_version"]})
+    assert client.post("/delete_machine/", params={"host": "machine1"}).status_code == 200
+    assert client.get("/list_machines/").json() == ["machine2"]
+
+
+def test_machine_not_deleted_while_draining(example_linter_registration):
+    manager = MachineManager(FakeContainerManager, Mock())
+    manager.add_machine("machine1")
+    manager.register_linter(**example_linter_registration)
+    linter = (example_linter_registration["linter_name"], example_linter_registration["linter_version"])
+    manager.start_linter_instance(*linter, "machine1")
+
+    manager.stop_linter_instances(*linter, 1, drain_seconds=0.2)
+    assert manager.list_linters() == []
+    with pytest.raises(ValueError):
+        manager.delete_machine("machine1")
+    time.sleep(0.5)
+    assert len(manager.container_managers["machine1"].stopped) == 1
+    manager.delete_machine("machine1")
+    assert manager.list_machines() == []
+
+
+def test_routing_table_answered_while_publishing(example_linter_registration):
+    load_balancer_client = Mock()
+    with TestClient(create_app(load_balancer_client=load_balancer_client,
+                               container_manager_factory=FakeContainerManager)) as client:
+        client.post("/add_machine/", json={"host": "machine1"})
+        client.post("/register_linter/", json=example_linter_registration)
+        container_name, _ = client.post("/unsafe_start_linter/", params={
+            "linter_name": example_linter_registration["linter_name"],
+            "linter_version": example_linter_registration["linter_version"], "host": "machine1"}).json()
+
+        # load balancer doesn't answer
+        publishing, release = threading.Event(), threading.Event()
+        load_balancer_client.update_routing_table.side_effect = lambda _: publishing.set() or release.wait(5)
+        stop = threading.Thread(target=client.post, args=("/unsafe_stop_linter/",),
+                                kwargs={"params": {"machine": "machine1", "container_name": container_name}})
+        stop.start()
+        assert publishing.wait(5)
+        start_time = time.monotonic()
+        assert client.get("/routing_table/").json()["instances"] == []
+        assert time.monotonic() - start_time < 1
+        release.set()
+        stop.join()
+
+
+def test_start_linters_failure_reported(fake_machines_client):
+    response = fake_machines_client.post("/start_linters/", json={"linter_name": "unregistered",
+                                                                  "linter_version": "v0", "n_instances": 2})
+    operation = wait_for_operation(fake_machines_client, response.json())
+    assert operation["n_failed"] == 2
+    assert len(operation["errors"]) == 2
+
+
+def test_unknown_operation(fresh_client):
+    assert fresh_client.get("/start_linters/unknown").status_code == 404
+
+
+def test_cold_start_times(fake_machines_client, example_linter_registration):
+    response = fake_machines_client.post("/start_linters/",
+                                         json={"linter_name": example_linter_registration["linter_name"],
+                                               "linter_version": example_linter_registration["linter_version"],
+                                               "n_instances": 2})
+    wait_for_operation(fake_machines_client, response.json())
+
+    cold_start_times = fake_machines_client.get("/cold_start_times/").json()
+    assert len(cold_start_times) == 1
+    assert cold_start_times[0]["docker_image"] == example_linter_registration["docker_image"]
+    assert cold_start_times[0]["n_starts"] == 2
+    assert FakeContainerManager.start_delay <= cold_start_times[0]["mean"] <= cold_start_times[0]["max"]
+
+
+def test_linter_registry():
+    registry = LinterRegistry()
+    linters = [RunningLinter(machine=f"machine{i % 2}", container_name=f"container{i}", linter_name="spaces",
+                             linter_version=f"v{i % 3}", exposed_port=12301 + i) for i in range(6)]
+    for linter in linters:
+        registry.add(linter)
+
+    assert len(registry) == 6
+    assert registry.host_ports("spaces", "v0") == ["machine0:12301", "machine1:12304"]
+    assert registry.at_host_port("machine1:12302") == [linters[1]]
+    assert registry.on_machine("machine0") == [linters[0], linters[2], linters[4]]
+
+    assert registry.remove("machine1", "container0") == []
+    assert registry.remove("machine0", "container0") == [linters[0]]
+    assert registry.host_ports("spaces", "v0") == ["machine1:12304"]
+    assert registry.at_host_port("machine0:12301") == []
+    assert len(registry.endpoints()) == 5
+    assert registry.with_name_version("spaces", "v7") == []
+
+
+def test_port_allocator():
+    allocator = PortAllocator(100, 103)
+    allocator.set_external_ports([101, 5000])
+    assert [allocator.allocate(), allocator.allocate()] == [100, 102]
+
+    allocator.release(100)
+    allocator.add_external_port(103)
+    assert allocator.allocate() == 100
+    with pytest.raises(RuntimeError):
+        allocator.allocate()
+
+    # 101 is not bound anymore
+    allocator.set_external_ports([103])
+    assert allocator.allocate() == 101
+
+
+def test_parse_listening_ports():
+    ss_output = ("LISTEN 0      4096         0.0.0.0:12301      0.0.0.0:*\n"
+                 "LISTEN 0      128             [::]:22            [::]:*\n"
+                 "LISTEN 0      4096      127.0.0.53%lo:53         0.0.0.0:*\n")
+    assert parse_listening_ports(ss_output) == [12301, 22, 53]
+
+
+@pytest.mark.parametrize("multiplex", [True, False])
+def test_ssh_options(multiplex):
+    with patch("container_manager.subprocess.run",
+               return_value=subprocess.CompletedProcess([], 0, stdout="", stderr="")) as run:
+        container_manager = SSHContainerManager("user@machine1", multiplex=multiplex, control_persist=60)
+        container_manager.close()
+
+    commands = [call.args[0] for call in run.call_args_list]
+    # docker ps and ss on the machine, then closing the shared connection
+    assert [command[-1] for command in commands[:2]] == ["docker ps", "ss -Htln"]
+    if multiplex:
+        options = commands[0][1:-2]
+        assert options[::2] == ["-o", "-o", "-o"]
+        assert options[1] == "ControlMaster=auto" and options[5] == "ControlPersist=60"
+        assert options[3].startswith("ControlPath=") and "%C" in options[3]
+        assert all(command[1:-2] == options for command in commands[:2])
+        assert commands[2] == ["ssh", *options, "-O", "exit", "user@machine1"]
+    else:
+        assert [command[:2] for command in commands] == [["ssh", "user@machine1"]] * 2
+
+
+def test_ssh_container_not_ready_stopped():
+    container_manager = FakeSSHContainerManager(serving=False, readiness_timeout=0.1, readiness_poll_interval=0.01,
+                                                first_port=12301, last_port=12301)
+    with pytest.raises(TimeoutError):
+        container_manager.start_container("foo.bar:baz")
+
+    container_name = container_manager.commands[-2].split()[5]
+    assert container_manager.commands[-1] == f"docker stop {container_name}"
+    # the port is free again
+    assert container_manager.occupied_ports == {}
+    assert container_manager.port_allocator.allocate() == 12301
+
+
+def test_ssh_container_port_conflict_retried():
+    container_manager = FakeSSHContainerManager(docker_run_errors=["Bind for 0.0.0.0:12301 failed: port is already "
+                                                                   "allocated"],
+                                                first_port=12301, last_port=12303)
+    port, container_name = container_manager.start_container("foo.bar:baz")
+
+    docker_runs = [command for command in container_manager.commands if command.startswith("docker run")]
+    assert [command.split()[7] for command in docker_runs] == ["12301:50051", "12302:50051"]
+    assert f"docker rm --force {container_name}" in container_manager.commands
+    assert port == 12302
+    assert container_manager.occupied_ports == {container_name: 12302}
+    # the taken port is skipped until ss stops listing it
+    assert container_manager.port_allocator.allocate() == 12303
+
+    container_manager = FakeSSHContainerManager(docker_run_errors=["port is already allocated"] * 2,
+                                                first_port=12301, last_port=12303)
+    container_manager.MAX_PORT_CONFLICTS = 1
+    with pytest.raises(RuntimeError):
+        container_manager.start_container("foo.bar:baz")
+    assert container_manager.occupied_ports == {}
+
+    container_manager = FakeSSHContainerManager(docker_run_errors=["no such image"])
+    with pytest.raises(RuntimeError):
+        container_manager.start_container("foo.bar:baz")
+    assert len([command for command in container_manager.commands if command.startswith("docker run")]) == 1
+
+
+def test_local_process_container_manager():
+    container_manager = LocalProcessContainerManager("localhost", supervision_interval=0.1)
+    port, container_name = container_manager.start_container("ghcr.io/chedatomasz/no_semicolons:v1")
+    host_port = f"localhost:{port}"
+    linter_client = LinterClient()
+    try:
+        assert linter_client.lint_code(host_port, "x = 1;")[0] == 1
+
+        # the supervisor starts the process again on the same port
+        linter_process = container_manager.processes[container_name]
+        linter_process.process.kill()
+        linter_process.process.wait()
+        assert wait_until_serving(linter_client, host_port, timeout=30, poll_interval=0.05)
+        assert linter_process.n_restarts == 1
+        assert linter_client.lint_code(host_port, "x = 1")[0] == 0
+    finally:
+        container_manager.stop_container(container_name)
+        container_manager.close()
+    assert not linter_process.is_running()
+
+
+def test_is_port_free_without_ipv6():
+    # socket.socket is patched in the module, which is the same for the test
+    socket_class = socket.socket
+
+    def ipv4_socket(family=socket.AF_INET, *args):
+        if family == socket.AF_INET6:
+            raise OSError(errno.EAFNOSUPPORT, "Address family not supported by protocol")
+        return socket_class(family, *args)
+
+    with socket.socket() as sock:
+        sock.bind(("0.0.0.0", 0))
+        taken_port = sock.getsockname()[1]
+        with patch("container_manager.socket.socket", ipv4_socket):
+            assert not is_port_free(taken_port)
+            sock.close()
+            assert is_port_free(taken_port)
+
+
+def test_local_process_port_taken_after_check():
+    with socket.socket(socket.AF_INET6) as sock:
+        sock.bind(("::", 0))
+        taken_port = sock.getsockname()[1]
+        container_manager = LocalProcessContainerManager("localhost", first_port=taken_port,
+                                                         last_port=taken_port + 20)
+        # the port looks free when checked, and is bound by the time the linter server binds it
+        checked_ports = set()
+
+        def free_at_first_check(port):
+            if port == taken_port and port not in checked_ports:
+                checked_ports.add(port)
+                return True
+            return is_port_free(port)
+
+        with patch.object(container_manager_module, "is_port_free", free_at_first_check):
+            port, container_name = container_manager.start_container("ghcr.io/chedatomasz/no_semicolons:v1")
+    try:
+        assert port != taken_port
+        assert taken_port in container_manager.port_allocator.external_ports
+    finally:
+        container_manager.stop_container(container_name)
+        container_manager.close()
+
+
+def wait_for_warm_pool(client, n_ready, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        warm_pools = client.get("/warm_pool/").json()
+        if warm_pools and warm_pools[0]["n_ready"] == n_ready and warm_pools[0]["n_starting"] == 0:
+            return warm_pools[0]
+        time.sleep(0.05)
+    raise TimeoutError("Warm pool not filled")
+
+
+def test_start_linters_from_warm_pool(fake_machines_client, example_linter_registration):
+    client = fake_machines_client
+    linter = {"linter_name": example_linter_registration["linter_name"],
+              "linter_version": example_linter_registration["linter_version"]}
+    assert client.post("/warm_pool/", json={**linter, "size": 2}).status_code == 200
+    wait_for_warm_pool(client, n_ready=2)
+    assert client.get("/list_linters/").json() == []
+
+    response = client.post("/start_linters/", json={**linter, "n_instances": 3})
+    operation = response.json()
+    assert operation["n_from_warm_pool"] == 2
+    assert len(client.get("/list_linters/").json()) == 2
+
+    operation = wait_for_operation(client, operation)
+    assert operation["n_started"] == 3
+    assert len(client.get("/list_linters/").json()) == 3
+    wait_for_warm_pool(client, n_ready=2)
+
+    assert client.post("/warm_pool/", json={**linter, "size": 0}).status_code == 200
+    assert client.get("/warm_pool/").json()[0]["n_ready"] == 0
+    response = client.post("/warm_pool/", json={"linter_name": "unknown", "linter_version": "v0", "size": 1})
+    assert response.status_code == 404
+
+
+def wait_for_manager_warm_pool(manager, n_ready, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        warm_pool = manager.get_warm_pools()[0]
+        if warm_pool.n_ready == n_ready and warm_pool.n_starting == 0:
+            return
+        time.sleep(0.05)
+    raise TimeoutError("Warm pool not filled")
+
+
+def test_dead_warm_pool_container_not_taken(example_linter_registration):
+    manager = MachineManager(FakeContainerManager, Mock(), warm_pool_size=2)
+    manager.add_machine("machine1")
+    manager.register_linter(**example_linter_registration)
+    linter = (example_linter_registration["linter_name"], example_linter_registration["linter_version"])
+    wait_for_manager_warm_pool(manager, n_ready=2)
+    dead = manager.warm_pools[linter][0]
+    container_manager = manager.container_managers["machine1"]
+    container_manager.dead_ports.add(dead.exposed_port)
+
+    operation = manager.start_linters(StartLintersRequest(linter_name=linter[0], linter_version=linter[1],
+                                                          n_instances=2))
+    assert operation.n_from_warm_pool == 1
+    deadline = time.monotonic() + 5
+    while not manager.get_start_operation(operation.operation_id).done and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert dead.get_host_port() not in manager.list_linters_instances(*linter)
+    assert len(manager.list_linters_instances(*linter)) == 2
+    assert container_manager.stopped == [dead.container_name]
+    wait_for_manager_warm_pool(manager, n_ready=2)
+    assert manager.machine_to_n_linters["machine1"] == 4
+
+
+def test_warm_pool_drained_on_machine_deletion(example_linter_registration):
+    manager = MachineManager(FakeContainerManager, Mock(), warm_pool_size=2)
+    manager.add_machine("machine1")
+    manager.add_machine("machine2")
+    manager.register_linter(**example_linter_registration)
+    linter = (example_linter_registration["linter_name"], example_linter_registration["linter_version"])
+    wait_for_manager_warm_pool(manager, n_ready=2)
+    pooled_on_machine1 = [linter_instance.container_name for linter_instance in manager.warm_pools[linter]
+                          if linter_instance.machine == "machine1"]
+    assert len(pooled_on_machine1) == 1
+    container_manager = manager.container_managers["machine1"]
+
+    manager.delete_machine("machine1")
+    assert container_manager.stopped == pooled_on_machine1
+    wait_for_manager_warm_pool(manager, n_ready=2)
+    assert {linter_instance.machine for linter_instance in manager.warm_pools[linter]} == {"machine2"}
+
+
+def test_linters_share_containers_of_same_image(fake_machines_client, example_linter_registration):
+    client = fake_machines_client
+    other_linter = {"linter_name": "python_bar", "linter_version": "v0.0.1"}
+    client.post("/register_linter/", json={**other_linter, "docker_image": example_linter_registration["docker_image"]})
+    linter = {"linter_name": example_linter_registration["linter_name"],
+              "linter_version": example_linter_registration["linter_version"]}
+    wait_for_operation(client, client.post("/start_linters/", json={**linter, "n_instances": 2}).json())
+
+    operation = client.post("/start_linters/", json={**other_linter, "n_instances": 3}).json()
+    assert operation["n_from_shared_containers"] == 2
+    operation = wait_for_operation(client, operation)
+    assert operation["n_started"] == 3
+    host_ports = client.get("/list_linter_instances/", params=linter).json()
+    other_host_ports = client.get("/list_linter_instances/", params=other_linter).json()
+    assert set(host_ports) < set(other_host_ports)
+
+    # containers stay while they serve another linter
+    client.post("/remove_linter/", params=linter)
+    assert client.get("/list_linter_instances/", params=other_linter).json() == other_host_ports
+    assert 'machine_linters{machine="machine1"} 2' in client.get("/metrics").text.splitlines()
+
+
+def test_overlapping_reports_of_broken_linters(example_linter_registration):
+    manager = MachineManager(FakeContainerManager, Mock())
+    manager.add_machine("machine1")
+    manager.register_linter(**example_linter_registration)
+    linter = (example_linter_registration["linter_name"], example_linter_registration["linter_version"])
+    for _ in range(2):
+        manager.start_linter_instance(*linter, "machine1")
+    host_port1, host_port2 = manager.list_linters_instances(*linter)
+    linters_at_host_port1 = manager.registry.at_host_port(host_port1)
+
+    manager.restart_broken_linters([host_port1])
+    # the second report looked up the linter before the first one stopped it, its other linter is restarted
+    at_host_port = manager.registry.at_host_port
+    with patch.object(manager.registry, "at_host_port",
+                      lambda host_port: linters_at_host_port1 if host_port == host_port1 else at_host_port(host_port)):
+        manager.restart_broken_linters([host_port1, host_port2])
+
+    host_ports = manager.list_linters_instances(*linter)
+    assert len(host_ports) == 2
+    assert host_port1 not in host_ports and host_port2 not in host_ports
+    assert manager.machine_to_n_linters["machine1"] == 2
+
+
+def test_metrics(fake_machines_client, example_linter_registration):
+    response = fake_machines_client.post("/start_linters/",
+                                         json={"linter_name": example_linter_registration["linter_name"],
+                                               "linter_version": example_linter_registration["linter_version"],
+                                               "n_instances": 2})
+    wait_for_operation(fake_machines_client, response.json())
+
+    lines = fake_machines_client.get("/metrics").text.splitlines()
+    linter = (f'linter="{example_linter_registration["linter_name"]}",'
+              f'version="{example_linter_registration["linter_version"]}"')
+    assert f"linter_instances{{{linter}}} 2" in lines
+    assert f'container_start_duration_seconds_count{{{linter},machine="machine1"}} 1' in lines
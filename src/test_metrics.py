@@ -0,0 +1,52 @@
+import unittest
+
+from metrics import MetricsRegistry
+
+
+class MetricsRegistryTester(unittest.TestCase):
+    def test_counter_and_gauge(self):
+        registry = MetricsRegistry()
+        requests = registry.counter("requests_total", "Requests", ["linter"])
+        in_flight = registry.gauge("in_flight", "In flight")
+        requests.labels("spaces").inc()
+        requests.labels("spaces").inc(2)
+        requests.labels('say "hi"').inc()
+        in_flight.set(1.5)
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE requests_total counter", lines)
+        self.assertIn('requests_total{linter="spaces"} 3', lines)
+        self.assertIn('requests_total{linter="say \\"hi\\""} 1', lines)
+        self.assertIn("in_flight 1.5", lines)
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram("latency_seconds", "Latency", ["instance"], buckets=[0.1, 1])
+        latency.labels("hp1").observe(0.05)
+        latency.labels("hp1").observe(0.5, count=2)
+        latency.labels("hp1").observe(5)
+
+        lines = registry.render().splitlines()
+        self.assertIn('latency_seconds_bucket{instance="hp1",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{instance="hp1",le="1"} 3', lines)
+        self.assertIn('latency_seconds_bucket{instance="hp1",le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_sum{instance="hp1"} 6.05', lines)
+        self.assertIn('latency_seconds_count{instance="hp1"} 4', lines)
+
+    def test_retain_and_collectors(self):
+        registry = MetricsRegistry()
+        failures = registry.counter("failures_total", "Failures", ["instance"])
+        cache_hits = registry.counter("cache_hits_total", "Cache hits")
+        registry.add_collector(lambda: cache_hits.labels().set(7))
+        failures.labels("hp1").inc()
+        failures.labels("hp2").inc()
+        failures.retain("instance", ["hp2"])
+
+        rendered = registry.render()
+        self.assertNotIn("hp1", rendered)
+        self.assertIn('failures_total{instance="hp2"} 1', rendered)
+        self.assertIn("cache_hits_total 7", rendered)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import concurrent
+import time
 from concurrent.futures import ThreadPoolExecutor
 
 import requests
@@ -27,10 +28,16 @@ class TestingUtils:
         add_linter_request = {"linter_name": name, "linter_version": version, "docker_image": docker_image}
         return requests.post(f"{cls.machine_management_addr}/register_linter/", json=add_linter_request)
 
+    # waits until all instances are started, returns the last response with operation progress
     @classmethod
     def start_linters(cls, name, version, n_instances=1):
         start_linters_request = {"linter_name": name, "linter_version": version, "n_instances": n_instances}
-        return requests.post(f"{cls.machine_management_addr}/start_linters/", json=start_linters_request)
+        response = requests.post(f"{cls.machine_management_addr}/start_linters/", json=start_linters_request)
+        while response.status_code == 200 and not response.json()["done"]:
+            time.sleep(0.5)
+            operation_id = response.json()["operation_id"]
+            response = requests.get(f"{cls.machine_management_addr}/start_linters/{operation_id}")
+        return response
 
     @classmethod
     def lint_code(cls, linter_name, code):
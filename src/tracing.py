@@ -0,0 +1,141 @@
+import json
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+# Timed spans of a lint request, from load balancer through linter client to the linter server.
+# The trace id comes with the HTTP request in the X-Trace-Id header or is drawn by load balancer for a sampled
+# fraction of requests, and goes to linters in gRPC metadata together with the id of the parent span.
+# Only sampled requests carry a trace id, everything else gets spans which record nothing.
+# This file is kept identical in src and src/linter, like linter.proto.
+
+# HTTP header and gRPC metadata keys, gRPC requires lowercase
+TRACE_ID_KEY = "x-trace-id"
+PARENT_SPAN_ID_KEY = "x-parent-span-id"
+
+# (trace id, id of the parent span)
+TraceContext = Tuple[str, str]
+
+
+class SpanExporter(ABC):
+    @abstractmethod
+    def export(self, span: dict):
+        raise NotImplementedError
+
+
+# Appends every span as a JSON line to a local file
+class JsonlSpanExporter(SpanExporter):
+    def __init__(self, path: str):
+        self.file = open(path, "a", buffering=1)
+        self.lock = threading.Lock()
+
+    def export(self, span: dict):
+        line = json.dumps(span) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+
+class InMemorySpanExporter(SpanExporter):
+    def __init__(self):
+        self.spans: List[dict] = []
+
+    def export(self, span: dict):
+        self.spans.append(span)
+
+
+class Span:
+    def __init__(self, exporter: SpanExporter, service: str, name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: dict):
+        self.exporter = exporter
+        self.service = service
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.start_perf_counter = time.perf_counter()
+
+    # context for child spans, also in other processes
+    def context(self) -> Optional[TraceContext]:
+        return self.trace_id, self.span_id
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.exporter.export({"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                              "service": self.service, "name": self.name, "start": self.start,
+                              "duration": time.perf_counter() - self.start_perf_counter,
+                              "attributes": self.attributes})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.set_attribute("error", repr(exc_value))
+        self.end()
+
+
+# Span of a request which is not traced
+class NullSpan:
+    def context(self) -> Optional[TraceContext]:
+        return None
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    def __init__(self, service: str, exporter: SpanExporter = None, sample_rate: float = 0.0):
+        self.service = service
+        # without an exporter nothing is traced
+        self.exporter = exporter
+        # fraction of requests without a trace id which start a new trace
+        self.sample_rate = sample_rate
+
+    # trace id of a new request, None if the request is not sampled
+    def sample(self, trace_id: str = None) -> Optional[str]:
+        if trace_id is not None:
+            return trace_id
+        if self.exporter is not None and random.random() < self.sample_rate:
+            return uuid.uuid4().hex
+        return None
+
+    def start_span(self, name: str, trace_context: Optional[TraceContext], **attributes):
+        if self.exporter is None or trace_context is None:
+            return NULL_SPAN
+        trace_id, parent_id = trace_context
+        return Span(self.exporter, self.service, name, trace_id, parent_id, attributes)
+
+    # trace context sent in gRPC metadata
+    @staticmethod
+    def to_metadata(trace_context: Optional[TraceContext]) -> Optional[List[Tuple[str, str]]]:
+        if trace_context is None:
+            return None
+        trace_id, parent_id = trace_context
+        return [(TRACE_ID_KEY, trace_id), (PARENT_SPAN_ID_KEY, parent_id or "")]
+
+    @staticmethod
+    def from_metadata(metadata) -> Optional[TraceContext]:
+        metadata = dict(metadata or ())
+        trace_id = metadata.get(TRACE_ID_KEY)
+        if trace_id is None:
+            return None
+        return trace_id, metadata.get(PARENT_SPAN_ID_KEY) or None